@@ -6,6 +6,9 @@ import {
   ChatCallResponse,
   ChatModelsResponse,
   ChatSession,
+  ChatSessionHistory,
+  ChatSessionRefs,
+  ChatSessionTitle,
   ApiResponse
 } from './types';
 
@@ -27,7 +30,8 @@ export class ChatAPI {
       request,
       onChunk,
       onError,
-      onComplete
+      onComplete,
+      '/chat/resume'
     );
   }
 
@@ -70,6 +74,34 @@ export class ChatAPI {
     return response.data;
   }
 
+  /**
+   * 分页获取指定会话的历史消息
+   */
+  static async getSessionHistory(threadId: string, offset = 0, limit = 50): Promise<ChatSessionHistory> {
+    const response = await api.get<ChatSessionHistory>(`/chat/sessions/${threadId}/history`, {
+      params: { offset, limit }
+    });
+    return response.data;
+  }
+
+  /**
+   * 分页获取指定会话的检索引用，传入 turnId 时只获取该轮回答的引用
+   */
+  static async getSessionRefs(threadId: string, params: { offset?: number; limit?: number; turnId?: string } = {}): Promise<ChatSessionRefs> {
+    const response = await api.get<ChatSessionRefs>(`/chat/sessions/${threadId}/refs`, {
+      params: { offset: params.offset, limit: params.limit, turn_id: params.turnId }
+    });
+    return response.data;
+  }
+
+  /**
+   * 获取指定会话的标题（后台生成）
+   */
+  static async getSessionTitle(threadId: string): Promise<ChatSessionTitle> {
+    const response = await api.get<ChatSessionTitle>(`/chat/sessions/${threadId}/title`);
+    return response.data;
+  }
+
   /**
    * 删除指定会话
    */
@@ -76,26 +76,43 @@ export const createStreamRequest = async (
   data: any,
   onChunk: (chunk: any) => void,
   onError: (error: Error) => void,
-  onComplete: () => void
+  onComplete: () => void,
+  resumeUrl?: string  // 可续传流的重连地址，读取中断时携带 Last-Event-ID 重连
 ) => {
-  try {
-    console.log('发送流式请求:', { url, data });
+  const maxResumeAttempts = 3;
+  let lastEventId: string | null = null;
+  let resumeAttempts = 0;
 
-    const response = await fetch(`${api.defaults.baseURL}${url}`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      credentials: 'include',
-      body: JSON.stringify(data)
-    });
+  // 逐行解析SSE数据，记录事件ID用于断线重连
+  const handleLine = (line: string) => {
+    if (!line.trim()) return;
 
-    console.log('流式响应状态:', response.status, response.statusText);
+    if (line.startsWith('id: ')) {
+      lastEventId = line.substring(4);
+      return;
+    }
 
-    if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`);
+    // 处理SSE格式：data: {json}
+    if (line.startsWith('data: ')) {
+      const jsonStr = line.substring(6); // 移除 "data: " 前缀
+      try {
+        const data = JSON.parse(jsonStr);
+        onChunk(data);
+      } catch (error) {
+        console.error('解析SSE数据失败:', error, 'Line:', line);
+      }
+    } else {
+      // 兼容处理：如果不是SSE格式，尝试直接解析JSON
+      try {
+        const data = JSON.parse(line);
+        onChunk(data);
+      } catch (error) {
+        console.error('解析流式数据失败:', error, 'Line:', line);
+      }
     }
+  };
 
+  const readStream = async (response: Response) => {
     const reader = response.body?.getReader();
     const decoder = new TextDecoder();
     let buffer = '';
@@ -107,27 +124,47 @@ export const createStreamRequest = async (
       buffer += decoder.decode(value, { stream: true });
       const lines = buffer.split('\n');
       buffer = lines.pop() || '';
+      lines.forEach(handleLine);
+    }
+  };
+
+  try {
+    console.log('发送流式请求:', { url, data });
 
-      for (const line of lines) {
-        if (!line.trim()) continue;
-
-        // 处理SSE格式：data: {json}
-        if (line.startsWith('data: ')) {
-          const jsonStr = line.substring(6); // 移除 "data: " 前缀
-          try {
-            const data = JSON.parse(jsonStr);
-            onChunk(data);
-          } catch (error) {
-            console.error('解析SSE数据失败:', error, 'Line:', line);
-          }
-        } else {
-          // 兼容处理：如果不是SSE格式，尝试直接解析JSON
-          try {
-            const data = JSON.parse(line);
-            onChunk(data);
-          } catch (error) {
-            console.error('解析流式数据失败:', error, 'Line:', line);
-          }
+    let response = await fetch(`${api.defaults.baseURL}${url}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      credentials: 'include',
+      body: JSON.stringify(data)
+    });
+
+    console.log('流式响应状态:', response.status, response.statusText);
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    while (true) {
+      try {
+        await readStream(response);
+        break;
+      } catch (error) {
+        // 网络中断：携带最后收到的事件ID重连，补发缺失事件并继续接收
+        if (!resumeUrl || !lastEventId || resumeAttempts >= maxResumeAttempts) {
+          throw error;
+        }
+        resumeAttempts += 1;
+        console.warn(`流式连接中断，第${resumeAttempts}次重连:`, lastEventId);
+        await new Promise((resolve) => setTimeout(resolve, 500 * resumeAttempts));
+        response = await fetch(`${api.defaults.baseURL}${resumeUrl}`, {
+          method: 'GET',
+          headers: { 'Last-Event-ID': lastEventId },
+          credentials: 'include'
+        });
+        if (!response.ok) {
+          throw error;
         }
       }
     }
@@ -4,6 +4,9 @@ import {
   KnowledgeFile,
   CreateDatabaseRequest,
   UploadFileResponse,
+  MultipartUpload,
+  IngestJob,
+  IngestJobResponse,
   FileToChunkRequest,
   AddChunksRequest,
   QueryTestRequest,
@@ -12,6 +15,11 @@ import {
   ApiResponse
 } from './types';
 
+// 超过该大小的文件使用可续传的分片上传
+const MULTIPART_THRESHOLD = 32 * 1024 * 1024;
+const PART_MAX_RETRIES = 3;
+const JOB_POLL_INTERVAL = 1000;
+
 /**
  * 知识库API模块
  */
@@ -66,6 +74,10 @@ export class KnowledgeAPI {
    * 上传文件
    */
   static async uploadFile(dbId: string, file: File): Promise<UploadFileResponse> {
+    if (file.size > MULTIPART_THRESHOLD) {
+      return KnowledgeAPI.uploadFileMultipart(dbId, file);
+    }
+
     const formData = new FormData();
     formData.append('file', file);
 
@@ -78,6 +90,51 @@ export class KnowledgeAPI {
     return response.data;
   }
 
+  /**
+   * 分片上传大文件，中断后再次上传同一文件时只补传缺失的分片
+   */
+  static async uploadFileMultipart(dbId: string, file: File): Promise<UploadFileResponse> {
+    const resumeKey = `multipart:${dbId}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload: MultipartUpload | null = null;
+
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+      try {
+        upload = (await api.get<MultipartUpload>(`/data/upload/multipart/${savedId}`)).data;
+      } catch {
+        localStorage.removeItem(resumeKey);
+      }
+    }
+    if (!upload) {
+      upload = (await api.post<MultipartUpload>('/data/upload/multipart', {
+        filename: file.name,
+        total_size: file.size,
+        db_id: dbId
+      })).data;
+      localStorage.setItem(resumeKey, upload.upload_id);
+    }
+
+    const missing = upload.missing_parts ?? Array.from({ length: upload.total_parts }, (_, i) => i);
+    for (const index of missing) {
+      const part = file.slice(index * upload.part_size, (index + 1) * upload.part_size);
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await api.put(`/data/upload/multipart/${upload.upload_id}/${index}`, part, {
+            headers: { 'Content-Type': 'application/octet-stream' },
+            timeout: 0,
+          });
+          break;
+        } catch (error) {
+          if (attempt >= PART_MAX_RETRIES) throw error;
+        }
+      }
+    }
+
+    const response = await api.post<UploadFileResponse>(`/data/upload/multipart/${upload.upload_id}/complete`, {});
+    localStorage.removeItem(resumeKey);
+    return response.data;
+  }
+
   /**
    * 文件转分块
    */
@@ -87,24 +144,47 @@ export class KnowledgeAPI {
   }
 
   /**
-   * 通过文件添加到知识库
+   * 通过文件添加到知识库（不等待入库结束，立即返回任务ID）
    */
-  static async addByFile(dbId: string, files: string[]): Promise<ApiResponse> {
-    const response = await api.post<ApiResponse>('/data/add-by-file', {
+  static async addByFile(dbId: string, files: string[]): Promise<IngestJobResponse> {
+    const response = await api.post<IngestJobResponse>('/data/add-by-file', {
       db_id: dbId,
-      files
+      files,
+      wait: false
     });
     return response.data;
   }
 
   /**
-   * 通过分块添加到知识库
+   * 通过分块添加到知识库（不等待入库结束，立即返回任务ID）
    */
-  static async addByChunks(request: AddChunksRequest): Promise<ApiResponse> {
-    const response = await api.post<ApiResponse>('/data/add-by-chunks', request);
+  static async addByChunks(request: AddChunksRequest): Promise<IngestJobResponse> {
+    const response = await api.post<IngestJobResponse>('/data/add-by-chunks', { ...request, wait: false });
     return response.data;
   }
 
+  /**
+   * 获取入库任务进度
+   */
+  static async getIngestJob(jobId: string): Promise<IngestJob> {
+    const response = await api.get<IngestJob>(`/data/jobs/${jobId}`);
+    return response.data;
+  }
+
+  /**
+   * 轮询入库任务直到结束
+   */
+  static async waitForIngestJob(jobId: string, onProgress?: (job: IngestJob) => void): Promise<IngestJob> {
+    for (;;) {
+      const job = await KnowledgeAPI.getIngestJob(jobId);
+      onProgress?.(job);
+      if (job.status === 'completed' || job.status === 'cancelled') {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+  }
+
   /**
    * 删除文件
    */
@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from typing import List
 from rag.service.chat_service import ChatService
+from rag.utils.admission import AdmissionRejected, AdmissionTicket
+from rag.utils.disconnect import cancel_on_disconnect
+from rag.utils.metrics import metrics
+from rag.utils.sse_encoder import dumps
 
 # 创建路由
 chat = APIRouter(prefix="/chat")
 
 # 初始化聊天服务
 chat_service = ChatService()
+# 应用关闭时写出尚未回写Redis的会话历史（路由的事件处理器随 include_router 注册到应用）
+chat.add_event_handler("shutdown", chat_service.close)
 
 
 @chat.get("/")
@@ -15,8 +22,18 @@ async def chat_get():
     return "Chat Get!"
 
 
+async def admit(request: Request) -> AdmissionTicket:
+    """申请生成名额，公平性按可信的租户头或客户端地址区分（见 ChatService.admission_key）；超出容量时返回429"""
+    key = chat_service.admission_key(request.headers, request.client.host if request.client else None)
+    try:
+        return await chat_service.admission.acquire(key)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
 @chat.post("/")
 async def chat_post(
+        request: Request,
         query: str = Body(...),
         meta: dict = Body(None),
         history: List[dict] = Body(None),
@@ -30,29 +47,137 @@ async def chat_post(
             - db_id: 数据库ID
             - history_round: 历史对话轮数限制
             - system_prompt: 系统提示词（str，不含变量）
+            - stream_protocol: 流式协议，"delta" 表示推理内容只发送增量（reasoning_delta + seq），
+              finished 事件附带 reasoning_bytes 和 reasoning_sha256 用于校验；缺省时保持原有全量格式
+            - finished_format: finished 事件格式，"compact" 只返回 turn（本轮消息ID）、history_version 和
+              refs_digest，"full" 返回完整的 history 和 refs（旧版客户端）；缺省时使用 CHAT_FINISHED_FORMAT
+            - resumable: 可续传流，每个事件带 "id: {stream_id}:{seq}"，断线后用 GET /chat/resume
+              携带 Last-Event-ID 重连；缺省时使用 STREAM_RESUMABLE
         history: 对话历史记录列表
         thread_id: 对话线程ID
     Returns:
         StreamingResponse: 返回一个SSE流式响应
     """
+    ticket = await admit(request)
+
+    if chat_service.use_resumable(meta or {}):
+        # 生成在后台运行并写入环形缓冲区，客户端断开后仍保留一段时间等待重连；名额在生成结束时释放
+        owner = chat_service.admission_key(request.headers, request.client.host if request.client else None)
+        run = chat_service.resumable_streams.start(chat_service.process_chat_stream(query, meta, history, thread_id),
+                                                   on_done=ticket.release, owner=owner, thread_id=thread_id)
+        return StreamingResponse(
+            cancel_on_disconnect(chat_service.resumable_streams.subscribe(run),
+                                 request.is_disconnected, chat_service.disconnect_poll_interval),
+            media_type='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                'X-Accel-Buffering': 'no',
+                'X-Stream-ID': run.stream_id
+            }
+        )
+
     # 使用ChatService处理聊天请求，返回SSE格式的流式响应
+    # 客户端断开时取消检索和模型调用；流结束时释放名额，若流未被消费，由后台任务兜底释放
+    stream = cancel_on_disconnect(chat_service.process_chat_stream(query, meta, history, thread_id),
+                                  request.is_disconnected, chat_service.disconnect_poll_interval)
     return StreamingResponse(
-        chat_service.process_chat_stream(query, meta, history, thread_id),
+        chat_service.admitted_stream(ticket, stream),
         media_type='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
             'X-Accel-Buffering': 'no'  # 禁用nginx缓冲
+        },
+        background=BackgroundTask(ticket.release)
+    )
+
+@chat.get("/resume")
+async def chat_resume(request: Request, last_event_id: str = Header(None), event_id: str = None,
+                      thread_id: str = None):
+    """断线重连：补发 Last-Event-ID 之后的事件，并继续接收仍在进行的生成
+
+    只有发起该流的同一调用方（相同的准入 key）可以重连，其他调用方得到与流不存在相同的 404。
+
+    Args:
+        last_event_id: 请求头 Last-Event-ID，格式为 {stream_id}:{seq}
+        event_id: 同 Last-Event-ID，供无法设置请求头的客户端使用
+        thread_id: 对话线程ID（可选），传入时须与发起时的线程一致
+
+    Returns:
+        StreamingResponse: SSE流式响应
+    """
+    parsed = chat_service.resumable_streams.parse_event_id(last_event_id or event_id)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    stream_id, seq = parsed
+    run = chat_service.resumable_streams.get(stream_id)
+    owner = chat_service.admission_key(request.headers, request.client.host if request.client else None)
+    if run is None or not run.owned_by(owner, thread_id):
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    if not run.can_resume(seq):
+        raise HTTPException(status_code=410, detail="Missed events are no longer buffered")
+
+    return StreamingResponse(
+        cancel_on_disconnect(chat_service.resumable_streams.subscribe(run, seq),
+                             request.is_disconnected, chat_service.disconnect_poll_interval),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
+            'X-Stream-ID': stream_id
         }
     )
 
+
 @chat.post("/call")
-async def call(query: str = Body(...), meta: dict = Body(None)):
+async def call(request: Request, query: str = Body(...), meta: dict = Body(None)):
     """直接调用模型进行预测"""
+    ticket = await admit(request)
     try:
         return await chat_service.call_model(query, meta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        ticket.release()
+
+
+@chat.post("/batch")
+async def batch(request: Request, queries: List[str] = Body(...), meta: dict = Body(None),
+                concurrency: int = Body(None), ordered: bool = Body(False), max_retries: int = Body(None)):
+    """批量调用模型（离线情报富化等场景），以NDJSON逐行返回结果
+
+    Args:
+        queries: 查询列表，共享同一个 meta
+        meta: 元数据，包含模型配置
+        concurrency: 并发数，不超过 BATCH_CONCURRENCY
+        ordered: 是否按输入顺序返回，默认按完成顺序
+        max_retries: 单条失败后的最大重试次数，不超过 BATCH_MAX_RETRIES
+
+    Returns:
+        StreamingResponse: 每行一个JSON结果，最后一行为汇总（done=true）
+    """
+    if len(queries) > chat_service.batch_max_queries:
+        raise HTTPException(status_code=413, detail=f"Too many queries, limit is {chat_service.batch_max_queries}")
+    try:
+        chat_service.model_registry.validate(
+            *chat_service.model_registry.resolve_key((meta or {}).get("model_provider"), (meta or {}).get("model_name")))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 每个并发调用在 batch_call 中各自申请生成名额，而不是整个批次只占一个
+    key = chat_service.admission_key(request.headers, request.client.host if request.client else None)
+
+    async def ndjson():
+        async for result in chat_service.batch_call(queries, meta, concurrency, ordered, max_retries, key):
+            yield dumps(result) + b"\n"
+
+    return StreamingResponse(
+        cancel_on_disconnect(ndjson(), request.is_disconnected, chat_service.disconnect_poll_interval),
+        media_type='application/x-ndjson'
+    )
 
 
 @chat.get("/sessions/{thread_id}")
@@ -76,6 +201,60 @@ async def get_session(thread_id: str):
             raise HTTPException(status_code=500, detail=str(e))
 
 
+@chat.get("/sessions/{thread_id}/history")
+async def get_session_history(thread_id: str, offset: int = 0, limit: int = 50):
+    """分页获取会话历史（精简 finished 事件不再携带完整历史）
+
+    Args:
+        thread_id: 会话ID
+        offset: 起始位置（从最早一条保留的消息开始）
+        limit: 每页条数
+
+    Returns:
+        messages、total、offset、limit
+    """
+    try:
+        return await chat_service.get_session_history(thread_id, offset, min(max(limit, 1), 200))
+    except Exception as e:
+        if "not available" in str(e):
+            raise HTTPException(status_code=503, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@chat.get("/sessions/{thread_id}/refs")
+async def get_session_refs(thread_id: str, offset: int = 0, limit: int = 20, turn_id: str = None):
+    """分页获取会话各轮回答的检索引用
+
+    Args:
+        thread_id: 会话ID
+        offset: 起始位置
+        limit: 每页轮数
+        turn_id: 只获取指定助手消息（finished 事件中的 turn.assistant_id）的引用
+
+    Returns:
+        items（{"turn_id", "refs"} 列表）、total、offset、limit
+    """
+    try:
+        return await chat_service.get_session_refs(thread_id, offset, min(max(limit, 1), 100), turn_id)
+    except Exception as e:
+        if "not available" in str(e):
+            raise HTTPException(status_code=503, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@chat.get("/sessions/{thread_id}/title")
+async def get_session_title(thread_id: str):
+    """获取指定会话的标题（标题在后台生成，新会话的流结束后轮询该接口）
+
+    Args:
+        thread_id: 会话ID
+
+    Returns:
+        status（pending / generated / unknown）和 title
+    """
+    return await chat_service.get_session_title(thread_id)
+
+
 @chat.delete("/sessions/{thread_id}")
 async def delete_session(thread_id: str):
     """删除指定会话
@@ -108,3 +287,8 @@ async def update_chat_models(model_provider: str, model_names: List[str]):
     """更新指定模型提供商的模型列表"""
     return chat_service.update_chat_models(model_provider, model_names)
 
+
+@chat.get("/metrics")
+async def get_chat_metrics():
+    """获取聊天服务的运行指标（含各模型端点的路由统计）"""
+    return {**metrics.snapshot(), "router": chat_service.model_router.snapshot()}
@@ -1,11 +1,15 @@
-from typing import List, Optional
-from fastapi import APIRouter, File, UploadFile, HTTPException, Body, Query
+from typing import Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Body, Query, Request
+from fastapi.responses import StreamingResponse
 from rag.service.data_service import DataService
+from rag.utils.sse_encoder import dumps
 
 data = APIRouter(prefix="/data")
 
 # 初始化数据服务
 data_service = DataService()
+# 应用启动时恢复中断的入库任务（路由的事件处理器随 include_router 注册到应用）
+data.add_event_handler("startup", data_service.start)
 
 
 @data.get("/")
@@ -47,31 +51,104 @@ async def query_test(query: str = Body(...), meta: dict = Body(...)):
 
 @data.post("/file-to-chunk")
 async def file_to_chunk(files: List[str] = Body(...), params: dict = Body(...)):
-    """文件转换为分块"""
-    result = data_service.file_to_chunk(files, params)
+    """文件转换为分块（多进程并行解析，相同内容和参数的结果直接从缓存返回）"""
+    result = await data_service.file_to_chunk(files, params)
     if result.get("status") == "failed":
         raise HTTPException(status_code=400, detail=result.get("message"))
     return result
 
 
+@data.post("/file-to-chunk/stream")
+async def file_to_chunk_stream(files: List[str] = Body(...), params: dict = Body(...)):
+    """文件转换为分块，以NDJSON逐个返回每个文件的结果，最后一行为汇总（done=true）"""
+    async def ndjson():
+        async for item in data_service.file_to_chunk_stream(files, params):
+            yield dumps(item) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+
 @data.post("/add-by-file")
-async def create_document_by_file(db_id: str = Body(...), files: List[str] = Body(...)):
-    """通过文件添加文档"""
-    result = await data_service.add_files(db_id, files)
+async def create_document_by_file(db_id: str = Body(...), files: List[str] = Body(...), wait: bool = Body(True),
+                                  replaces: Optional[Dict[str, str]] = Body(None)):
+    """通过文件添加文档
+
+    默认等待入库结束后返回 added/skipped/replaced，有文件失败时返回 400（与提交任务前的行为一致）；
+    wait=false 时立即返回入库任务ID（job_id），进度通过 /jobs/{job_id} 或 /jobs/{job_id}/events 获取。
+    replaces 为 文件路径 -> 要替换的旧 file_id，新版本入库后删除旧版本。
+    """
+    result = await data_service.submit_ingest(db_id, "files", [(path, None) for path in files], wait, replaces)
     if result.get("status") == "failed":
         raise HTTPException(status_code=400, detail=result.get("message"))
     return result
 
 
 @data.post("/add-by-chunks")
-async def add_by_chunks(db_id: str = Body(...), file_chunks: dict = Body(...)):
-    """通过分块添加文档"""
-    result = await data_service.add_chunks(db_id, file_chunks)
+async def add_by_chunks(db_id: str = Body(...), file_chunks: dict = Body(...), wait: bool = Body(True),
+                        replaces: Optional[Dict[str, str]] = Body(None)):
+    """通过分块添加文档，wait 和返回结果与 /add-by-file 相同；replaces 为 file_id -> 要替换的旧 file_id"""
+    result = await data_service.submit_ingest(db_id, "chunks", list(file_chunks.items()), wait, replaces)
     if result.get("status") == "failed":
         raise HTTPException(status_code=400, detail=result.get("message"))
     return result
 
 
+@data.get("/jobs")
+async def list_ingest_jobs(db_id: Optional[str] = None, limit: int = Query(20, ge=1, le=200)):
+    """获取最近的入库任务"""
+    return await data_service.list_ingest_jobs(db_id, limit)
+
+
+@data.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """获取入库任务进度：状态、各状态文件数、吞吐，以及每个文件的状态、错误和结果"""
+    result = await data_service.get_ingest_job(job_id)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.get("/jobs/{job_id}/events")
+async def watch_ingest_job(job_id: str):
+    """以SSE推送入库任务进度，每次状态变化发送一次完整进度，任务结束后关闭"""
+    result = await data_service.get_ingest_job(job_id)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+
+    async def events():
+        async for snapshot in data_service.watch_ingest_job(job_id):
+            yield b"data: " + dumps(snapshot) + b"\n\n"
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+
+@data.post("/jobs/{job_id}/cancel")
+async def cancel_ingest_job(job_id: str):
+    """取消入库任务"""
+    result = await data_service.cancel_ingest_job(job_id)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.get("/embedding/stats")
+async def get_embedding_stats():
+    """获取向量化管线统计：实际向量化吞吐（条/秒）、缓存命中、批内去重节省的调用量"""
+    result = data_service.get_embedding_stats()
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.delete("/embedding/cache")
+async def clear_embedding_cache():
+    """清空向量缓存（写满 EMBED_CACHE_MAX_ROWS 时也会自动清空）"""
+    result = data_service.clear_embedding_cache()
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
 @data.get("/info")
 async def get_database_info(db_id: str):
     """获取数据库信息"""
@@ -100,18 +177,77 @@ async def get_document_info(db_id: str, file_id: str):
 
 
 @data.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    db_id: Optional[str] = Query(None)
-):
-    """上传文件"""
-    if not file.filename:
+async def upload_file(request: Request, db_id: Optional[str] = Query(None)):
+    """上传文件（multipart/form-data，文件字段名为 file）
+
+    文件按块写入磁盘并计算sha256（返回 content_hash），不把整个文件读入内存；
+    超过 UPLOAD_MAX_BYTES 返回 413。请求声明的 Content-Length 已超过上限时在解析表单前直接拒绝；
+    分块传输（没有 Content-Length）的请求在表单暂存之后才按实际大小检查。大文件请使用 /upload/multipart 分片上传。
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and data_service.declares_too_large(int(content_length)):
+        raise HTTPException(status_code=413, detail=f"File exceeds the upload limit of {data_service.upload_max_bytes} bytes")
+
+    form = await request.form()
+    file = form.get("file")
+    if not getattr(file, "filename", None):
         raise HTTPException(status_code=400, detail="No selected file")
 
-    file_content = await file.read()
-    result = await data_service.upload_file(file_content, file.filename, db_id)
+    result = await data_service.upload_file(file, file.filename, db_id)
     if result.get("status") == "failed":
-        raise HTTPException(status_code=400, detail=result.get("message"))
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.post("/upload/multipart")
+async def create_multipart_upload(
+    filename: str = Body(...),
+    total_size: int = Body(...),
+    db_id: Optional[str] = Body(None),
+    part_size: Optional[int] = Body(None)
+):
+    """创建可续传的分片上传，返回 upload_id、part_size 和 total_parts"""
+    result = data_service.create_multipart_upload(filename, total_size, db_id, part_size)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.get("/upload/multipart/{upload_id}")
+async def get_multipart_upload(upload_id: str):
+    """查询分片上传状态，断线后按 missing_parts 补传"""
+    result = data_service.get_multipart_upload(upload_id)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.put("/upload/multipart/{upload_id}/{index}")
+async def upload_part(upload_id: str, index: int, request: Request):
+    """上传一个分片，请求体为分片的原始字节（application/octet-stream），边接收边写盘"""
+    content_length = request.headers.get("content-length")
+    result = await data_service.upload_part(upload_id, index, request.stream(),
+                                            int(content_length) if content_length else None)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.post("/upload/multipart/{upload_id}/complete")
+async def complete_multipart_upload(upload_id: str, sha256: Optional[str] = Body(None, embed=True)):
+    """合并分片，返回与 /upload 相同的结果"""
+    result = await data_service.complete_multipart_upload(upload_id, sha256)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
+    return result
+
+
+@data.delete("/upload/multipart/{upload_id}")
+async def abort_multipart_upload(upload_id: str):
+    """放弃分片上传并删除已收到的分片"""
+    result = data_service.abort_multipart_upload(upload_id)
+    if result.get("status") == "failed":
+        raise HTTPException(status_code=result.get("status_code", 400), detail=result.get("message"))
     return result
 
 
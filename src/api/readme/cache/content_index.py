@@ -0,0 +1,155 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    db_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER,
+    file_id TEXT,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (db_id, content_hash)
+);
+CREATE INDEX IF NOT EXISTS files_path ON files (file_path);
+CREATE INDEX IF NOT EXISTS files_name ON files (db_id, filename);
+CREATE TABLE IF NOT EXISTS chunks (
+    db_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_file ON chunks (db_id, file_id);
+"""
+
+# 文件状态：已上传未入库 / 已入库
+UPLOADED = "uploaded"
+INGESTED = "ingested"
+
+
+class ContentIndex:
+    """按内容哈希索引知识库文件
+
+    每个知识库维护 内容sha256 -> 文件路径/file_id 的映射和已入库文件的分块哈希，
+    相同内容的文件只保存和入库一次；同名文件内容变化时视为修订，用分块哈希比较变化的分块。
+    数据保存在 sqlite 中，服务重启后仍然有效。
+    """
+
+    def __init__(self, path: str):
+        """初始化索引
+
+        Args:
+            path: sqlite 数据库文件路径
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def _db(db_id: Optional[str]) -> str:
+        return db_id or ""
+
+    def _one(self, sql: str, params: Iterable[Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(sql, tuple(params)).fetchone()
+        return dict(row) if row else None
+
+    def lookup(self, db_id: Optional[str], content_hash: str) -> Optional[Dict[str, Any]]:
+        """按内容哈希查找知识库中的文件"""
+        return self._one("SELECT * FROM files WHERE db_id = ? AND content_hash = ?", (self._db(db_id), content_hash))
+
+    def lookup_path(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """按保存路径查找文件（用于取得已上传文件的内容哈希）"""
+        return self._one("SELECT * FROM files WHERE file_path = ? ORDER BY updated_at DESC LIMIT 1", (file_path,))
+
+    def latest_revision(self, db_id: Optional[str], filename: str, exclude_hash: str) -> Optional[Dict[str, Any]]:
+        """查找同名文件最近一次入库的其他版本"""
+        return self._one(
+            "SELECT * FROM files WHERE db_id = ? AND filename = ? AND status = ? AND content_hash != ? "
+            "ORDER BY updated_at DESC LIMIT 1",
+            (self._db(db_id), filename, INGESTED, exclude_hash)
+        )
+
+    def record_upload(self, db_id: Optional[str], content_hash: str, file_path: str, filename: str, size: int):
+        """记录上传的文件；内容已存在时只更新保存路径，不改变入库状态"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO files (db_id, content_hash, file_path, filename, size, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (db_id, content_hash) DO UPDATE SET file_path = excluded.file_path",
+                (self._db(db_id), content_hash, file_path, filename, size, UPLOADED, time.time())
+            )
+
+    def mark_ingested(self, db_id: Optional[str], content_hash: str, file_id: Optional[str],
+                      chunk_hashes: Optional[List[str]] = None):
+        """标记文件已入库，并保存其分块哈希"""
+        db_id = self._db(db_id)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE files SET status = ?, file_id = ?, updated_at = ? WHERE db_id = ? AND content_hash = ?",
+                (INGESTED, file_id, time.time(), db_id, content_hash)
+            )
+            if file_id and chunk_hashes:
+                self._conn.execute("DELETE FROM chunks WHERE db_id = ? AND file_id = ?", (db_id, file_id))
+                self._conn.executemany(
+                    "INSERT INTO chunks (db_id, file_id, chunk_hash) VALUES (?, ?, ?)",
+                    [(db_id, file_id, chunk_hash) for chunk_hash in chunk_hashes]
+                )
+
+    def chunk_hashes(self, db_id: Optional[str], file_id: str) -> Set[str]:
+        """已入库文件的分块哈希集合"""
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_hash FROM chunks WHERE db_id = ? AND file_id = ?",
+                                      (self._db(db_id), file_id)).fetchall()
+        return {row[0] for row in rows}
+
+    def remove_file(self, db_id: Optional[str], file_id: str):
+        """文件从知识库删除后移除其索引"""
+        db_id = self._db(db_id)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE db_id = ? AND file_id = ?", (db_id, file_id))
+            self._conn.execute("DELETE FROM chunks WHERE db_id = ? AND file_id = ?", (db_id, file_id))
+
+    def remove_database(self, db_id: str):
+        """知识库删除后移除其全部索引"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE db_id = ?", (db_id,))
+            self._conn.execute("DELETE FROM chunks WHERE db_id = ?", (db_id,))
+
+
+class InflightIngests:
+    """正在入库的 (db_id, 内容哈希)
+
+    相同内容同一时间只由一个调用入库；其他调用取得该入库的完成事件，等待结束后重新判断
+    （入库成功则作为重复跳过，失败则自行入库），而不是在入库结果未知时直接报告跳过。
+    claim 可在线程中调用，release 须在事件循环中调用。
+    """
+
+    def __init__(self):
+        self._events: Dict[Tuple[str, str], asyncio.Event] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, db_id: Optional[str], content_hash: str) -> Optional[asyncio.Event]:
+        """登记入库，成功时返回 None；已有调用在入库相同内容时返回其完成事件"""
+        key = (db_id or "", content_hash)
+        with self._lock:
+            event = self._events.get(key)
+            if event is not None:
+                return event
+            self._events[key] = asyncio.Event()
+        return None
+
+    def release(self, db_id: Optional[str], content_hash: str):
+        """入库结束（成功或失败），唤醒等待的调用"""
+        with self._lock:
+            event = self._events.pop((db_id or "", content_hash), None)
+        if event is not None:
+            event.set()
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    db_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_db ON jobs (db_id, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    item_key TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    started_at REAL,
+    finished_at REAL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+# 单项状态（另有 RUNNING、CANCELLED）
+PENDING = "pending"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+ITEM_STATUSES = (PENDING, RUNNING, DONE, SKIPPED, FAILED, CANCELLED)
+FINISHED_ITEM_STATUSES = (DONE, SKIPPED, FAILED, CANCELLED)
+
+
+class IngestJobStore:
+    """入库任务表（sqlite）
+
+    每个任务记录知识库、类型（files/chunks）和状态，任务中的每个文件一行，记录状态、错误、结果和耗时；
+    服务重启后未完成的任务可以从表中恢复。
+    """
+
+    def __init__(self, path: str):
+        """初始化任务表
+
+        Args:
+            path: sqlite 数据库文件路径
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def create(self, db_id: str, kind: str, items: List[Tuple[str, Any]]) -> str:
+        """创建任务
+
+        Args:
+            db_id: 数据库ID
+            kind: 任务类型
+            items: (文件标识, 附加数据) 列表，附加数据序列化为 JSON 保存
+
+        Returns:
+            str: 任务ID
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO jobs (job_id, db_id, kind, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, db_id, kind, QUEUED, time.time()))
+            self._conn.executemany(
+                "INSERT INTO job_items (job_id, idx, item_key, payload, status) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, idx, key, json.dumps(payload, ensure_ascii=False) if payload is not None else None, PENDING)
+                 for idx, (key, payload) in enumerate(items)]
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务记录，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, db_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的任务记录，按创建时间倒序"""
+        sql, params = "SELECT * FROM jobs", []
+        if db_id:
+            sql, params = sql + " WHERE db_id = ?", [db_id]
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY created_at DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self, job_id: str) -> Dict[str, int]:
+        """各状态的文件数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status",
+                                      (job_id,)).fetchall()
+        counts = {status: 0 for status in ITEM_STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def items(self, job_id: str) -> List[Dict[str, Any]]:
+        """任务中每个文件的状态（不含附加数据）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, item_key, status, error, result, started_at, finished_at FROM job_items "
+                "WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["result"] = json.loads(item["result"]) if item["result"] else None
+            items.append(item)
+        return items
+
+    def pending_items(self, job_id: str) -> List[Tuple[int, str, Any]]:
+        """待处理的文件：(序号, 文件标识, 附加数据)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, item_key, payload FROM job_items WHERE job_id = ? AND status = ? ORDER BY idx",
+                (job_id, PENDING)
+            ).fetchall()
+        return [(row[0], row[1], json.loads(row[2]) if row[2] else None) for row in rows]
+
+    def set_status(self, job_id: str, status: str):
+        """更新任务状态，同时记录开始/结束时间"""
+        now = time.time()
+        with self._lock, self._conn:
+            if status == RUNNING:
+                self._conn.execute("UPDATE jobs SET status = ?, started_at = COALESCE(started_at, ?) WHERE job_id = ?",
+                                   (status, now, job_id))
+            else:
+                self._conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ?",
+                                   (status, now if status in (COMPLETED, CANCELLED) else None, job_id))
+
+    def update_item(self, job_id: str, idx: int, status: str, error: Optional[str] = None,
+                    result: Optional[dict] = None):
+        """更新单个文件的状态"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE job_items SET status = ?, error = ?, result = ?, finished_at = ? WHERE job_id = ? AND idx = ?",
+                (status, error, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 time.time() if status in FINISHED_ITEM_STATUSES else None, job_id, idx)
+            )
+
+    def claim(self, job_id: str, idx: int) -> bool:
+        """把待处理的文件标记为处理中，文件已被取消或处理时返回 False"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE job_items SET status = ?, started_at = ? WHERE job_id = ? AND idx = ? AND status = ?",
+                (RUNNING, time.time(), job_id, idx, PENDING)
+            )
+        return cursor.rowcount == 1
+
+    def cancel_pending(self, job_id: str) -> int:
+        """把未开始的文件标记为已取消，返回取消的数量"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE job_items SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, PENDING)
+            )
+        return cursor.rowcount
+
+    def recover(self) -> List[str]:
+        """服务启动时调用：中断时正在处理的文件重新置为待处理，返回未完成的任务ID"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE job_items SET status = ?, started_at = NULL WHERE status = ?",
+                               (PENDING, RUNNING))
+            rows = self._conn.execute("SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                                      (QUEUED, RUNNING)).fetchall()
+        return [row[0] for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """删除早于指定时间结束的任务，返回删除的任务数"""
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                                      (older_than,)).fetchall()
+            job_ids = [(row[0],) for row in rows]
+            self._conn.executemany("DELETE FROM job_items WHERE job_id = ?", job_ids)
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", job_ids)
+        return len(job_ids)
@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import redis
+
+from rag.utils.metrics import metrics
+
+# 知识图谱的版本键，图谱数据变更时递增
+GRAPH_VERSION_KEY = "__graph__"
+
+
+class KnowledgeVersions:
+    """知识库版本计数器
+
+    知识库内容每次变更（添加文件、分块、删除文件等）都递增对应 db_id 的版本号，
+    缓存把版本号纳入缓存键，版本变化后旧缓存自然失效；同时通知订阅者主动清理。
+
+    配置 Redis 后版本号保存在 Redis 哈希中（HINCRBY），后台线程每 refresh_interval 秒读取一次，
+    多个 worker 之间的变更最多延迟一个刷新间隔可见。Redis 不可用时的变更只在本进程内计数：
+    版本号为 Redis 中的值加上本进程未能写入 Redis 的变更次数，两部分都只增不减。
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._offsets: Dict[str, int] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        self._client = None
+        self._key = ""
+        self._refresher: Optional[threading.Thread] = None
+
+    def configure(self, redis_url: Optional[str] = None, key: str = "rag:kb_versions", refresh_interval: float = 1.0,
+                  client: Optional[redis.Redis] = None):
+        """启用跨 worker 的版本同步（重复调用时只生效一次）
+
+        Args:
+            redis_url: Redis 地址，为空且未传入 client 时只使用进程内版本号
+            key: 保存版本号的 Redis 哈希键
+            refresh_interval: 从 Redis 读取其他 worker 变更的间隔（秒），0 表示不启动刷新线程
+            client: 已创建的同步 Redis 客户端（可选，需 decode_responses=True）
+        """
+        if self._client is not None or not (redis_url or client):
+            return
+        self._client = client or redis.Redis.from_url(redis_url, decode_responses=True,
+                                                      socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._key = key
+        self.refresh()
+        if refresh_interval <= 0:
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, args=(refresh_interval,),
+                                           name="kb-version-refresh", daemon=True)
+        self._refresher.start()
+
+    def get(self, db_id: str) -> int:
+        """获取知识库当前版本号"""
+        return self._versions.get(db_id, 0) + self._offsets.get(db_id, 0)
+
+    def bump(self, db_id: str) -> int:
+        """递增知识库版本号并通知订阅者
+
+        Returns:
+            int: 新版本号
+        """
+        remote = None
+        if self._client is not None:
+            try:
+                remote = int(self._client.hincrby(self._key, db_id, 1))
+            except Exception:
+                # 只在本进程内生效，其他 worker 在缓存过期后才会看到变更
+                metrics.inc("kb_version_sync_failed_total")
+        with self._lock:
+            if remote is None:
+                self._offsets[db_id] = self._offsets.get(db_id, 0) + 1
+            else:
+                self._versions[db_id] = max(self._versions.get(db_id, 0), remote)
+            version = self._versions.get(db_id, 0) + self._offsets.get(db_id, 0)
+        for listener in list(self._listeners):
+            listener(db_id)
+        return version
+
+    def refresh(self) -> bool:
+        """从 Redis 读取所有知识库的版本号
+
+        其他 worker 的变更只更新版本号（旧缓存因缓存键变化不再命中），不在刷新线程中调用订阅者。
+
+        Returns:
+            bool: 是否读取成功
+        """
+        if self._client is None:
+            return False
+        try:
+            remote = self._client.hgetall(self._key)
+        except Exception:
+            metrics.inc("kb_version_sync_failed_total")
+            return False
+        with self._lock:
+            for db_id, version in remote.items():
+                if int(version) > self._versions.get(db_id, 0):
+                    self._versions[db_id] = int(version)
+        return True
+
+    def _refresh_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.refresh()
+
+    def subscribe(self, listener: Callable[[str], None]):
+        """订阅知识库变更，listener 接收变更的 db_id"""
+        self._listeners.append(listener)
+
+
+# 全局知识库版本实例
+kb_versions = KnowledgeVersions()
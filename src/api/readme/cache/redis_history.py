@@ -0,0 +1,176 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+
+class RedisHistoryStore:
+    """基于Redis列表的会话历史存储
+
+    每个会话的消息按顺序保存在一个定长列表中（RPUSH + LTRIM），读取时只用一次 LRANGE 取最近 N 轮，
+    一轮对话的用户/助手消息和过期时间刷新在同一个 MULTI 管道中提交。
+    """
+
+    def __init__(self, redis_url: str = "redis://localhost:6379", expire_time: int = 3600,
+                 max_messages: int = 200, key_prefix: str = "chat:history:", client=None):
+        """初始化历史存储
+
+        Args:
+            redis_url: Redis连接地址
+            expire_time: 会话历史过期时间（秒）
+            max_messages: 每个会话最多保留的消息条数
+            key_prefix: 键前缀
+            client: 已有的异步Redis客户端（可选，测试时可传入 fakeredis）
+        """
+        self.client = client or redis.from_url(redis_url, decode_responses=True)
+        self.expire_time = expire_time
+        self.max_messages = max_messages
+        self.key_prefix = key_prefix
+
+    def _key(self, thread_id: str) -> str:
+        return f"{self.key_prefix}{thread_id}"
+
+    def _version_key(self, thread_id: str) -> str:
+        return f"{self.key_prefix}{thread_id}:ver"
+
+    def _refs_key(self, thread_id: str) -> str:
+        return f"{self.key_prefix}{thread_id}:refs"
+
+    async def get_recent(self, thread_id: str, rounds: Optional[int] = None) -> List[dict]:
+        """读取最近的历史消息
+
+        Args:
+            thread_id: 会话ID
+            rounds: 读取的对话轮数（每轮包含用户和助手两条消息），为空时读取全部保留的消息
+
+        Returns:
+            List[dict]: 按时间顺序排列的消息列表
+        """
+        start = -rounds * 2 if rounds else 0
+        items = await self.client.lrange(self._key(thread_id), start, -1)
+        return [json.loads(item) for item in items]
+
+    async def get_recent_with_version(self, thread_id: str, rounds: Optional[int] = None) -> Tuple[List[dict], int]:
+        """在一次往返中读取最近的历史消息和当前版本号"""
+        start = -rounds * 2 if rounds else 0
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrange(self._key(thread_id), start, -1)
+            pipe.get(self._version_key(thread_id))
+            items, version = await pipe.execute()
+        return [json.loads(item) for item in items], int(version or 0)
+
+    async def get_range(self, thread_id: str, offset: int = 0, limit: int = 50) -> Tuple[List[dict], int]:
+        """分页读取保留的历史消息（从最早一条开始计数）
+
+        Returns:
+            Tuple[List[dict], int]: 本页消息和保留的消息总数
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrange(self._key(thread_id), offset, offset + limit - 1)
+            pipe.llen(self._key(thread_id))
+            items, total = await pipe.execute()
+        return [json.loads(item) for item in items], total
+
+    async def get_version(self, thread_id: str) -> int:
+        """读取会话历史的版本号（每追加一条消息加一），用于校验本地缓存"""
+        return int(await self.client.get(self._version_key(thread_id)) or 0)
+
+    async def append(self, thread_id: str, messages: List[dict]) -> int:
+        """在一个事务管道中追加消息、截断列表并刷新过期时间
+
+        Args:
+            thread_id: 会话ID
+            messages: 要追加的消息列表，例如一轮对话的用户和助手消息
+
+        Returns:
+            int: 追加后的版本号
+        """
+        versions = await self.append_many({thread_id: messages})
+        return versions[thread_id]
+
+    async def append_many(self, batches: Dict[str, List[dict]]) -> Dict[str, int]:
+        """在一个事务管道中为多个会话追加消息
+
+        Args:
+            batches: thread_id 到待追加消息列表的映射
+
+        Returns:
+            Dict[str, int]: 每个会话追加后的版本号
+        """
+        async with self.client.pipeline(transaction=True) as pipe:
+            for thread_id, messages in batches.items():
+                key, version_key = self._key(thread_id), self._version_key(thread_id)
+                pipe.rpush(key, *[json.dumps(message, ensure_ascii=False) for message in messages])
+                pipe.ltrim(key, -self.max_messages, -1)
+                pipe.expire(key, self.expire_time)
+                pipe.incrby(version_key, len(messages))
+                pipe.expire(version_key, self.expire_time)
+            results = await pipe.execute()
+        return {thread_id: results[i * 5 + 3] for i, thread_id in enumerate(batches)}
+
+    async def seed(self, thread_id: str, messages: List[dict]) -> bool:
+        """会话列表不存在时写入迁移的旧历史（WATCH 保证并发请求只写入一次）
+
+        Args:
+            thread_id: 会话ID
+            messages: 旧格式会话中的历史消息
+
+        Returns:
+            bool: 是否写入（列表已存在或并发写入时返回 False）
+        """
+        key, version_key = self._key(thread_id), self._version_key(thread_id)
+        messages = messages[-self.max_messages:]
+        if not messages:
+            return False
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.exists(key):
+                    return False
+                pipe.multi()
+                pipe.rpush(key, *[json.dumps(message, ensure_ascii=False) for message in messages])
+                pipe.expire(key, self.expire_time)
+                pipe.incrby(version_key, len(messages))
+                pipe.expire(version_key, self.expire_time)
+                await pipe.execute()
+            except redis.WatchError:
+                return False
+        return True
+
+    async def save_refs(self, thread_id: str, turn_id: str, refs) -> None:
+        """保存一轮回答的检索引用，按需通过分页接口读取
+
+        Args:
+            thread_id: 会话ID
+            turn_id: 助手消息ID
+            refs: 检索结果
+        """
+        key = self._refs_key(thread_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, json.dumps({"turn_id": turn_id, "refs": refs}, ensure_ascii=False, default=str))
+            pipe.ltrim(key, -max(self.max_messages // 2, 1), -1)
+            pipe.expire(key, self.expire_time)
+            await pipe.execute()
+
+    async def get_refs(self, thread_id: str, offset: int = 0, limit: int = 20,
+                       turn_id: Optional[str] = None) -> Tuple[List[dict], int]:
+        """分页读取检索引用，指定 turn_id 时只返回该轮的引用
+
+        Returns:
+            Tuple[List[dict], int]: 本页的 {"turn_id", "refs"} 列表和保留的总轮数
+        """
+        key = self._refs_key(thread_id)
+        if turn_id is not None:
+            items = [json.loads(item) for item in await self.client.lrange(key, 0, -1)]
+            matched = [item for item in items if item.get("turn_id") == turn_id]
+            return matched, len(matched)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrange(key, offset, offset + limit - 1)
+            pipe.llen(key)
+            items, total = await pipe.execute()
+        return [json.loads(item) for item in items], total
+
+    async def delete(self, thread_id: str) -> bool:
+        """删除会话历史"""
+        return bool(await self.client.delete(self._key(thread_id), self._version_key(thread_id),
+                                             self._refs_key(thread_id)))
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple
+
+from rag.cache.kb_version import GRAPH_VERSION_KEY, kb_versions
+from rag.utils.metrics import metrics
+
+
+@dataclass
+class CachedResponse:
+    """缓存的问答结果"""
+    content: str
+    reasoning_content: str = ""
+    refs: Any = None
+    retrieved_docs: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class _Entry:
+    response: CachedResponse
+    scope: str
+    sources: Tuple[str, ...]
+    created_at: float
+    embedding: Optional[List[float]] = None
+    ttl: Optional[float] = None
+
+
+class ResponseCache:
+    """问答响应缓存
+
+    精确层：缓存键由归一化后的问题、模型、知识库（含版本号）、use_graph/use_web 和历史摘要组成。
+    语义层（可选）：在同一作用域（除问题外的其他条件都相同）内按问题向量的余弦相似度匹配。
+    两层共用 LRU + TTL 淘汰；知识库变更时清理相关条目。网络搜索的结果会过时，使用较短的 web_ttl。
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600,
+                 semantic_threshold: float = 0.0, embed_fn: Optional[Callable[[str], List[float]]] = None,
+                 web_ttl: float = 300):
+        """初始化缓存
+
+        Args:
+            max_entries: 最大缓存条目数
+            ttl: 条目存活时间（秒）
+            semantic_threshold: 语义匹配的相似度阈值，0 表示关闭语义层
+            embed_fn: 问题向量化函数（阻塞调用）
+            web_ttl: 使用网络搜索（use_web）的回答的存活时间（秒），0 表示不缓存
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.web_ttl = web_ttl
+        self.semantic_threshold = semantic_threshold
+        self.embed_fn = embed_fn
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        kb_versions.subscribe(self.invalidate_db)
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold > 0 and self.embed_fn is not None
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """归一化问题：去除首尾空白和句末标点、合并空白、统一小写"""
+        query = re.sub(r"\s+", " ", query.strip().lower())
+        return query.rstrip("?？。.!！ ")
+
+    def cacheable(self, meta: dict) -> bool:
+        """请求是否允许使用缓存（meta.use_cache 为 False 时跳过；web_ttl 为 0 时跳过网络搜索请求）"""
+        meta = meta or {}
+        if meta.get("use_web") and self.web_ttl <= 0:
+            return False
+        return meta.get("use_cache", True) is not False
+
+    def ttl_for(self, meta: dict) -> float:
+        """请求对应的条目存活时间"""
+        return min(self.web_ttl, self.ttl) if (meta or {}).get("use_web") else self.ttl
+
+    def make_scope(self, model_key: Tuple, meta: dict, history: Optional[List[dict]] = None) -> str:
+        """计算作用域：除问题外影响回答的所有条件"""
+        meta = meta or {}
+        db_id = meta.get("db_id") or None
+        history_digest = hashlib.sha256(
+            json.dumps(history or [], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        scope = {
+            "model": list(model_key),
+            "db_id": db_id,
+            "db_version": kb_versions.get(db_id) if db_id else 0,
+            "use_graph": bool(meta.get("use_graph")),
+            "graph_version": kb_versions.get(GRAPH_VERSION_KEY) if meta.get("use_graph") else 0,
+            "use_web": bool(meta.get("use_web")),
+            "history": history_digest,
+            # 系统提示词和历史轮数同样决定模型看到的提示词
+            "system_prompt": meta.get("system_prompt") or "",
+            "history_round": meta.get("history_round"),
+        }
+        return hashlib.sha256(json.dumps(scope, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def sources(meta: dict) -> Tuple[str, ...]:
+        """回答依赖的知识来源（知识库 db_id、图谱），用于变更时清理"""
+        meta = meta or {}
+        sources = []
+        if meta.get("db_id"):
+            sources.append(meta["db_id"])
+        if meta.get("use_graph"):
+            sources.append(GRAPH_VERSION_KEY)
+        return tuple(sources)
+
+    def make_key(self, query: str, scope: str, normalize: bool = True) -> str:
+        """计算精确层缓存键
+
+        Args:
+            query: 问题
+            scope: 作用域
+            normalize: 是否先归一化问题
+        """
+        if normalize:
+            query = self.normalize(query)
+        return hashlib.sha256(f"{scope}:{query}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """精确层查询"""
+        entry = self._entries.get(key)
+        if entry is None or self._expired(entry):
+            if entry is not None:
+                del self._entries[key]
+            metrics.inc("response_cache_miss_total")
+            return None
+        self._entries.move_to_end(key)
+        metrics.inc("response_cache_hit_total")
+        return entry.response
+
+    def get_similar(self, scope: str, embedding: List[float]) -> Optional[CachedResponse]:
+        """语义层查询：返回同一作用域内相似度最高且超过阈值的结果"""
+        embedding = self._unit(embedding)
+        best, best_score = None, self.semantic_threshold
+        for entry in self._entries.values():
+            if entry.scope != scope or entry.embedding is None or self._expired(entry):
+                continue
+            score = sum(a * b for a, b in zip(embedding, entry.embedding))
+            if score >= best_score:
+                best, best_score = entry, score
+        if best is None:
+            metrics.inc("response_cache_semantic_miss_total")
+            return None
+        metrics.inc("response_cache_semantic_hit_total")
+        metrics.observe("response_cache_semantic_score", best_score)
+        return best.response
+
+    def put(self, key: str, scope: str, response: CachedResponse, sources: Tuple[str, ...] = (),
+            embedding: Optional[List[float]] = None, ttl: Optional[float] = None):
+        """写入缓存，ttl 为空时使用默认存活时间"""
+        self._entries[key] = _Entry(
+            response=response,
+            scope=scope,
+            sources=sources,
+            created_at=time.monotonic(),
+            embedding=self._unit(embedding) if embedding is not None else None,
+            ttl=ttl,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("response_cache_entries", len(self._entries))
+
+    def invalidate_db(self, db_id: str):
+        """清理与指定知识库（或图谱）相关的条目"""
+        keys = [key for key, entry in self._entries.items() if db_id in entry.sources]
+        for key in keys:
+            del self._entries[key]
+        metrics.inc("response_cache_invalidated_total", len(keys))
+        metrics.set_gauge("response_cache_entries", len(self._entries))
+
+    def _expired(self, entry: _Entry) -> bool:
+        ttl = entry.ttl if entry.ttl is not None else self.ttl
+        return time.monotonic() - entry.created_at > ttl
+
+    @staticmethod
+    def _unit(vector: List[float]) -> List[float]:
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [float(v) / norm for v in vector]
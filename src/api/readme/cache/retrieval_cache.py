@@ -0,0 +1,189 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from rag.cache.kb_version import GRAPH_VERSION_KEY, kb_versions
+from rag.utils.metrics import metrics
+
+# 影响检索结果的 meta 字段
+RETRIEVAL_META_FIELDS = ("db_id", "use_graph", "use_web", "rewrite_query", "top_k")
+
+
+class _Entry:
+    __slots__ = ("value", "sources", "size", "created_at")
+
+    def __init__(self, value: Any, sources: Tuple[str, ...], size: int):
+        self.value = value
+        self.sources = sources
+        self.size = size
+        self.created_at = time.monotonic()
+
+
+class RetrievalCache:
+    """检索结果缓存
+
+    缓存键由命名空间、查询、检索相关的 meta 字段、历史摘要和知识库/图谱版本号组成，
+    知识库变更后版本号递增，旧结果不再命中。按条目数和估算字节数双重限制内存，
+    并发的相同查询只执行一次检索（single-flight），其余请求等待同一结果。
+    """
+
+    def __init__(self, max_entries: int = 2000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 600,
+                 single_flight: bool = True):
+        """初始化缓存
+
+        Args:
+            max_entries: 最大条目数
+            max_bytes: 缓存结果的估算总字节数上限
+            ttl: 条目存活时间（秒）
+            single_flight: 是否合并并发的相同检索
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.single_flight = single_flight
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._bytes = 0
+        kb_versions.subscribe(self.invalidate_db)
+
+    @staticmethod
+    def sources(meta: dict) -> Tuple[str, ...]:
+        """检索依赖的知识来源（知识库 db_id、图谱）"""
+        meta = meta or {}
+        sources = []
+        if meta.get("db_id"):
+            sources.append(meta["db_id"])
+        if meta.get("use_graph"):
+            sources.append(GRAPH_VERSION_KEY)
+        return tuple(sources)
+
+    def make_key(self, namespace: str, query: str, meta: dict, history: Optional[List[dict]] = None) -> str:
+        """计算缓存键
+
+        Args:
+            namespace: 命名空间，区分不同的检索调用（如 chat、query_test）
+            query: 查询文本
+            meta: 请求元数据
+            history: 检索时使用的历史消息
+        """
+        meta = meta or {}
+        key = {
+            "namespace": namespace,
+            "query": query.strip(),
+            "meta": {field: meta.get(field) for field in RETRIEVAL_META_FIELDS},
+            "versions": {source: kb_versions.get(source) for source in self.sources(meta)},
+            "history": history or [],
+        }
+        return hashlib.sha256(json.dumps(key, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.inc("retrieval_cache_miss_total")
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._remove(key)
+            metrics.inc("retrieval_cache_miss_total")
+            return None
+        self._entries.move_to_end(key)
+        metrics.inc("retrieval_cache_hit_total")
+        return copy.copy(entry.value)
+
+    def put(self, key: str, value: Any, sources: Tuple[str, ...] = ()):
+        """写入缓存"""
+        self._put(key, value, sources)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], sources: Tuple[str, ...] = ()) -> Any:
+        """读取缓存，未命中时调用 loader 检索并写入缓存
+
+        Args:
+            key: 缓存键
+            loader: 无参异步函数，执行实际检索
+            sources: 结果依赖的知识来源，用于变更时清理
+
+        Returns:
+            检索结果（命中时返回缓存副本）
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() - entry.created_at <= self.ttl:
+                self._entries.move_to_end(key)
+                metrics.inc("retrieval_cache_hit_total")
+                return copy.copy(entry.value)
+            self._remove(key)
+
+        if self.single_flight and key in self._inflight:
+            metrics.inc("retrieval_cache_coalesced_total")
+            inflight = self._inflight[key]
+            try:
+                return copy.copy(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                # 发起检索的请求被取消（例如客户端断开）时，由当前请求重新检索
+                if not inflight.cancelled():
+                    raise
+                return await self.get_or_load(key, loader, sources)
+
+        metrics.inc("retrieval_cache_miss_total")
+        future = asyncio.get_running_loop().create_future()
+        if self.single_flight:
+            self._inflight[key] = future
+        started = time.monotonic()
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # 没有其他等待者时避免 "exception was never retrieved" 警告
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        metrics.observe("retrieval_load_seconds", time.monotonic() - started)
+        future.set_result(value)
+        self._put(key, value, sources)
+        return value
+
+    def invalidate_db(self, db_id: str):
+        """清理依赖指定知识库（或图谱）的条目"""
+        for key in [key for key, entry in self._entries.items() if db_id in entry.sources]:
+            self._remove(key)
+        self._update_gauges()
+
+    def _put(self, key: str, value: Any, sources: Tuple[str, ...]):
+        size = len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, sources, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._update_gauges()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _update_gauges(self):
+        metrics.set_gauge("retrieval_cache_entries", len(self._entries))
+        metrics.set_gauge("retrieval_cache_bytes", self._bytes)
+
+
+# 全局检索缓存实例，聊天检索和查询测试共用
+retrieval_cache = RetrievalCache(
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000")),
+    max_bytes=int(os.getenv("RETRIEVAL_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "600")),
+    single_flight=os.getenv("RETRIEVAL_CACHE_SINGLE_FLIGHT", "true").lower() == "true"
+)
@@ -0,0 +1,276 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.cache.redis_history import RedisHistoryStore
+from rag.utils.circuit_breaker import CircuitBreaker
+from rag.utils.metrics import metrics
+
+
+class _Entry:
+    """本地缓存的会话历史"""
+
+    __slots__ = ("messages", "version", "loaded_at", "validated_at")
+
+    def __init__(self, messages: List[dict], version: int):
+        now = time.monotonic()
+        self.messages = messages
+        self.version = version
+        self.loaded_at = now
+        self.validated_at = now
+
+
+class CachedHistoryStore:
+    """带进程内缓存和异步回写的会话历史存储
+
+    读：热点会话的历史缓存在本 worker 内（LRU + TTL）。短时间内直接命中；
+    超过信任时间后只读取版本号校验，版本不一致说明其他 worker 写过该会话，重新加载。
+    写：先更新本地缓存并进入待写队列，由后台任务按间隔合并成一个管道批量写入Redis；
+    Redis短暂不可用时保留待写消息并重试，同时继续用本地缓存服务读请求。
+    """
+
+    def __init__(self, store: RedisHistoryStore, max_sessions: int = 1000, ttl: float = 300,
+                 trust_seconds: float = 2.0, flush_interval_ms: int = 50, max_pending: int = 10000,
+                 breaker: Optional[CircuitBreaker] = None):
+        """初始化缓存
+
+        Args:
+            store: 底层Redis历史存储
+            max_sessions: 本地缓存的最大会话数
+            ttl: 缓存项的最长存活时间（秒）
+            trust_seconds: 缓存项免校验的时间（秒）
+            flush_interval_ms: 回写间隔（毫秒）
+            max_pending: 最多保留的待写消息条数，超出时丢弃最旧的消息
+            breaker: Redis熔断器，打开时暂停回写
+        """
+        self.store = store
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.trust_seconds = trust_seconds
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.breaker = breaker
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._pending_count = 0
+        self._inflight = set()
+        self._flusher: Optional[asyncio.Task] = None
+        # 回写与删除互斥：删除须等待进行中的回写结束，否则回写会把已删除会话的消息重新写回Redis
+        self._write_lock = asyncio.Lock()
+
+    def _fresh(self, thread_id: str) -> Optional[_Entry]:
+        """未过期的本地缓存项，超过存活时间（且没有待写消息）时移除"""
+        entry = self._entries.get(thread_id)
+        if entry is not None and time.monotonic() - entry.loaded_at >= self.ttl and thread_id not in self._pending:
+            self._entries.pop(thread_id)
+            return None
+        return entry
+
+    def local(self, thread_id: str, rounds: Optional[int] = None) -> Optional[List[dict]]:
+        """不访问Redis即可确定的历史（有待写消息或仍在免校验时间内），否则返回 None"""
+        entry = self._fresh(thread_id)
+        if entry is None or (thread_id not in self._pending
+                             and time.monotonic() - entry.validated_at >= self.trust_seconds):
+            return None
+        metrics.inc("session_cache_hit_total")
+        return self._slice(entry.messages, rounds)
+
+    async def get_recent(self, thread_id: str, rounds: Optional[int] = None) -> List[dict]:
+        """读取最近 rounds 轮历史（与 RedisHistoryStore.get_recent 一致）"""
+        history = self.local(thread_id, rounds)
+        if history is not None:
+            return history
+
+        entry = self._fresh(thread_id)
+        now = time.monotonic()
+        if entry is not None:
+            try:
+                version = await self.store.get_version(thread_id)
+            except Exception as e:
+                logger.warning(f"Redis版本校验失败，使用本地缓存: {e}")
+                metrics.inc("session_cache_stale_served_total")
+                return self._slice(entry.messages, rounds)
+            if version == entry.version:
+                entry.validated_at = now
+                metrics.inc("session_cache_validated_total")
+                return self._slice(entry.messages, rounds)
+            metrics.inc("session_cache_stale_total")
+
+        metrics.inc("session_cache_miss_total")
+        messages, version = await self.store.get_recent_with_version(thread_id)
+        # 尚未回写的消息不在Redis中，合并到加载结果
+        messages = messages + self._pending.get(thread_id, [])
+        if thread_id not in self._inflight:
+            # 回写进行中时无法确定Redis是否已包含这批消息，暂不缓存
+            self._put(thread_id, _Entry(messages, version))
+        return self._slice(messages, rounds)
+
+    def peek(self, thread_id: str, rounds: Optional[int] = None) -> Optional[List[dict]]:
+        """只从本地缓存读取历史，不访问Redis；未缓存时返回 None"""
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            return None
+        metrics.inc("session_cache_peek_total")
+        return self._slice(entry.messages, rounds)
+
+    async def get_range(self, thread_id: str, offset: int = 0, limit: int = 50) -> Tuple[List[dict], int]:
+        """分页读取历史（与 RedisHistoryStore.get_range 一致，包含尚未回写的消息）"""
+        messages = await self.get_recent(thread_id)
+        return messages[offset:offset + limit], len(messages)
+
+    async def seed(self, thread_id: str, messages: List[dict]) -> bool:
+        """迁移旧历史（与 RedisHistoryStore.seed 一致），已有本地消息或待写消息时不迁移"""
+        entry = self._entries.get(thread_id)
+        if thread_id in self._pending or thread_id in self._inflight or (entry is not None and entry.messages):
+            return False
+        seeded = await self.store.seed(thread_id, messages)
+        # 下次读取时从Redis重新加载（包含迁移的消息和版本号）
+        self._entries.pop(thread_id, None)
+        return seeded
+
+    async def save_refs(self, thread_id: str, turn_id: str, refs) -> None:
+        """检索引用直接写入Redis，不经过本地缓存"""
+        await self.store.save_refs(thread_id, turn_id, refs)
+
+    async def get_refs(self, thread_id: str, offset: int = 0, limit: int = 20,
+                       turn_id: Optional[str] = None) -> Tuple[List[dict], int]:
+        """读取检索引用（与 RedisHistoryStore.get_refs 一致）"""
+        return await self.store.get_refs(thread_id, offset, limit, turn_id)
+
+    async def append(self, thread_id: str, messages: List[dict]) -> Optional[int]:
+        """追加消息：立即更新本地缓存，异步回写Redis
+
+        Returns:
+            Optional[int]: 回写完成后的预期版本号，无法确定时（未缓存或正在回写）返回 None
+        """
+        entry = self._entries.get(thread_id)
+        if entry is not None:
+            entry.messages = (entry.messages + messages)[-self.store.max_messages:]
+            self._entries.move_to_end(thread_id)
+
+        self._pending.setdefault(thread_id, []).extend(messages)
+        self._pending_count += len(messages)
+        self._trim_pending()
+        metrics.set_gauge("session_cache_pending_messages", self._pending_count)
+        self._ensure_flusher()
+
+        if entry is None or thread_id in self._inflight or thread_id not in self._pending:
+            return None
+        return entry.version + len(self._pending[thread_id])
+
+    async def delete(self, thread_id: str) -> bool:
+        """删除会话历史（本地缓存、待写消息和Redis）"""
+        async with self._write_lock:
+            # 在锁内丢弃待写消息：回写失败时会把消息放回队列
+            self._entries.pop(thread_id, None)
+            pending = self._pending.pop(thread_id, None)
+            if pending:
+                self._pending_count -= len(pending)
+                metrics.set_gauge("session_cache_pending_messages", self._pending_count)
+            return await self.store.delete(thread_id)
+
+    async def flush(self) -> bool:
+        """把待写消息合并成一个管道写入Redis，失败时放回队列等待重试
+
+        Returns:
+            bool: 是否写入成功
+        """
+        if not self._pending:
+            return True
+        # 后台回写不是用户请求：熔断打开期间直接暂停，不占用半开探测名额，也不计入短路次数
+        if self.breaker is not None and self.breaker.cooling_down():
+            return False
+        async with self._write_lock:
+            return await self._flush()
+
+    async def close(self):
+        """停止后台回写并写出剩余的待写消息（应用关闭时调用）
+
+        先等待进行中的回写结束再取消后台任务，避免取消发生在管道写入途中；最后一次回写不受熔断限制。
+        """
+        async with self._write_lock:
+            if self._flusher is not None and not self._flusher.done():
+                self._flusher.cancel()
+                try:
+                    await self._flusher
+                except asyncio.CancelledError:
+                    pass
+            self._flusher = None
+            if not await self._flush():
+                logger.warning(f"应用关闭时会话历史回写失败，丢弃 {self._pending_count} 条待写消息")
+
+    async def _flush(self) -> bool:
+        if not self._pending:
+            return True
+        batches, self._pending = self._pending, OrderedDict()
+        flushed = sum(len(messages) for messages in batches.values())
+        self._pending_count -= flushed
+
+        self._inflight = set(batches)
+        started = time.monotonic()
+        try:
+            versions = await self.store.append_many(batches)
+            if self.breaker is not None:
+                self.breaker.record_success()
+        except Exception as e:
+            if self.breaker is not None:
+                self.breaker.record_failure(time.monotonic() - started)
+            logger.warning(f"会话历史回写失败，稍后重试: {e}")
+            metrics.inc("session_cache_flush_failed_total")
+            for thread_id, messages in reversed(batches.items()):
+                merged = messages + self._pending.pop(thread_id, [])
+                self._pending[thread_id] = merged
+                self._pending.move_to_end(thread_id, last=False)
+            self._pending_count += flushed
+            self._trim_pending()
+            return False
+        finally:
+            self._inflight = set()
+
+        metrics.inc("session_cache_flushed_messages_total", flushed)
+        for thread_id, version in versions.items():
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                continue
+            if version != entry.version + len(batches[thread_id]):
+                # 其他 worker 在此期间写过该会话，本地缓存已过期
+                self._entries.pop(thread_id)
+                metrics.inc("session_cache_conflict_total")
+            else:
+                entry.version = version
+                entry.validated_at = time.monotonic()
+        metrics.set_gauge("session_cache_pending_messages", self._pending_count)
+        return True
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        delay = self.flush_interval
+        while self._pending:
+            await asyncio.sleep(delay)
+            # 写入失败时指数退避，避免Redis故障期间频繁重试
+            delay = self.flush_interval if await self.flush() else min(delay * 2, 5.0)
+
+    def _trim_pending(self):
+        """待写消息超出上限时丢弃最旧的会话批次"""
+        while self._pending_count > self.max_pending and self._pending:
+            thread_id, dropped = self._pending.popitem(last=False)
+            self._pending_count -= len(dropped)
+            self._entries.pop(thread_id, None)
+            metrics.inc("session_cache_dropped_messages_total", len(dropped))
+            logger.warning(f"会话历史待写队列已满，丢弃 {thread_id} 的 {len(dropped)} 条消息")
+
+    def _put(self, thread_id: str, entry: _Entry):
+        self._entries[thread_id] = entry
+        self._entries.move_to_end(thread_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _slice(messages: List[dict], rounds: Optional[int]) -> List[dict]:
+        return list(messages[-rounds * 2:]) if rounds else list(messages)
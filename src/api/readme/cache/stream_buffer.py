@@ -0,0 +1,188 @@
+import asyncio
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, Callable, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+
+
+class StreamRun:
+    """一次可续传的生成过程
+
+    生成在独立任务中运行，产生的事件按递增序号写入定长环形缓冲区；
+    客户端（首次连接或断线重连）通过 subscribe 从指定序号之后开始读取。
+    """
+
+    def __init__(self, stream_id: str, buffer_size: int, owner: Optional[str] = None, thread_id: Optional[str] = None):
+        self.stream_id = stream_id
+        self.owner = owner
+        self.thread_id = thread_id
+        self.events: deque = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.done = False
+        self.readers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._signal = asyncio.Event()
+
+    def append(self, chunk: bytes):
+        """追加一个事件，并为其加上 SSE id 行（格式为 {stream_id}:{seq}）"""
+        self.seq += 1
+        self.events.append((self.seq, f"id: {self.stream_id}:{self.seq}\n".encode("utf-8") + chunk))
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def owned_by(self, owner: Optional[str], thread_id: Optional[str] = None) -> bool:
+        """重连方是否为发起方（相同的准入 key），传入 thread_id 时还须与发起时的对话线程一致"""
+        if self.owner is not None and owner != self.owner:
+            return False
+        return thread_id is None or self.thread_id is None or thread_id == self.thread_id
+
+    def can_resume(self, after_seq: int) -> bool:
+        """序号 after_seq 之后的事件是否都还在缓冲区中"""
+        return not self.events or self.events[0][0] <= after_seq + 1
+
+    def _notify(self):
+        self._signal.set()
+        self._signal = asyncio.Event()
+
+    async def wait(self):
+        await self._signal.wait()
+
+
+class ResumableStreams:
+    """可续传流的注册表（进程内）
+
+    客户端断开后（或创建后首个客户端一直未连接时）生成继续运行 grace_seconds 秒，期间携带 Last-Event-ID
+    重连即可补发缺失事件并继续接收；超时无人连接时取消生成。生成结束后运行记录再保留 retention_seconds 秒供晚到的重连读取。
+    """
+
+    def __init__(self, buffer_size: int = 1024, grace_seconds: float = 30, retention_seconds: float = 120,
+                 max_runs: int = 1000):
+        """初始化注册表
+
+        Args:
+            buffer_size: 每个流保留的最近事件数
+            grace_seconds: 没有客户端连接时生成继续运行的时间（秒）
+            retention_seconds: 生成结束后保留事件的时间（秒）
+            max_runs: 最多保留的运行记录数，超出时淘汰最早已结束的记录
+        """
+        self.buffer_size = buffer_size
+        self.grace_seconds = grace_seconds
+        self.retention_seconds = retention_seconds
+        self.max_runs = max_runs
+        self._runs: "OrderedDict[str, StreamRun]" = OrderedDict()
+        self._timers = {}
+
+    def start(self, stream: AsyncGenerator[bytes, None], on_done: Optional[Callable[[], None]] = None,
+              owner: Optional[str] = None, thread_id: Optional[str] = None) -> StreamRun:
+        """在后台任务中运行 stream，事件写入新的环形缓冲区
+
+        Args:
+            stream: 事件流
+            on_done: 生成结束（完成、出错或被取消）后的回调，例如释放准入名额
+            owner: 发起方标识（准入 key），只有同一发起方可以重连
+            thread_id: 发起时的对话线程ID
+
+        Returns:
+            StreamRun: 运行记录，stream_id 用于续传
+        """
+        run = StreamRun(uuid.uuid4().hex, self.buffer_size, owner, thread_id)
+        run.task = asyncio.create_task(self._pump(run, stream, on_done))
+        self._runs[run.stream_id] = run
+        # 首个客户端一直没有连接（例如响应未发出前断开）时，同样在宽限期后取消生成
+        self._schedule_abandon(run)
+        self._evict()
+        metrics.set_gauge("resumable_streams", len(self._runs))
+        return run
+
+    def get(self, stream_id: str) -> Optional[StreamRun]:
+        return self._runs.get(stream_id)
+
+    @staticmethod
+    def parse_event_id(event_id: str) -> Optional[Tuple[str, int]]:
+        """解析 Last-Event-ID（{stream_id}:{seq}），格式不正确时返回 None"""
+        stream_id, _, seq = (event_id or "").strip().rpartition(":")
+        if not stream_id or not seq.isdigit():
+            return None
+        return stream_id, int(seq)
+
+    async def subscribe(self, run: StreamRun, after_seq: int = 0) -> AsyncGenerator[bytes, None]:
+        """读取 after_seq 之后的事件，追上后继续等待新事件直到生成结束
+
+        读取速度落后超过缓冲区长度时（缺失的事件已被淘汰）提前结束，客户端重连会得到 410。
+        """
+        run.readers += 1
+        self._cancel_timer(run.stream_id)
+        if after_seq:
+            metrics.inc("resumable_streams_resumed_total")
+        try:
+            while True:
+                if not run.can_resume(after_seq):
+                    metrics.inc("resumable_streams_gap_total")
+                    logger.warning(f"Resumable stream {run.stream_id} reader fell behind at {after_seq}")
+                    return
+                pending = [(seq, chunk) for seq, chunk in run.events if seq > after_seq]
+                for seq, chunk in pending:
+                    after_seq = seq
+                    yield chunk
+                if run.done and after_seq >= run.seq:
+                    return
+                if not pending:
+                    await run.wait()
+        finally:
+            run.readers -= 1
+            if run.readers == 0 and not run.done:
+                # 没有客户端连接时保留生成一段时间，等待重连
+                self._schedule_abandon(run)
+
+    async def _pump(self, run: StreamRun, stream: AsyncGenerator[bytes, None], on_done: Optional[Callable[[], None]]):
+        try:
+            async for chunk in stream:
+                run.append(chunk)
+        except asyncio.CancelledError:
+            logger.info(f"Resumable stream {run.stream_id} cancelled")
+        except Exception as e:
+            logger.error(f"Resumable stream {run.stream_id} failed: {e}")
+        finally:
+            await stream.aclose()
+            run.finish()
+            self._cancel_timer(run.stream_id)
+            if on_done is not None:
+                on_done()
+            loop = asyncio.get_running_loop()
+            self._timers[run.stream_id] = loop.call_later(self.retention_seconds, self._remove, run.stream_id)
+
+    def _schedule_abandon(self, run: StreamRun):
+        """宽限期后若仍无客户端连接则取消生成"""
+        self._cancel_timer(run.stream_id)
+        loop = asyncio.get_running_loop()
+        self._timers[run.stream_id] = loop.call_later(self.grace_seconds, self._abandon, run)
+
+    def _abandon(self, run: StreamRun):
+        """宽限期内无人重连，取消生成"""
+        self._timers.pop(run.stream_id, None)
+        if run.readers == 0 and not run.done and run.task is not None:
+            metrics.inc("resumable_streams_abandoned_total")
+            run.task.cancel()
+
+    def _cancel_timer(self, stream_id: str):
+        timer = self._timers.pop(stream_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _remove(self, stream_id: str):
+        self._timers.pop(stream_id, None)
+        self._runs.pop(stream_id, None)
+        metrics.set_gauge("resumable_streams", len(self._runs))
+
+    def _evict(self):
+        while len(self._runs) > self.max_runs:
+            stream_id = next((sid for sid, run in self._runs.items() if run.done), None)
+            if stream_id is None:
+                break
+            self._cancel_timer(stream_id)
+            self._runs.pop(stream_id)
@@ -1,17 +1,47 @@
 import os
 import json
 import asyncio
+import hashlib
+import time
 import traceback
 import uuid
+from contextvars import ContextVar
 from typing import Dict, List, Optional, AsyncGenerator
 from dotenv import load_dotenv
 
-from packages import retriever, config
+from packages import retriever, config, knowledge_base
 from packages.core.memory.history import HistoryManager
-from packages.models import select_model
 from packages.utils.logging_config import logger
+from rag.cache.kb_version import kb_versions
 from rag.cache.redis_session import RedisSessionManager
-from rag.utils.coroutine_pool import CoroutinePool
+from rag.cache.redis_history import RedisHistoryStore
+from rag.cache.session_cache import CachedHistoryStore
+from rag.cache.response_cache import CachedResponse, ResponseCache
+from rag.cache.retrieval_cache import retrieval_cache
+from rag.cache.stream_buffer import ResumableStreams
+from rag.utils.admission import AdmissionController, AdmissionTicket
+from rag.utils.batch_runner import BatchRunner
+from rag.utils.context_builder import ContextBuilder, count_tokens, parse_budgets
+from rag.utils.circuit_breaker import CLOSED, CircuitBreaker, RequestBudget
+from rag.utils.metrics import StageTimer, metrics
+from rag.utils.stream_bridge import PrimedStream, StreamBridge
+from rag.utils.delta_coalescer import DeltaCoalescer
+from rag.utils.fake_model import FakeModel
+from rag.utils.sse_encoder import SSEEncoder
+from rag.utils.model_registry import ModelRegistry
+from rag.utils.model_router import ModelRouter
+from rag.service.title_service import TitleService
+
+
+# 并行检索的来源：(refs中的键, 启用该来源的meta字段, 检索器方法)
+RETRIEVAL_SOURCES = (
+    ("knowledge_base", "db_id", "query_knowledgebase"),
+    ("graph_base", "use_graph", "query_graph"),
+    ("web_search", "use_web", "query_web"),
+)
+
+# 当前请求的Redis耗时预算
+_redis_budget: ContextVar[Optional[RequestBudget]] = ContextVar("redis_budget", default=None)
 
 
 class ChatService:
@@ -34,27 +64,297 @@ class ChatService:
             logger.warning(f"Redis会话管理器初始化失败，将使用内存模式: {e}")
             self.redis_session = None
 
-        # 初始化协程池
-        self.coroutine_pool = CoroutinePool(
-            max_workers=int(os.getenv("MAX_CONCURRENT_CHATS", "20"))
+        # Redis熔断器：连续失败后直接跳过Redis，半开状态下放行探测请求
+        self.redis_breaker = CircuitBreaker(
+            "redis",
+            failure_threshold=int(os.getenv("REDIS_BREAKER_THRESHOLD", "3")),
+            reset_timeout=float(os.getenv("REDIS_BREAKER_RESET_TIMEOUT", "10"))
         )
+        # 单次Redis操作超时和单个请求的Redis总耗时预算（秒）
+        self.redis_op_timeout = float(os.getenv("REDIS_OP_TIMEOUT", "0.5"))
+        self.redis_request_budget = float(os.getenv("REDIS_REQUEST_BUDGET", "1.5"))
+
+        # 初始化会话历史存储（Redis列表，按轮数读取，一轮对话一次管道写入）
+        self.history_store = None
+        self.history_read_rounds = int(os.getenv("SESSION_HISTORY_ROUNDS", "10"))
+        if self.redis_session is not None:
+            try:
+                self.history_store = RedisHistoryStore(
+                    redis_url=os.getenv("REDIS_URL", "redis://localhost:6379"),
+                    expire_time=int(os.getenv("SESSION_EXPIRE_TIME", "3600")),
+                    max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "200"))
+                )
+                # 进程内热点会话缓存，写入异步批量回写Redis
+                if os.getenv("SESSION_CACHE_ENABLED", "true").lower() == "true":
+                    self.history_store = CachedHistoryStore(
+                        self.history_store,
+                        max_sessions=int(os.getenv("SESSION_CACHE_SIZE", "1000")),
+                        ttl=float(os.getenv("SESSION_CACHE_TTL", "300")),
+                        trust_seconds=float(os.getenv("SESSION_CACHE_TRUST_SECONDS", "2")),
+                        flush_interval_ms=int(os.getenv("SESSION_CACHE_FLUSH_MS", "50")),
+                        breaker=self.redis_breaker
+                    )
+            except Exception as e:
+                logger.warning(f"Redis历史存储初始化失败，将使用会话管理器读写历史: {e}")
+
+        # 初始化生成准入控制：限制并发生成数，超出时有界排队，按 key 轮转保证公平
+        self.admission = AdmissionController(
+            max_concurrent=int(os.getenv("MAX_CONCURRENT_CHATS", "20")),
+            max_queue=int(os.getenv("CHAT_QUEUE_SIZE", "100")),
+            queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", "10")),
+            per_key_limit=int(os.getenv("CHAT_PER_KEY_LIMIT", "4"))
+        )
+        # 准入公平性 key 只取自可信来源：来自可信代理（TRUSTED_PROXIES）的请求使用网关注入的租户头
+        # （ADMISSION_TENANT_HEADER）或代理追加的 X-Forwarded-For 最后一跳地址，直连请求使用连接地址
+        self.trusted_proxies = {ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+                                if ip.strip()}
+        self.admission_tenant_header = os.getenv("ADMISSION_TENANT_HEADER", "")
+
+        # 初始化模型流桥接器，避免同步模型调用阻塞事件循环
+        self.stream_bridge = StreamBridge(
+            max_workers=int(os.getenv("MAX_STREAM_THREADS", "256")),
+            queue_size=int(os.getenv("STREAM_QUEUE_SIZE", "64")),
+            max_calls=int(os.getenv("MAX_CALL_THREADS", "32"))
+        )
+
+        # 初始化模型注册表，按 (model_provider, model_name) 复用已初始化的模型客户端
+        # FAKE_MODEL_ENABLED=true 时注册本地假模型（model_provider="fake"），用于压测
+        providers = {}
+        if os.getenv("FAKE_MODEL_ENABLED", "false").lower() == "true":
+            fake_latency = float(os.getenv("FAKE_MODEL_LATENCY_MS", "200"))
+            providers["fake"] = lambda model_name=None: FakeModel(model_name, latency_ms=fake_latency)
+        self.model_registry = ModelRegistry(
+            max_size=int(os.getenv("MODEL_REGISTRY_SIZE", "16")),
+            providers=providers
+        )
+
+        # 模型路由：MODEL_ROUTES 中配置的等价端点按实时延迟/错误率分流，慢请求向其他端点对冲
+        self.model_router = ModelRouter(
+            self.model_registry,
+            self.stream_bridge,
+            groups=ModelRouter.parse_groups(os.getenv("MODEL_ROUTES")),
+            hedge_enabled=os.getenv("MODEL_HEDGE_ENABLED", "true").lower() == "true",
+            hedge_min_ms=float(os.getenv("MODEL_HEDGE_MIN_MS", "500")),
+            max_inflight=int(os.getenv("MODEL_ENDPOINT_MAX_INFLIGHT", "64"))
+        )
+
+        # 批量调用：单次请求的最大条数、并发和重试次数，以及每个模型提供商的全局并发上限
+        self.batch_max_queries = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+        self.batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+        self.batch_max_retries = int(os.getenv("BATCH_MAX_RETRIES", "2"))
+        self.provider_concurrency = int(os.getenv("BATCH_PROVIDER_CONCURRENCY", "32"))
+        self._provider_limits: Dict[str, asyncio.Semaphore] = {}
+
+        # 初始化后台标题生成服务，标题生成不占用聊天响应
+        self.title_service = TitleService(
+            self.model_registry,
+            self.stream_bridge,
+            on_title=self._save_session_title,
+            model_provider=os.getenv("TITLE_MODEL_PROVIDER") or None,
+            model_name=os.getenv("TITLE_MODEL_NAME") or None,
+            max_workers=int(os.getenv("TITLE_MAX_WORKERS", "2")),
+            batch_size=int(os.getenv("TITLE_BATCH_SIZE", "8")),
+            batch_wait_ms=int(os.getenv("TITLE_BATCH_WAIT_MS", "200"))
+        )
+
+        # 知识库版本号保存在Redis中，多个 worker 的响应缓存和检索缓存随知识库变更一起失效
+        if os.getenv("KB_VERSION_SYNC", "true").lower() == "true":
+            kb_versions.configure(os.getenv("REDIS_URL", "redis://localhost:6379"),
+                                  refresh_interval=float(os.getenv("KB_VERSION_REFRESH_MS", "1000")) / 1000)
+
+        # 问答响应缓存：精确匹配，配置相似度阈值后启用语义匹配
+        self.response_cache = None
+        if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true":
+            semantic_threshold = float(os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "0"))
+            self.response_cache = ResponseCache(
+                max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                semantic_threshold=semantic_threshold,
+                embed_fn=self._load_embed_fn() if semantic_threshold > 0 else None,
+                web_ttl=float(os.getenv("RESPONSE_CACHE_WEB_TTL", "300"))
+            )
+
+        # 按来源并行检索，每个来源有独立的截止时间（秒）
+        self.retrieval_fan_out = os.getenv("RETRIEVAL_FANOUT", "true").lower() == "true"
+        self.retrieval_deadlines = {
+            "knowledge_base": float(os.getenv("RETRIEVAL_DEADLINE_KB", "5")),
+            "graph_base": float(os.getenv("RETRIEVAL_DEADLINE_GRAPH", "5")),
+            "web_search": float(os.getenv("RETRIEVAL_DEADLINE_WEB", "8")),
+        }
+
+        # 流水线模式：检索期间预热模型连接，提示词就绪后立即打开模型流
+        self.pipeline_enabled = os.getenv("CHAT_PIPELINE", "false").lower() == "true"
+
+        # 按模型token预算裁剪历史和检索片段
+        self.context_builder = None
+        if os.getenv("CONTEXT_BUDGET_ENABLED", "true").lower() == "true":
+            self.context_builder = ContextBuilder(
+                default_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "16000")),
+                budgets=parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS")),
+                reserve_output=int(os.getenv("CONTEXT_RESERVE_OUTPUT", "1024")),
+                retrieval_ratio=float(os.getenv("CONTEXT_RETRIEVAL_RATIO", "0.5"))
+            )
+
+        # finished 事件格式：compact 只发送本轮消息ID、历史版本和引用摘要，full 为旧版完整载荷
+        self.finished_format = os.getenv("CHAT_FINISHED_FORMAT", "compact").lower()
+
+        # 客户端断开检测间隔（秒）；已完成回答的平均输出token数（指数滑动平均），用于估算断开后节省的token
+        self.disconnect_poll_interval = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+        self.output_tokens_ewma = None
+
+        # 可续传流：事件带 id，断线后携带 Last-Event-ID 重连可补发并继续接收
+        self.resumable_enabled = os.getenv("STREAM_RESUMABLE", "false").lower() == "true"
+        self.resumable_streams = ResumableStreams(
+            buffer_size=int(os.getenv("STREAM_RESUME_BUFFER", "1024")),
+            grace_seconds=float(os.getenv("STREAM_RESUME_GRACE", "30")),
+            retention_seconds=float(os.getenv("STREAM_RESUME_RETENTION", "120"))
+        )
+
+        # 初始化增量合并器，按时间窗口/字节上限合并细碎的模型增量
+        self.delta_coalescer = DeltaCoalescer(
+            window_ms=int(os.getenv("SSE_COALESCE_WINDOW_MS", "30")),
+            max_bytes=int(os.getenv("SSE_COALESCE_MAX_BYTES", "1024"))
+        )
+
+    @staticmethod
+    def _load_embed_fn():
+        """使用知识库的向量模型作为语义缓存的向量化函数"""
+        embed_model = getattr(knowledge_base, "embed_model", None)
+        if embed_model is None:
+            logger.warning("知识库向量模型不可用，语义缓存未启用")
+            return None
+        return lambda text: embed_model.encode([text])[0]
+
+    async def _embed_query(self, query: str) -> Optional[list]:
+        """计算问题向量，失败时返回None"""
+        try:
+            return await self.stream_bridge.run(self.response_cache.embed_fn, query)
+        except Exception as e:
+            logger.warning(f"问题向量化失败，跳过语义缓存: {e}")
+            return None
 
     async def safe_redis_operation(self, operation, *args, **kwargs):
-        """安全执行Redis操作，失败时返回None"""
+        """安全执行Redis操作，失败时返回None
+
+        熔断器打开或本请求的Redis耗时预算用尽时直接跳过，每次操作受 REDIS_OP_TIMEOUT 限制。
+        """
         if self.redis_session is None:
             return None
+
+        timeout = self.redis_op_timeout
+        budget = _redis_budget.get()
+        remaining = budget.remaining() if budget is not None else None
+        if remaining is not None:
+            if remaining <= 0:
+                metrics.inc("redis_budget_exhausted_total")
+                return None
+            timeout = min(timeout, remaining)
+
+        if not self.redis_breaker.allow():
+            return None
+
+        started = time.monotonic()
         try:
-            return await operation(*args, **kwargs)
+            result = await asyncio.wait_for(operation(*args, **kwargs), timeout)
         except Exception as e:
-            logger.warning(f"Redis操作失败: {e}")
+            self.redis_breaker.record_failure(time.monotonic() - started)
+            logger.warning(f"Redis操作失败: {e!r}")
             return None
+        except BaseException:
+            # 被取消（例如客户端断开）时既不算成功也不算失败，归还半开探测名额
+            self.redis_breaker.release()
+            raise
+        self.redis_breaker.record_success()
+        return result
+
+    async def _read_history(self, thread_id: str, rounds: Optional[int] = None) -> Optional[list]:
+        """从历史存储读取最近 rounds 轮历史
+
+        本地缓存可以直接命中时不经过 safe_redis_operation：没有访问Redis，不应计为熔断器的成功调用。
+        """
+        if isinstance(self.history_store, CachedHistoryStore):
+            # Redis熔断期间只使用本地缓存
+            history = (self.history_store.local(thread_id, rounds) if self.redis_breaker.state == CLOSED
+                       else self.history_store.peek(thread_id, rounds))
+            if history is not None:
+                return history
+        return await self.safe_redis_operation(self.history_store.get_recent, thread_id, rounds)
+
+    async def _load_history(self, thread_id: str, rounds: Optional[int] = None) -> Optional[list]:
+        """读取会话最近 rounds 轮历史，历史存储中没有记录时回退到会话管理器（兼容旧会话）"""
+        history = None
+        if self.history_store is not None:
+            history = await self._read_history(thread_id, rounds)
+        if not history:
+            history = await self._migrate_history(thread_id)
+            if history and rounds:
+                history = history[-rounds * 2:]
+        return history
+
+    async def _migrate_history(self, thread_id: str) -> Optional[list]:
+        """读取会话管理器中的旧格式历史，并在新一轮消息追加前复制到历史存储，避免追加后旧历史被遮蔽"""
+        history = await self.safe_redis_operation(self.redis_session.get_history, thread_id)
+        if history and self.history_store is not None:
+            if await self.safe_redis_operation(self.history_store.seed, thread_id, history):
+                logger.info(f"会话 {thread_id} 的 {len(history)} 条旧历史已迁移到历史存储")
+        return history
+
+    async def _save_messages(self, thread_id: str, messages: List[dict]) -> Optional[int]:
+        """保存一轮对话的消息，历史存储可用时只需一次管道提交
+
+        Returns:
+            Optional[int]: 保存后的历史版本号，无法确定时返回 None
+        """
+        if self.context_builder is not None:
+            # 随消息保存token数，后续轮次裁剪上下文时无需重新分词
+            messages = [self.context_builder.annotate(message) for message in messages]
+        if isinstance(self.history_store, CachedHistoryStore):
+            # 写入本地缓存后异步回写，不占用请求的Redis预算
+            return await self.history_store.append(thread_id, messages)
+        if self.history_store is not None:
+            return await self.safe_redis_operation(self.history_store.append, thread_id, messages)
+        for message in messages:
+            await self.safe_redis_operation(self.redis_session.add_message, thread_id, message["role"], message["content"])
+        return None
+
+    async def close(self):
+        """应用关闭时写出会话历史的待写消息"""
+        if isinstance(self.history_store, CachedHistoryStore):
+            await self.history_store.close()
+
+    def admission_key(self, headers, client_host: Optional[str]) -> Optional[str]:
+        """计算准入公平性 key，无法取得可信身份时返回 None（不受单 key 并发限制）
+
+        meta.tenant_id、thread_id 由客户端任意指定，不参与计算。
+
+        Args:
+            headers: 请求头
+            client_host: 连接的对端地址
+
+        Returns:
+            Optional[str]: "tenant:..." 或 "ip:..."
+        """
+        if client_host not in self.trusted_proxies:
+            return f"ip:{client_host}" if client_host else None
+        if self.admission_tenant_header and headers.get(self.admission_tenant_header):
+            return f"tenant:{headers.get(self.admission_tenant_header)}"
+        # 代理把对端地址追加在 X-Forwarded-For 末尾，之前的部分可能由客户端伪造
+        forwarded = (headers.get("X-Forwarded-For") or "").split(",")[-1].strip()
+        return f"ip:{forwarded}" if forwarded else None
 
     def need_retrieve(self, meta: dict) -> bool:
         """判断是否需要检索"""
         return meta.get("use_web") or meta.get("use_graph") or meta.get("db_id")
 
+    def use_delta_protocol(self, meta: dict) -> bool:
+        """判断客户端是否协商使用增量推理协议（meta.stream_protocol == "delta"）"""
+        return bool(meta) and meta.get("stream_protocol") == "delta"
+
     def make_chunk(self, content=None, meta=None, thread_id=None, **kwargs):
-        """创建SSE格式的响应数据块"""
+        """创建SSE格式的响应数据块
+
+        单个流内的事件应使用 SSEEncoder，外层字段只序列化一次。
+        """
         data = json.dumps({
             "response": content,
             "meta": meta or {},
@@ -64,38 +364,187 @@ class ChatService:
         # 返回SSE格式：data: {json_data}\n\n
         return f"data: {data}\n\n".encode('utf-8')
 
-    async def _handle_retrieval(self, query: str, history_messages: list, meta: dict, thread_id: str):
+    async def _handle_retrieval(self, query: str, history_messages: list, meta: dict, encoder: SSEEncoder,
+                                chunk_budget: Optional[int] = None):
         """处理检索逻辑
 
         Args:
             query: 用户查询
             history_messages: 历史消息
             meta: 元数据
-            thread_id: 会话ID
+            encoder: 当前流的SSE编码器
+            chunk_budget: 知识库片段的token预算
 
         Returns:
             tuple: (modified_query, refs, retrieved_docs)
         """
-        yield self.make_chunk(status="searching", meta=meta, thread_id=thread_id)
+        yield encoder.encode(status="searching")
 
         modified_query = query
         refs = None
-        retrieved_docs = []
+
+        if retriever and self._can_fan_out():
+            async for item in self._fan_out_retrieval(query, history_messages, meta, encoder, chunk_budget):
+                yield item
+            return
 
         try:
-            # 直接调用检索器
+            # 调用检索器，相同查询和知识库版本的结果直接复用缓存
             if retriever:
-                modified_query, refs = await retriever(modified_query, history_messages, meta)
+                namespace = f"chat:{chunk_budget}" if chunk_budget else "chat"
+                cache_key = retrieval_cache.make_key(namespace, query, meta, history_messages)
+
+                async def load():
+                    result_query, result_refs = await retriever(query, history_messages, meta)
+                    result_query, result_refs = await self._pack_retrieved(query, result_query, result_refs, meta,
+                                                                           chunk_budget)
+                    return result_query, self._without_meta(result_refs)
+
+                modified_query, refs = await retrieval_cache.get_or_load(cache_key, load, retrieval_cache.sources(meta))
+                refs = self._with_meta(refs, meta)
             else:
                 logger.warning("检索器未初始化，跳过检索")
                 refs = None
         except Exception as e:
             logger.error(f"Retriever error: {e}, {traceback.format_exc()}")
-            yield self.make_chunk(message=f"Retriever error: {e}", status="error", meta=meta, thread_id=thread_id)
+            yield encoder.encode(message=f"Retriever error: {e}", status="error")
             yield (modified_query, None, [])
             return
 
-        # 构造检索结果信息
+        # 最后yield结果元组
+        yield (modified_query, refs, self._format_retrieved_docs(refs))
+
+    async def _pack_retrieved(self, query: str, modified_query: str, refs, meta: dict, chunk_budget: Optional[int]):
+        """把单次检索结果中的知识库片段装入 chunk_budget，有片段被丢弃时用 construct_query 重新构造查询
+
+        检索器不提供 construct_query 时无法重新构造，保留原查询并计数（fit_messages 始终保留当前问题，
+        此时片段不受预算限制）。
+
+        Returns:
+            tuple: (modified_query, refs)
+        """
+        if not chunk_budget or self.context_builder is None or not isinstance(refs, dict):
+            return modified_query, refs
+        result = refs.get("knowledge_base")
+        packed = self.context_builder.pack_results(result, chunk_budget)
+        if packed is result or len(packed.get("results") or []) == len(result.get("results") or []):
+            return modified_query, refs
+        if not callable(getattr(retriever, "construct_query", None)):
+            metrics.inc("context_budget_unenforced_total")
+            logger.warning("检索器不支持 construct_query，知识库片段未按上下文预算裁剪")
+            return modified_query, refs
+        refs = {**refs, "knowledge_base": packed}
+        modified_query = retriever.construct_query(query, refs, meta)
+        if asyncio.iscoroutine(modified_query):
+            modified_query = await modified_query
+        return modified_query, refs
+
+    def _can_fan_out(self) -> bool:
+        """检索器提供分来源查询方法和查询构造方法时，才能按来源并行检索"""
+        if not self.retrieval_fan_out:
+            return False
+        methods = [method for _, _, method in RETRIEVAL_SOURCES] + ["construct_query"]
+        return all(callable(getattr(retriever, method, None)) for method in methods)
+
+    async def _query_source(self, method_name: str, query: str, history_messages: list, refs: dict):
+        """调用单个来源的检索方法，同步方法放到桥接线程池执行"""
+        method = getattr(retriever, method_name)
+        if asyncio.iscoroutinefunction(method):
+            return await method(query, history_messages, refs)
+        return await self.stream_bridge.run(method, query, history_messages, refs)
+
+    async def _fan_out_retrieval(self, query: str, history_messages: list, meta: dict, encoder: SSEEncoder,
+                                 chunk_budget: Optional[int] = None):
+        """按来源（知识库、图谱、网络）并行检索
+
+        每个来源有独立的截止时间，超时的来源被取消并丢弃；每个来源完成时立即发送一个
+        status=retrieved 的事件，包含该来源的 retrieved_docs。知识库片段在构造查询前按相关度装入 chunk_budget。
+
+        Yields:
+            bytes: 状态事件
+            tuple: 最后一个元素为 (modified_query, refs, retrieved_docs)
+        """
+        namespace = f"chat:{chunk_budget}" if chunk_budget else "chat"
+        cache_key = retrieval_cache.make_key(namespace, query, meta, history_messages)
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            modified_query, refs = cached
+            refs = self._with_meta(refs, meta)
+            yield (modified_query, refs, self._format_retrieved_docs(refs))
+            return
+
+        deadlines = {**self.retrieval_deadlines, **(meta.get("retrieval_deadlines") or {})}
+        refs = {"meta": meta}
+        tasks = {}
+        for name, flag, method in RETRIEVAL_SOURCES:
+            if meta.get(flag):
+                coro = self._query_source(method, query, history_messages, {"meta": meta})
+                tasks[asyncio.create_task(asyncio.wait_for(coro, float(deadlines[name])))] = name
+
+        retrieved_docs = []
+        complete = True
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = tasks[task]
+                    try:
+                        refs[name] = task.result()
+                    except asyncio.TimeoutError:
+                        complete = False
+                        logger.warning(f"Retrieval source {name} exceeded its deadline, result dropped")
+                        metrics.inc(f"retrieval_{name}_timeout_total")
+                        yield encoder.encode(status="retrieved", source=name, source_status="timeout", retrieved_docs=[])
+                        continue
+                    except Exception as e:
+                        complete = False
+                        logger.error(f"Retriever error in {name}: {e}, {traceback.format_exc()}")
+                        yield encoder.encode(status="retrieved", source=name, source_status="error", retrieved_docs=[])
+                        continue
+                    if name == "knowledge_base" and chunk_budget and self.context_builder is not None:
+                        refs[name] = self.context_builder.pack_results(refs[name], chunk_budget)
+                    docs = self._format_retrieved_docs({name: refs[name]})
+                    retrieved_docs.extend(docs)
+                    yield encoder.encode(status="retrieved", source=name, source_status="success", retrieved_docs=docs)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        try:
+            modified_query = retriever.construct_query(query, refs, meta)
+            if asyncio.iscoroutine(modified_query):
+                modified_query = await modified_query
+        except Exception as e:
+            logger.error(f"Retriever error: {e}, {traceback.format_exc()}")
+            yield encoder.encode(message=f"Retriever error: {e}", status="error")
+            yield (query, None, [])
+            return
+
+        # 只缓存所有来源都按时完成的结果
+        if complete:
+            retrieval_cache.put(cache_key, (modified_query, self._without_meta(refs)), retrieval_cache.sources(meta))
+        yield (modified_query, refs, retrieved_docs)
+
+    @staticmethod
+    def _without_meta(refs):
+        """写入检索缓存或响应缓存前移除请求的 meta（含 thread_id、system_prompt 等仅属于发起请求的字段）"""
+        if isinstance(refs, dict):
+            return {key: value for key, value in refs.items() if key != "meta"}
+        return refs
+
+    @staticmethod
+    def _with_meta(refs, meta: dict):
+        """为缓存的检索结果附加当前请求的 meta（返回新的字典，不修改缓存中的值）"""
+        if isinstance(refs, dict):
+            return {**refs, "meta": meta}
+        return refs
+
+    @staticmethod
+    def _format_retrieved_docs(refs: Optional[dict]) -> List[dict]:
+        """把检索结果整理为前端展示的召回文档列表"""
+        retrieved_docs = []
+
         # 处理知识库文档
         if refs and "knowledge_base" in refs and "results" in refs["knowledge_base"]:
             for doc in refs["knowledge_base"]["results"]:
@@ -119,38 +568,93 @@ class ChatService:
                         "label": node.get("label", "")
                     })
 
-        # 最后yield结果元组
-        yield (modified_query, refs, retrieved_docs)
+        return retrieved_docs
+
+    def use_compact_finished(self, meta: dict) -> bool:
+        """判断 finished 事件是否使用精简格式，meta.finished_format 优先于环境变量"""
+        return (meta.get("finished_format") or self.finished_format) == "compact"
+
+    @staticmethod
+    def refs_digest(refs) -> Optional[str]:
+        """检索引用的摘要，客户端据此判断是否需要重新获取引用"""
+        if not refs:
+            return None
+        payload = json.dumps(refs, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def use_resumable(self, meta: dict) -> bool:
+        """判断是否使用可续传流，meta.resumable 优先于环境变量"""
+        return bool(meta.get("resumable", self.resumable_enabled))
+
+    def use_pipeline(self, meta: dict) -> bool:
+        """判断是否启用流水线模式，meta.pipeline 优先于环境变量"""
+        return bool(meta.get("pipeline", self.pipeline_enabled))
+
+    def _open_model_stream(self, model, messages: list):
+        """打开模型流：在桥接线程中调用模型预测，通过异步队列获取流式输出，并合并细碎增量
+
+        模型配置了等价端点分组时经由路由层打开，首个增量最先到达的端点胜出。
+        """
+        model_key = self.model_registry.resolve_key()
+        if self.model_router.routes(model_key):
+            stream = self.model_router.stream(model_key, lambda routed: routed.predict(messages, stream=True))
+        else:
+            stream = self.stream_bridge.iterate(lambda: model.predict(messages, stream=True))
+        return self.delta_coalescer.coalesce(stream)
+
+    async def _warmup_model(self, model):
+        """预热模型连接（模型实现了 warmup 时），失败不影响正常请求"""
+        try:
+            await self.stream_bridge.run(model.warmup)
+        except Exception as e:
+            logger.debug(f"Model warmup failed: {e}")
 
-    async def _handle_generation(self, messages: list, meta: dict, thread_id: str):
+    async def _handle_generation(self, model, messages: list, meta: dict, encoder: SSEEncoder,
+                                 model_stream=None, timer: Optional[StageTimer] = None):
         """处理问答生成逻辑
 
         Args:
+            model: 本次请求解析得到的模型实例
             messages: 消息列表
             meta: 元数据
-            thread_id: 会话ID
+            encoder: 当前流的SSE编码器
+            model_stream: 已提前打开的模型流（流水线模式），为空时在此打开
+            timer: 阶段计时器，记录模型首字延迟
 
         Returns:
             tuple: (content, reasoning_content)
         """
-        model = select_model()
         content = ""
         reasoning_content = ""
+        reasoning_seq = 0
+        delta_protocol = self.use_delta_protocol(meta)
 
         try:
-            # 直接调用模型预测，获取流式输出
-            model_stream = model.predict(messages, stream=True)
+            if model_stream is None:
+                if timer:
+                    timer.start("model")
+                model_stream = self._open_model_stream(model, messages)
 
-            for delta in model_stream:
+            async for delta in model_stream:
                 # 确保delta是GeneralResponse对象
                 if not hasattr(delta, 'content'):
                     logger.warning(f"Unexpected delta type: {type(delta)}")
                     continue
 
+                if timer:
+                    timer.stop("model")
+                    timer.mark("ttft")
+
                 # 处理推理内容（如果存在）
                 if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
                     reasoning_content += delta.reasoning_content
-                    chunk = self.make_chunk(reasoning_content=reasoning_content, status="reasoning", meta=meta, thread_id=thread_id)
+                    if delta_protocol:
+                        # 增量协议：只发送本次推理增量和序号
+                        reasoning_seq += 1
+                        chunk = encoder.encode(reasoning_delta=delta.reasoning_content, seq=reasoning_seq,
+                                               status="reasoning")
+                    else:
+                        chunk = encoder.encode(reasoning_content=reasoning_content, status="reasoning")
                     yield chunk
                     # 如果只有推理内容，继续下一个循环
                     if not delta.content:
@@ -166,72 +670,51 @@ class ChatService:
 
                 # 发送增量内容（只有当有内容时才发送）
                 if delta.content:
-                    chunk = self.make_chunk(content=delta.content, status="loading", meta=meta, thread_id=thread_id)
+                    chunk = encoder.encode(content=delta.content, status="loading")
                     yield chunk
 
             logger.debug(f"Final response: {content}")
             logger.debug(f"Final reasoning response: {reasoning_content}")
 
+            output_tokens = count_tokens(content) + count_tokens(reasoning_content)
+            metrics.observe("chat_output_tokens", output_tokens)
+            self.output_tokens_ewma = output_tokens if self.output_tokens_ewma is None \
+                else 0.9 * self.output_tokens_ewma + 0.1 * output_tokens
+
             # 最后yield结果元组
             yield (content, reasoning_content)
 
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开：记录已生成的token，并按平均回答长度估算节省的token
+            generated = count_tokens(content) + count_tokens(reasoning_content)
+            metrics.inc("chat_cancelled_generation_total")
+            metrics.observe("chat_cancelled_output_tokens", generated)
+            if self.output_tokens_ewma is not None:
+                metrics.inc("chat_tokens_saved_total", max(int(self.output_tokens_ewma) - generated, 0))
+            logger.info(f"Generation cancelled after {generated} tokens")
+            raise
         except Exception as e:
             logger.error(f"Model error: {e}, {traceback.format_exc()}")
-            yield self.make_chunk(message=f"Model error: {e}", status="error", meta=meta, thread_id=thread_id)
+            yield encoder.encode(message=f"Model error: {e}", status="error")
             raise e
+        finally:
+            # 客户端断开或提前退出时，立即停止桥接线程中的模型流
+            if model_stream is not None:
+                await model_stream.aclose()
 
-    async def _generate_session_title(self, query: str, response: str, thread_id: str, meta: dict):
-        """生成会话标题
+    async def _save_session_title(self, thread_id: str, title: str):
+        """标题生成完成后的回调，更新Redis中的会话标题"""
+        if self.redis_session is None:
+            return
+        await self.safe_redis_operation(self.redis_session.update_session_title, thread_id, title)
 
-        Args:
-            query: 用户问题
-            response: 助手回答
-            thread_id: 会话ID
-            meta: 元数据
-        """
+    async def admitted_stream(self, ticket: AdmissionTicket, stream: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+        """在准入名额内消费流，流结束或被关闭时释放名额"""
         try:
-            yield self.make_chunk(status="title_generating", meta=meta, thread_id=thread_id)
-
-            # 构造标题生成提示
-            title_prompt = f"""请根据以下对话内容，生成一个简洁的会话标题（不超过20个字符）：
-
-                用户问题：{query}
-                助手回答：{response[:200]}...
-
-                要求：
-                1. 标题要简洁明了，能概括对话主题
-                2. 不超过20个字符
-                3. 不要包含标点符号
-                4. 直接返回标题，不要其他内容
-
-                标题："""
-
-            # 使用简化的模型调用生成标题
-            model = select_model()
-            title_response = model.predict(title_prompt)
-            title = title_response.content.strip()
-
-            # 清理标题，确保符合要求
-            title = title.replace("标题：", "").replace("：", "").replace(":", "").strip()
-            if len(title) > 20:
-                title = title[:20]
-
-            if not title:
-                title = "新对话"
-
-            # 更新Redis中的会话标题
-            await self.safe_redis_operation(self.redis_session.update_session_title, thread_id, title)
-
-            # 返回标题生成完成状态
-            yield self.make_chunk(status="title_generated", title=title, meta=meta, thread_id=thread_id)
-
-        except Exception as e:
-            logger.error(f"Title generation error: {e}")
-            # 如果标题生成失败，使用默认标题
-            default_title = "新对话"
-            await self.safe_redis_operation(self.redis_session.update_session_title, thread_id, default_title)
-            # 即使失败也要发送标题生成完成状态
-            yield self.make_chunk(status="title_generated", title=default_title, meta=meta, thread_id=thread_id)
+            async for chunk in stream:
+                yield chunk
+        finally:
+            ticket.release()
 
     async def process_chat_stream(self, query: str, meta: dict = None, history: List[dict] = None, thread_id: str = None) -> AsyncGenerator[bytes, None]:
         """处理聊天请求的主要逻辑，返回流式响应
@@ -246,15 +729,29 @@ class ChatService:
             bytes: 流式响应数据块
         """
         meta = meta or {}
-        model = select_model()
+        _redis_budget.set(RequestBudget(self.redis_request_budget))
+        timer = StageTimer("chat_stage")
+        pipelined = self.use_pipeline(meta)
+
+        # 每个请求只解析一次模型，并在整个流程中复用
+        model = self.model_registry.get()
         meta["server_model_name"] = model.model_name
 
+        # 流水线模式下，在会话加载和检索期间预热模型连接
+        warmup_task = None
+        if pipelined and callable(getattr(model, "warmup", None)):
+            warmup_task = asyncio.create_task(self._warmup_model(model))
+
         # 标记是否为新会话
         is_new_session = False
 
+        # 客户端传入的历史只保留 role/content：其中的 token 计数等字段不可信，由服务端重新计算
+        if history:
+            history = [ContextBuilder.strip(message) for message in history if isinstance(message, dict)]
+
         # 会话管理逻辑
         if thread_id and self.redis_session:
-            cached_history = await self.safe_redis_operation(self.redis_session.get_history, thread_id)
+            cached_history = await self._load_history(thread_id, meta.get("history_round") or self.history_read_rounds)
             if cached_history and not history:
                 history = cached_history
                 logger.debug(f"Using cached history for thread_id: {thread_id}")
@@ -273,40 +770,95 @@ class ChatService:
 
         # 初始化历史管理器
         history_manager = HistoryManager(history, system_prompt=meta.get("system_prompt"))
+        # 保存的历史消息带有消息ID和token计数，进入提示词、检索和缓存作用域前只保留 role/content
+        prompt_history = [ContextBuilder.strip(message) for message in history_manager.messages]
         logger.debug(f"Received query: {query} with meta: {meta}")
 
+        # 本次流的SSE编码器，meta和thread_id只序列化一次
+        encoder = SSEEncoder(meta, thread_id)
+
         modified_query = query
         refs = None
         retrieved_docs = []
 
-        # 1. 处理检索阶段
-        if meta and self.need_retrieve(meta):
-            async for chunk in self._handle_retrieval(query, history_manager.messages, meta, thread_id):
-                if isinstance(chunk, tuple):
-                    # 如果返回的是结果元组
-                    modified_query, refs, retrieved_docs = chunk
-                    break
-                else:
-                    # 如果是状态更新chunk
+        # 0. 查询响应缓存，命中时按正常流程回放
+        cache_scope = cache_key = query_embedding = None
+        if self.response_cache is not None and self.response_cache.cacheable(meta):
+            cache_scope = self.response_cache.make_scope(self.model_registry.resolve_key(), meta, prompt_history)
+            cache_key = self.response_cache.make_key(query, cache_scope)
+            cached = self.response_cache.get(cache_key)
+            if cached is None and self.response_cache.semantic_enabled:
+                query_embedding = await self._embed_query(query)
+                if query_embedding is not None:
+                    cached = self.response_cache.get_similar(cache_scope, query_embedding)
+            if cached is not None:
+                async for chunk in self._replay_cached(cached, query, history_manager, thread_id, is_new_session, meta, encoder):
                     yield chunk
+                return
 
-            # 在generating阶段返回检索结果
-            yield self.make_chunk(status="generating", retrieved_docs=retrieved_docs, meta=meta, thread_id=thread_id)
-        else:
-            yield self.make_chunk(status="generating", meta=meta, thread_id=thread_id)
+        # 按模型计算本次请求的上下文token预算
+        context_budget = None
+        if self.context_builder is not None:
+            context_budget = self.context_builder.budget_for(self.model_registry.resolve_key(), meta)
 
-        # 2. 准备消息和更新历史
+        # 1. 处理检索阶段
+        retrieving = bool(meta and self.need_retrieve(meta))
+        if retrieving:
+            timer.start("retrieval")
+            chunk_budget = self.context_builder.chunk_budget(context_budget) if context_budget else None
+            try:
+                async for chunk in self._handle_retrieval(query, prompt_history, meta, encoder, chunk_budget):
+                    if isinstance(chunk, tuple):
+                        # 如果返回的是结果元组
+                        modified_query, refs, retrieved_docs = chunk
+                        break
+                    else:
+                        # 如果是状态更新chunk
+                        yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                # 客户端断开时检索被取消，不再进入生成阶段
+                metrics.inc("chat_cancelled_retrieval_total")
+                raise
+            timer.stop("retrieval")
+
+            # 检索器可能修改meta，重新编码外层字段
+            encoder.update(meta=meta)
+
+        # 2. 准备消息
+        timer.start("prompt")
         messages = history_manager.get_history_with_msg(modified_query, max_rounds=meta.get('history_round'))
-        history_manager.add_user(query)  # 注意这里使用原始查询
+        if context_budget is not None:
+            messages = self.context_builder.fit_messages(messages, context_budget)
+        else:
+            messages = [ContextBuilder.strip(message) for message in messages]
+        timer.stop("prompt")
 
-        # 更新Redis中的会话历史（使用安全操作）
-        await self.safe_redis_operation(self.redis_session.add_message, thread_id, "user", query)
+        # 流水线模式：提示词就绪后立即打开模型流并开始等待首个增量，
+        # 发送 generating 事件、更新历史等工作与模型首字延迟重叠
+        model_stream = None
+        if pipelined:
+            timer.start("model")
+            model_stream = PrimedStream(self._open_model_stream(model, messages))
+
+        try:
+            if retrieving:
+                # 在generating阶段返回检索结果
+                yield encoder.encode(status="generating", retrieved_docs=retrieved_docs)
+            else:
+                yield encoder.encode(status="generating")
+        except BaseException:
+            if model_stream is not None:
+                await model_stream.aclose()
+            raise
+
+        history_manager.add_user(query)  # 注意这里使用原始查询
 
         # 3. 处理生成阶段
         content = ""
         reasoning_content = ""
         try:
-            async for chunk in self._handle_generation(messages, meta, thread_id):
+            async for chunk in self._handle_generation(model, messages, meta, encoder,
+                                                       model_stream=model_stream, timer=timer):
                 if isinstance(chunk, tuple):
                     # 如果返回的是结果元组
                     content, reasoning_content = chunk
@@ -315,28 +867,108 @@ class ChatService:
                     # 如果是状态更新chunk
                     yield chunk
 
-            # 更新历史管理器
-            history_manager.update_ai(content)
-
-            # 更新Redis中的会话历史（使用安全操作）
-            await self.safe_redis_operation(self.redis_session.add_message, thread_id, "assistant", content)
-
-            # 发送完成状态
-            yield self.make_chunk(status="finished",
-                                history=history_manager.messages,
-                                refs=refs,
-                                meta=meta,
-                                thread_id=thread_id)
-
-            # 4. 如果是新会话，生成标题
-            if is_new_session and content and query:
-                async for chunk in self._generate_session_title(query, content, thread_id, meta):
-                    yield chunk
+            # 写入响应缓存
+            if cache_key is not None and content:
+                self.response_cache.put(
+                    cache_key, cache_scope,
+                    CachedResponse(content, reasoning_content, self._without_meta(refs), retrieved_docs),
+                    sources=self.response_cache.sources(meta),
+                    embedding=query_embedding,
+                    ttl=self.response_cache.ttl_for(meta)
+                )
+
+            # 4. 保存历史、发送完成状态、生成标题
+            extra = {"timings": timer.stages} if meta.get("return_timings") else {}
+            async for chunk in self._complete_turn(query, content, reasoning_content, refs, history_manager,
+                                                   thread_id, is_new_session, meta, encoder, **extra):
+                yield chunk
 
         except Exception as e:
             logger.error(f"Model error: {e}, {traceback.format_exc()}")
-            yield self.make_chunk(message=f"Model error: {e}", status="error", meta=meta, thread_id=thread_id)
+            # 生成失败时仍然保存用户消息
+            await self._save_messages(thread_id, [{"role": "user", "content": query}])
+            yield encoder.encode(message=f"Model error: {e}", status="error")
             return
+        finally:
+            if warmup_task is not None and not warmup_task.done():
+                warmup_task.cancel()
+            logger.debug(f"Chat stage timings (pipelined={pipelined}): {timer.stages}")
+
+    async def _complete_turn(self, query: str, content: str, reasoning_content: str, refs, history_manager: HistoryManager,
+                             thread_id: str, is_new_session: bool, meta: dict, encoder: SSEEncoder, **extra):
+        """完成一轮对话：保存历史、发送完成状态，新会话提交标题生成任务
+
+        Args:
+            query: 用户原始问题
+            content: 回答内容
+            reasoning_content: 推理内容
+            refs: 检索结果
+            history_manager: 历史管理器（已添加用户消息）
+            thread_id: 会话ID
+            is_new_session: 是否为新会话
+            meta: 元数据
+            encoder: 当前流的SSE编码器
+            **extra: finished 事件的附加字段
+        """
+        # 更新历史管理器
+        history_manager.update_ai(content)
+
+        # 用户和助手消息一起写入Redis（使用安全操作），消息ID用于按需获取历史和引用
+        user_id, assistant_id = uuid.uuid4().hex, uuid.uuid4().hex
+        history_version = await self._save_messages(thread_id, [
+            {"id": user_id, "role": "user", "content": query},
+            {"id": assistant_id, "role": "assistant", "content": content},
+        ])
+        if refs and self.history_store is not None:
+            await self.safe_redis_operation(self.history_store.save_refs, thread_id, assistant_id, refs)
+
+        # 发送完成状态
+        if self.use_delta_protocol(meta):
+            # 增量协议下附带推理内容的长度和校验值，供客户端校验拼接结果
+            reasoning_bytes = reasoning_content.encode("utf-8")
+            extra["reasoning_bytes"] = len(reasoning_bytes)
+            extra["reasoning_sha256"] = hashlib.sha256(reasoning_bytes).hexdigest()
+        if self.use_compact_finished(meta):
+            # 完整历史和引用通过 /chat/sessions/{thread_id}/history 和 /refs 按需分页获取
+            yield encoder.encode(status="finished",
+                                 turn={"user_id": user_id, "assistant_id": assistant_id},
+                                 history_version=history_version,
+                                 refs_digest=self.refs_digest(refs),
+                                 **extra)
+        else:
+            yield encoder.encode(status="finished",
+                                 history=history_manager.messages,
+                                 refs=refs,
+                                 **extra)
+
+        # 如果是新会话，提交后台标题生成任务，客户端通过 /chat/sessions/{thread_id}/title 获取
+        if is_new_session and content and query:
+            if self.title_service.submit(thread_id, query, content):
+                yield encoder.encode(status="title_generating")
+
+    async def _replay_cached(self, cached: CachedResponse, query: str, history_manager: HistoryManager,
+                             thread_id: str, is_new_session: bool, meta: dict, encoder: SSEEncoder):
+        """以正常的SSE事件序列回放缓存的回答，finished 事件带 cached=True"""
+        if self.need_retrieve(meta):
+            yield encoder.encode(status="searching")
+            yield encoder.encode(status="generating", retrieved_docs=cached.retrieved_docs)
+        else:
+            yield encoder.encode(status="generating")
+
+        history_manager.add_user(query)
+        if cached.reasoning_content:
+            if self.use_delta_protocol(meta):
+                yield encoder.encode(reasoning_delta=cached.reasoning_content, seq=1, status="reasoning")
+            else:
+                yield encoder.encode(reasoning_content=cached.reasoning_content, status="reasoning")
+        for start in range(0, len(cached.content), 256):
+            yield encoder.encode(content=cached.content[start:start + 256], status="loading")
+
+        # 缓存的 refs 不含发起请求的 meta，回放时附加当前请求的 meta
+        refs = self._with_meta(cached.refs, meta)
+        async for chunk in self._complete_turn(query, cached.content, cached.reasoning_content, refs, history_manager,
+                                               thread_id, is_new_session, meta, encoder, cached=True):
+            yield chunk
 
     async def call_model(self, query: str, meta: dict = None) -> dict:
         """直接调用模型进行预测
@@ -349,17 +981,87 @@ class ChatService:
             dict: 包含响应内容的字典
         """
         meta = meta or {}
-        model = select_model(model_provider=meta.get("model_provider"), model_name=meta.get("model_name"))
+        model_provider, model_name = meta.get("model_provider"), meta.get("model_name")
+        model_key = self.model_registry.resolve_key(model_provider, model_name)
+        # 未配置的模型直接拒绝（ValueError），不进入缓存和注册表
+        self.model_registry.validate(*model_key)
+
+        # 只使用精确匹配缓存：批量调用的提示词往往只差个别指标，语义匹配容易误命中
+        cache_key = None
+        if self.response_cache is not None and self.response_cache.cacheable(meta):
+            cache_scope = self.response_cache.make_scope(model_key, {})
+            cache_key = self.response_cache.make_key(query, cache_scope, normalize=False)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return {"response": cached.content, "cached": True}
 
         try:
-            # 直接调用模型预测
-            response = model.predict(query)
+            if self.model_router.routes(model_key):
+                # 在等价端点间分流和对冲
+                response = await self.model_router.call(model_key, lambda routed: routed.predict(query))
+            else:
+                # 在桥接线程池中调用模型预测
+                model = self.model_registry.get(model_provider=model_provider, model_name=model_name)
+                response = await self.stream_bridge.run(model.predict, query)
             logger.debug({"query": query, "response": response.content})
+            if cache_key is not None and response.content:
+                self.response_cache.put(cache_key, cache_scope, CachedResponse(response.content))
             return {"response": response.content}
         except Exception as e:
             logger.error(f"Model prediction error: {e}")
             raise Exception(f"Model prediction failed: {str(e)}")
 
+    async def batch_call(self, queries: List[str], meta: dict = None, concurrency: int = None,
+                         ordered: bool = False, max_retries: int = None,
+                         admission_key: Optional[str] = None) -> AsyncGenerator[dict, None]:
+        """批量调用模型，结果按完成顺序（或输入顺序）逐条返回
+
+        每个并发调用各自申请一个生成名额，与单条对话共享总并发和单 key 并发限制；
+        名额不足时调用排队，排队被拒绝的调用按重试规则重试。
+
+        Args:
+            queries: 查询列表，共享同一个 meta
+            meta: 元数据，包含模型配置
+            concurrency: 本批次的并发数，不超过 BATCH_CONCURRENCY
+            ordered: 是否按输入顺序返回
+            max_retries: 单条失败后的最大重试次数
+            admission_key: 准入控制的 key（见 admission_key）
+
+        Yields:
+            dict: 每条的结果（index、query、response 或 error、attempts、elapsed_ms），最后一条为汇总（done=True）
+        """
+        meta = meta or {}
+        provider = self.model_registry.resolve_key(meta.get("model_provider"), meta.get("model_name"))[0] or "default"
+        limit = self._provider_limits.setdefault(provider, asyncio.Semaphore(self.provider_concurrency))
+
+        async def call(query: str) -> dict:
+            ticket = await self.admission.acquire(admission_key)
+            try:
+                # 同一提供商的所有批次共享并发上限
+                async with limit:
+                    return await self.call_model(query, meta)
+            finally:
+                ticket.release()
+
+        runner = BatchRunner(
+            call,
+            concurrency=min(concurrency or self.batch_concurrency, self.batch_concurrency),
+            max_retries=self.batch_max_retries if max_retries is None else min(max_retries, self.batch_max_retries)
+        )
+        started = time.monotonic()
+        succeeded = failed = 0
+        async for result in runner.run(queries, ordered=ordered):
+            result = {"index": result.pop("index"), "query": result.pop("input"), **result}
+            if "error" in result:
+                failed += 1
+            else:
+                succeeded += 1
+            yield result
+        elapsed = time.monotonic() - started
+        metrics.observe("batch_throughput_qps", len(queries) / elapsed if elapsed else 0)
+        yield {"done": True, "total": len(queries), "succeeded": succeeded, "failed": failed,
+               "elapsed_ms": round(elapsed * 1000, 1)}
+
     async def get_session(self, thread_id: str) -> dict:
         """获取指定会话的历史记录
 
@@ -376,11 +1078,80 @@ class ChatService:
             session = await self.redis_session.get_session(thread_id)
             if not session:
                 raise Exception("Session not found")
+            if self.history_store is not None:
+                history = await self._read_history(thread_id)
+                if not history:
+                    await self._migrate_history(thread_id)
+                    history = await self._read_history(thread_id)
+                if history:
+                    session["history"] = history
             return session
         except Exception as e:
             logger.error(f"Error getting session: {e}")
             raise Exception(str(e))
 
+    async def get_session_history(self, thread_id: str, offset: int = 0, limit: int = 50) -> dict:
+        """分页获取会话历史（从最早一条保留的消息开始）
+
+        Args:
+            thread_id: 会话ID
+            offset: 起始位置
+            limit: 每页条数
+
+        Returns:
+            dict: 包含 messages、total、offset、limit 的字典
+        """
+        if self.history_store is not None:
+            local = self.history_store.local(thread_id) if isinstance(self.history_store, CachedHistoryStore) else None
+            if local:
+                result = local[offset:offset + limit], len(local)
+            else:
+                result = await self.safe_redis_operation(self.history_store.get_range, thread_id, offset, limit)
+            if result is not None and result[1]:
+                messages, total = result
+                return {"thread_id": thread_id, "messages": messages, "total": total, "offset": offset, "limit": limit}
+        if not self.redis_session:
+            raise Exception("Redis session manager not available")
+        history = await self._migrate_history(thread_id) or []
+        return {"thread_id": thread_id, "messages": history[offset:offset + limit], "total": len(history),
+                "offset": offset, "limit": limit}
+
+    async def get_session_refs(self, thread_id: str, offset: int = 0, limit: int = 20, turn_id: str = None) -> dict:
+        """分页获取会话各轮回答的检索引用
+
+        Args:
+            thread_id: 会话ID
+            offset: 起始位置
+            limit: 每页轮数
+            turn_id: 只获取指定助手消息的引用
+
+        Returns:
+            dict: 包含 items（{"turn_id", "refs"} 列表）、total、offset、limit 的字典
+        """
+        if self.history_store is None:
+            raise Exception("History store not available")
+        result = await self.safe_redis_operation(self.history_store.get_refs, thread_id, offset, limit, turn_id)
+        if result is None:
+            raise Exception("History store not available")
+        items, total = result
+        return {"thread_id": thread_id, "items": items, "total": total, "offset": offset, "limit": limit}
+
+    async def get_session_title(self, thread_id: str) -> dict:
+        """获取指定会话的标题
+
+        Args:
+            thread_id: 会话ID
+
+        Returns:
+            dict: 包含 status（pending / generated / unknown）和 title 的字典
+        """
+        status, title = self.title_service.get_title(thread_id)
+        if status == "unknown" and self.redis_session is not None:
+            session = await self.safe_redis_operation(self.redis_session.get_session, thread_id)
+            if session and session.get("title"):
+                status, title = "generated", session["title"]
+        return {"thread_id": thread_id, "status": status, "title": title}
+
     async def delete_session(self, thread_id: str) -> dict:
         """删除指定会话
 
@@ -395,6 +1166,8 @@ class ChatService:
 
         try:
             result = await self.redis_session.delete_session(thread_id)
+            if self.history_store is not None:
+                await self.safe_redis_operation(self.history_store.delete, thread_id)
             if not result:
                 raise Exception("Session not found")
             return {"success": True}
@@ -411,7 +1184,7 @@ class ChatService:
         Returns:
             dict: 模型列表
         """
-        model = select_model(model_provider=model_provider)
+        model = self.model_registry.get(model_provider=model_provider)
         return {"models": model.get_models()}
 
     def update_chat_models(self, model_provider: str, model_names: List[str]) -> dict:
@@ -426,4 +1199,6 @@ class ChatService:
         """
         config.model_names[model_provider]["models"] = model_names
         config._save_models_to_file()
+        # 移除该提供商已缓存的模型实例，之后的请求按新配置创建；进行中的请求继续使用旧实例，不主动关闭
+        self.model_registry.invalidate(model_provider, close=False)
         return {"models": config.model_names[model_provider]["models"]}
\ No newline at end of file
@@ -1,9 +1,23 @@
 import os
 import asyncio
+import functools
+import hashlib
 import traceback
-from typing import List, Optional, Dict, Any
-from packages.utils import logger, hashstr
+import uuid
+from typing import Any, AsyncGenerator, Callable, AsyncIterator, Dict, List, Optional, Tuple, Union
+from packages.utils import logger
 from packages import config, executor, retriever, knowledge_base
+from rag.cache.content_index import INGESTED, ContentIndex, InflightIngests
+from rag.cache.ingest_jobs import IngestJobStore
+from rag.cache.kb_version import kb_versions
+from rag.cache.retrieval_cache import retrieval_cache
+from rag.utils.chunk_engine import DEFAULT_PARSER, ChunkEngine, chunk_one, chunk_with_knowledge_base, is_text_file
+from rag.utils import embedding_pipeline
+from rag.utils.chunked_upload import (FORM_OVERHEAD_BYTES, MultipartUploads, UploadTooLarge, hash_file, iter_bytes,
+                                      iter_upload, write_stream)
+from rag.utils.fake_model import FakeEmbedder
+from rag.utils.ingest_queue import IngestQueue
+from rag.utils.metrics import metrics
 
 
 class DataService:
@@ -11,7 +25,80 @@ class DataService:
 
     def __init__(self):
         """初始化数据服务"""
-        pass
+        # 知识库版本号保存在Redis中，多个 worker 的响应缓存和检索缓存随知识库变更一起失效
+        if os.getenv("KB_VERSION_SYNC", "true").lower() == "true":
+            kb_versions.configure(os.getenv("REDIS_URL", "redis://localhost:6379"),
+                                  refresh_interval=float(os.getenv("KB_VERSION_REFRESH_MS", "1000")) / 1000)
+
+        # 上传按固定大小分块写盘，边写边计算sha256；超过上限的文件直接拒绝
+        self.upload_chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+        self.upload_max_bytes = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+        # 大文件的可续传分片上传，分片暂存在上传目录下
+        self.multipart_uploads = MultipartUploads(
+            root=os.path.join(config.save_dir, "data", "uploads", ".multipart"),
+            part_size=int(os.getenv("UPLOAD_PART_SIZE", str(16 * 1024 * 1024))),
+            max_bytes=self.upload_max_bytes,
+            max_parts=int(os.getenv("UPLOAD_MAX_PARTS", "10000")),
+            ttl=float(os.getenv("UPLOAD_MULTIPART_TTL", "86400"))
+        )
+        # 内容哈希索引：相同内容只保存、入库一次；入库时客户端指明被替换的 file_id 才删除旧版本
+        self.content_index = ContentIndex(
+            os.getenv("CONTENT_INDEX_PATH", os.path.join(config.save_dir, "data", "content_index.db"))
+        )
+        # 按原始文件名自动识别旧版本并替换（同名的不同文档会被当作修订删除，仅适用于文件名唯一的知识库）
+        self.replace_revisions = os.getenv("INGEST_REPLACE_REVISIONS", "false").lower() == "true"
+        # 文件解析/分块，结果按内容哈希+分块参数缓存（最多 CHUNK_CACHE_MAX_MB，超出时淘汰最久未用的结果）。
+        # 解析函数 CHUNK_PARSER（"模块:函数"）在进程池中并行（CHUNK_WORKERS），子进程只导入该函数；
+        # 未配置时使用内置的纯文本切分函数，只处理文本类文件，PDF/DOCX 等仍在线程池中调用 knowledge_base.file_to_chunk；
+        # CHUNK_PARSER=none 时全部在线程池中分块
+        chunk_cache_enabled = os.getenv("CHUNK_CACHE_ENABLED", "true").lower() == "true"
+        chunk_parser = os.getenv("CHUNK_PARSER", DEFAULT_PARSER)
+        if chunk_parser.lower() == "none":
+            chunk_parser = ""
+            logger.info("CHUNK_PARSER=none，文件分块在线程池中执行")
+        self.chunk_engine = ChunkEngine(
+            chunk_fn=functools.partial(chunk_one, parser=chunk_parser) if chunk_parser else chunk_with_knowledge_base,
+            workers=int(os.getenv("CHUNK_WORKERS", str(min(4, os.cpu_count() or 1)))) if chunk_parser else 0,
+            cache_dir=os.getenv("CHUNK_CACHE_DIR", os.path.join(config.save_dir, "data", "chunk_cache"))
+            if chunk_cache_enabled else None,
+            fallback_executor=executor,
+            accepts=is_text_file if chunk_parser == DEFAULT_PARSER else None,
+            cache_max_bytes=int(float(os.getenv("CHUNK_CACHE_MAX_MB", "1024")) * 1024 * 1024),
+            hash_fn=self._content_hash
+        )
+        # 正在入库的 (db_id, 内容哈希)，并行处理的任务中相同内容只入库一次，其余等待其结果
+        self._ingesting = InflightIngests()
+        # 入库任务队列：按文件并行处理（INGEST_CONCURRENCY），任务状态保存在本地 sqlite，重启后恢复
+        self.ingest_queue = IngestQueue(
+            IngestJobStore(os.getenv("INGEST_JOB_DB", os.path.join(config.save_dir, "data", "ingest_jobs.db"))),
+            self._ingest_item,
+            concurrency=int(os.getenv("INGEST_CONCURRENCY", "2")),
+            retention=float(os.getenv("INGEST_JOB_RETENTION", str(7 * 86400)))
+        )
+        # FAKE_EMBEDDING_ENABLED=true 时使用本地假向量模型，用于入库压测
+        if os.getenv("FAKE_EMBEDDING_ENABLED", "false").lower() == "true":
+            knowledge_base.embed_model = FakeEmbedder(
+                dimension=int(os.getenv("FAKE_EMBEDDING_DIM", "1024")),
+                call_latency_ms=float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "20"))
+            )
+        # 向量化管线：入库文本按哈希去重、按条数和token预算批量调用向量模型，结果缓存在磁盘上。
+        # 只缓存入库时的向量化调用，最多 EMBED_CACHE_MAX_ROWS 条，写满后整体清空；
+        # 手动清理调用 DELETE /data/embedding/cache，或在服务停止时删除 EMBED_CACHE_DIR
+        self.embedding_pipeline = None
+        if os.getenv("EMBED_PIPELINE_ENABLED", "true").lower() == "true":
+            embed_cache_enabled = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+            self.embedding_pipeline = embedding_pipeline.install(
+                knowledge_base,
+                cache_root=os.getenv("EMBED_CACHE_DIR", os.path.join(config.save_dir, "data", "embedding_cache"))
+                if embed_cache_enabled else None,
+                batch_size=int(os.getenv("EMBED_BATCH_SIZE", "64")),
+                max_batch_tokens=int(os.getenv("EMBED_BATCH_TOKENS", "8192")),
+                max_rows=int(os.getenv("EMBED_CACHE_MAX_ROWS", "200000"))
+            )
+
+    async def start(self):
+        """应用启动时恢复中断的入库任务，不必等到第一次访问任务接口"""
+        await self.ingest_queue.start()
 
     def get_databases(self) -> Dict[str, Any]:
         """获取数据库列表
@@ -61,6 +148,8 @@ class DataService:
         logger.debug(f"Delete database {db_id}")
         try:
             knowledge_base.delete_database(db_id)
+            self.content_index.remove_database(db_id)
+            kb_versions.bump(db_id)
             return {"message": "删除成功"}
         except Exception as e:
             logger.error(f"删除数据库失败 {e}, {traceback.format_exc()}")
@@ -78,13 +167,23 @@ class DataService:
         """
         logger.debug(f"Query test in {meta}: {query}")
         try:
-            result = await retriever.query_knowledgebase(query, history=None, refs={"meta": meta})
+            cache_key = retrieval_cache.make_key("query_test", query, meta)
+            result = await retrieval_cache.get_or_load(
+                cache_key,
+                lambda: retriever.query_knowledgebase(query, history=None, refs={"meta": meta}),
+                retrieval_cache.sources(meta)
+            )
             return result
         except Exception as e:
             logger.error(f"查询测试失败 {e}, {traceback.format_exc()}")
             return {"message": f"查询测试失败 {e}", "status": "failed"}
 
-    def file_to_chunk(self, files: List[str], params: dict) -> Dict[str, Any]:
+    def _content_hash(self, file_path: str) -> str:
+        """文件内容哈希，优先使用上传时记录的值"""
+        entry = self.content_index.lookup_path(file_path)
+        return entry["content_hash"] if entry else hash_file(file_path)
+
+    async def file_to_chunk(self, files: List[str], params: dict) -> Dict[str, Any]:
         """文件转换为分块
 
         Args:
@@ -92,59 +191,425 @@ class DataService:
             params: 参数
 
         Returns:
-            Dict[str, Any]: 转换结果
+            Dict[str, Any]: 转换结果（file_id -> 分块信息），任一文件失败时返回失败
         """
         logger.debug(f"File to chunk: {files}")
+        result = {}
+        async for item in self.chunk_engine.run(files, params):
+            if "error" in item:
+                return {"message": f"文件转换失败 {item['error']}", "status": "failed"}
+            result.update(item["chunks"])
+        return result
+
+    async def file_to_chunk_stream(self, files: List[str], params: dict) -> AsyncGenerator[Dict[str, Any], None]:
+        """文件转换为分块，每个文件完成后立即产出
+
+        Args:
+            files: 文件列表
+            params: 参数
+
+        Yields:
+            Dict[str, Any]: 每个文件一项 {"file", "cached", "chunks"} 或 {"file", "error"}，
+                最后一项为汇总 {"done": True, "total", "failed", "cached"}
+        """
+        logger.debug(f"File to chunk (stream): {files}")
+        failed = cached = 0
+        async for item in self.chunk_engine.run(files, params):
+            failed += "error" in item
+            cached += bool(item.get("cached"))
+            yield item
+        yield {"done": True, "total": len(files), "failed": failed, "cached": cached}
+
+    def _file_hash(self, db_id: str, file_path: str) -> Tuple[str, str]:
+        """取得文件的内容哈希和原始文件名，并登记到该知识库的索引
+
+        优先使用上传时记录的哈希，索引中没有的文件（例如直接放入目录的文件）读取内容计算。
+        """
+        entry = self.content_index.lookup_path(file_path)
+        if entry:
+            content_hash, filename, size = entry["content_hash"], entry["filename"], entry["size"]
+        else:
+            content_hash = hash_file(file_path)
+            filename, size = os.path.basename(file_path).lower(), os.path.getsize(file_path)
+        if not self.content_index.lookup(db_id, content_hash):
+            self.content_index.record_upload(db_id, content_hash, file_path, filename, size)
+        return content_hash, filename
+
+    async def _plan(self, db_id: str, items: List[Tuple[Any, str, str]],
+                    replaces: Optional[Dict[str, str]] = None) -> Tuple[list, list, dict]:
+        """按内容哈希划分待入库的文件，相同内容正在被其他调用入库时等待其结束后重新判断
+
+        Returns:
+            (需要入库的项, 跳过的文件标识, 内容哈希 -> 被替换的旧版本索引记录)
+        """
+        pending, skipped, revisions = [], [], {}
+        claimed = set()
         try:
-            result = knowledge_base.file_to_chunk(files, params=params)
-            return result
-        except Exception as e:
-            logger.error(f"文件转换失败 {e}, {traceback.format_exc()}")
-            return {"message": f"文件转换失败 {e}", "status": "failed"}
+            while items:
+                waiting = await asyncio.to_thread(self._plan_ingest, db_id, items, replaces, claimed,
+                                                  pending, skipped, revisions)
+                if waiting:
+                    logger.info(f"相同内容正在入库，等待其结果: {[item[0] for item, _ in waiting]}")
+                    metrics.inc("ingest_inflight_waits_total", len(waiting))
+                    await asyncio.gather(*[event.wait() for _, event in waiting])
+                items = [item for item, _ in waiting]
+        except BaseException:
+            self._release(db_id, pending)
+            raise
+        return pending, skipped, revisions
+
+    def _plan_ingest(self, db_id: str, items: List[Tuple[Any, str, str]], replaces: Optional[Dict[str, str]],
+                     claimed: set, pending: list, skipped: list, revisions: dict) -> list:
+        """按内容哈希划分待入库的文件（阻塞，在线程中调用），结果追加到 pending、skipped、revisions
 
-    async def add_files(self, db_id: str, files: List[str]) -> Dict[str, Any]:
+        Args:
+            db_id: 数据库ID
+            items: (文件标识, 内容哈希, 原始文件名) 列表
+            replaces: 文件标识 -> 客户端指明要替换的旧 file_id
+            claimed: 本次调用已登记入库的内容哈希（同一批次中的重复内容直接跳过）
+
+        Returns:
+            list: (项, 完成事件) 列表，相同内容正在被其他调用入库
+        """
+        replaces = replaces or {}
+        waiting = []
+        for item in items:
+            key, content_hash, filename = item
+            entry = self.content_index.lookup(db_id, content_hash)
+            if content_hash in claimed or (entry and entry["status"] == INGESTED):
+                skipped.append(key)
+                continue
+            event = self._ingesting.claim(db_id, content_hash)
+            if event is not None:
+                waiting.append((item, event))
+                continue
+            claimed.add(content_hash)
+            pending.append(item)
+            if replaces.get(key):
+                revisions[content_hash] = {"file_id": replaces[key]}
+            elif self.replace_revisions:
+                previous = self.content_index.latest_revision(db_id, filename, content_hash)
+                if previous and previous["file_id"]:
+                    revisions[content_hash] = previous
+        return waiting
+
+    def _release(self, db_id: str, pending: list):
+        for _, content_hash, _ in pending:
+            self._ingesting.release(db_id, content_hash)
+
+    def _replace_revisions(self, db_id: str, revisions: Dict[str, Dict[str, Any]]) -> List[str]:
+        """新版本入库后删除被替换的旧版本"""
+        replaced = []
+        for previous in revisions.values():
+            try:
+                knowledge_base.delete_file(db_id, previous["file_id"])
+                self.content_index.remove_file(db_id, previous["file_id"])
+                replaced.append(previous["file_id"])
+            except Exception as e:
+                logger.warning(f"删除旧版本文件失败 {previous['file_id']}: {e}")
+        return replaced
+
+    async def add_files(self, db_id: str, files: List[str], replaces: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """通过文件添加文档
 
+        按内容哈希去重：该知识库已入库相同内容的文件直接跳过；replaces 中指明的旧文件在新版本入库后删除
+        （INGEST_REPLACE_REVISIONS=true 时同名文件也视为旧版本）。
+
         Args:
             db_id: 数据库ID
             files: 文件列表
+            replaces: 文件路径 -> 要替换的旧 file_id（可选）
 
         Returns:
-            Dict[str, Any]: 添加结果
+            Dict[str, Any]: 添加结果，包含 added、skipped、replaced
         """
         logger.debug(f"Add document in {db_id} by file: {files}")
         try:
+            items = await asyncio.to_thread(
+                lambda: [(path, *self._file_hash(db_id, path)) for path in files]
+            )
+            pending, skipped, revisions = await self._plan(db_id, items, replaces)
+            if skipped:
+                logger.info(f"跳过内容未变化的文件: {skipped}")
+            if not pending:
+                return {"message": "文件内容均已入库", "status": "success", "added": [], "skipped": skipped,
+                        "replaced": []}
+        except Exception as e:
+            logger.error(f"添加文件失败: {e}, {traceback.format_exc()}")
+            return {"message": f"添加文件失败: {e}", "status": "failed"}
+
+        try:
+            new_files = [path for path, _, _ in pending]
             # 使用线程池执行耗时操作
             loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
+            added = await loop.run_in_executor(
                 executor,  # 使用与chat_router相同的线程池
-                lambda: knowledge_base.add_files(db_id, files)
+                lambda: self._ingest_call(knowledge_base.add_files, db_id, new_files)
             )
-            return {"message": "文件添加完成", "status": "success"}
+
+            def record():
+                # 优先使用 add_files 返回的文件信息，没有时再查询文件列表
+                file_ids = self._file_ids_by_path(added)
+                if any(path not in file_ids for path in new_files):
+                    try:
+                        file_ids = {**self._file_ids_by_path(knowledge_base.get_files_list(db_id)), **file_ids}
+                    except Exception as e:
+                        logger.warning(f"获取文件ID失败: {e}")
+                unresolved = []
+                for path, content_hash, _ in pending:
+                    # 找不到file_id时不标记入库，避免文件被删除后索引无法清理
+                    if file_ids.get(path):
+                        self.content_index.mark_ingested(db_id, content_hash, file_ids[path])
+                    else:
+                        unresolved.append(path)
+                if unresolved:
+                    logger.warning(f"未能取得入库文件的file_id，内容索引不标记为已入库，再次添加时不会去重: {unresolved}")
+                return self._replace_revisions(db_id, revisions)
+
+            replaced = await loop.run_in_executor(executor, record)
+            kb_versions.bump(db_id)
+            return {"message": "文件添加完成", "status": "success", "added": new_files, "skipped": skipped,
+                    "replaced": replaced}
         except Exception as e:
             logger.error(f"添加文件失败: {e}, {traceback.format_exc()}")
             return {"message": f"添加文件失败: {e}", "status": "failed"}
-
-    async def add_chunks(self, db_id: str, file_chunks: dict) -> Dict[str, Any]:
+        finally:
+            self._release(db_id, pending)
+
+    @staticmethod
+    def _ingest_call(fn: Callable, *args):
+        """在入库标记下调用知识库，只有入库时的向量化结果写入向量缓存"""
+        with embedding_pipeline.ingestion():
+            return fn(*args)
+
+    @staticmethod
+    def _file_ids_by_path(files: Any) -> Dict[str, str]:
+        """从知识库返回的文件信息（file_id -> 信息 的字典，或信息列表）中取得 路径 -> file_id"""
+        if isinstance(files, dict):
+            files = [{"file_id": file_id, **info} for file_id, info in files.items() if isinstance(info, dict)]
+        if not isinstance(files, list):
+            return {}
+        return {f["path"]: f["file_id"] for f in files if isinstance(f, dict) and f.get("path") and f.get("file_id")}
+
+    @staticmethod
+    def _chunk_hashes(chunk_info: dict) -> List[str]:
+        return [hashlib.sha256(node.get("text", "").encode("utf-8")).hexdigest()
+                for node in chunk_info.get("nodes", [])]
+
+    def _chunk_item(self, db_id: str, file_id: str, chunk_info: dict) -> Tuple[str, str, str]:
+        """分块数据对应的 (file_id, 内容哈希, 原始文件名)
+
+        哈希由源文件内容哈希和分块文本哈希共同计算：同一文件以新的 chunk_size/chunk_overlap 重新分块后
+        分块集合不同，不会被当作已入库跳过。源文件不在磁盘上时只用分块文本计算。
+        """
+        path = chunk_info.get("path")
+        chunk_set = "\n".join(self._chunk_hashes(chunk_info))
+        if path and os.path.exists(path):
+            source_hash, filename = self._file_hash(db_id, path)
+            chunk_set = f"{source_hash}\n{chunk_set}"
+        else:
+            filename = (chunk_info.get("filename") or file_id).lower()
+        content_hash = hashlib.sha256(chunk_set.encode("utf-8")).hexdigest()
+        if not self.content_index.lookup(db_id, content_hash):
+            # 以 file_id 作为记录路径，避免按路径查找源文件哈希时取到分块集合的记录
+            self.content_index.record_upload(db_id, content_hash, file_id, filename, 0)
+        return file_id, content_hash, filename
+
+    async def add_chunks(self, db_id: str, file_chunks: dict, replaces: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """通过分块添加文档
 
+        与 add_files 相同按内容哈希去重和替换旧版本；修订的文件按分块文本哈希与旧版本比较，
+        在 chunk_changes 中返回新增、未变和删除的分块数。
+
         Args:
             db_id: 数据库ID
             file_chunks: 文件分块数据
+            replaces: file_id -> 要替换的旧 file_id（可选）
 
         Returns:
-            Dict[str, Any]: 添加结果
+            Dict[str, Any]: 添加结果，包含 added、skipped、replaced、chunk_changes
         """
         try:
+            items = await asyncio.to_thread(
+                lambda: [self._chunk_item(db_id, file_id, info) for file_id, info in file_chunks.items()]
+            )
+            pending, skipped, revisions = await self._plan(db_id, items, replaces)
+            if skipped:
+                logger.info(f"跳过内容未变化的文件: {skipped}")
+            if not pending:
+                return {"message": "文件内容均已入库", "status": "success", "added": [], "skipped": skipped,
+                        "replaced": [], "chunk_changes": {}}
+        except Exception as e:
+            logger.error(f"添加分块失败: {e}, {traceback.format_exc()}")
+            return {"message": f"添加分块失败: {e}", "status": "failed"}
+
+        try:
+            new_chunks = {file_id: file_chunks[file_id] for file_id, _, _ in pending}
+            chunk_hashes = {file_id: self._chunk_hashes(file_chunks[file_id]) for file_id in new_chunks}
+            chunk_changes = {}
+            for file_id, content_hash, _ in pending:
+                if content_hash in revisions:
+                    old = self.content_index.chunk_hashes(db_id, revisions[content_hash]["file_id"])
+                    new = chunk_hashes[file_id]
+                    changed = sum(1 for chunk_hash in new if chunk_hash not in old)
+                    chunk_changes[file_id] = {"changed": changed, "unchanged": len(new) - changed,
+                                              "removed": len(old - set(new))}
+
             loop = asyncio.get_event_loop()
             await loop.run_in_executor(
                 executor,  # 使用与chat_router相同的线程池
-                lambda: knowledge_base.add_chunks(db_id, file_chunks)
+                lambda: self._ingest_call(knowledge_base.add_chunks, db_id, new_chunks)
             )
-            return {"message": "分块添加完成", "status": "success"}
+
+            def record():
+                for file_id, content_hash, _ in pending:
+                    self.content_index.mark_ingested(db_id, content_hash, file_id, chunk_hashes[file_id])
+                return self._replace_revisions(db_id, revisions)
+
+            replaced = await loop.run_in_executor(executor, record)
+            kb_versions.bump(db_id)
+            return {"message": "分块添加完成", "status": "success", "added": list(new_chunks), "skipped": skipped,
+                    "replaced": replaced, "chunk_changes": chunk_changes}
         except Exception as e:
             logger.error(f"添加分块失败: {e}, {traceback.format_exc()}")
             return {"message": f"添加分块失败: {e}", "status": "failed"}
+        finally:
+            self._release(db_id, pending)
+
+    async def _ingest_item(self, kind: str, db_id: str, key: str, payload: Any) -> Dict[str, Any]:
+        """入库任务中处理单个文件
+
+        files 任务的 key 为文件路径、payload 为 {"replaces": 旧file_id} 或 None；
+        chunks 任务的 key 为 file_id、payload 为 {"chunks": 分块数据, "replaces": 旧file_id}。
+        """
+        payload = payload or {}
+        replaces = {key: payload["replaces"]} if payload.get("replaces") else None
+        if kind == "files":
+            result = await self.add_files(db_id, [key], replaces)
+        else:
+            result = await self.add_chunks(db_id, {key: payload.get("chunks", payload)}, replaces)
+        if result.get("status") == "failed":
+            raise RuntimeError(result.get("message"))
+        return {k: v for k, v in result.items() if k not in ("message", "status")}
+
+    async def submit_ingest(self, db_id: str, kind: str, items: List[Tuple[str, Any]],
+                            wait: bool = False, replaces: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """提交入库任务
+
+        Args:
+            db_id: 数据库ID
+            kind: files（items 为 (文件路径, None)）或 chunks（items 为 (file_id, 分块数据)）
+            items: 待入库的文件
+            wait: 是否等待任务结束后再返回
+            replaces: 文件路径/file_id -> 要替换的旧 file_id，新版本入库后删除旧版本
+
+        Returns:
+            Dict[str, Any]: job_id 和任务进度；wait=True 时另外汇总 added/skipped/replaced，
+                有文件失败时 status 为 failed
+        """
+        if not items:
+            return {"message": "没有需要入库的文件", "status": "failed"}
+        replaces = replaces or {}
+        if kind == "chunks":
+            items = [(key, {"chunks": chunks, "replaces": replaces.get(key)}) for key, chunks in items]
+        else:
+            items = [(key, {"replaces": replaces[key]} if replaces.get(key) else None) for key, _ in items]
+        try:
+            job_id = await self.ingest_queue.submit(db_id, kind, items)
+            if wait:
+                await self.ingest_queue.wait(job_id)
+                return self._job_result(await self.ingest_queue.snapshot(job_id))
+            return {"message": "入库任务已提交", "status": "success", "job_id": job_id,
+                    "job": await self.ingest_queue.snapshot(job_id, include_items=False)}
+        except Exception as e:
+            logger.error(f"提交入库任务失败: {e}, {traceback.format_exc()}")
+            return {"message": f"提交入库任务失败: {e}", "status": "failed"}
+
+    @staticmethod
+    def _job_result(job: Dict[str, Any]) -> Dict[str, Any]:
+        """把已结束任务中各文件的结果汇总成与同步入库相同的返回格式"""
+        merged = {"added": [], "skipped": [], "replaced": []}
+        chunk_changes, errors = {}, []
+        for item in job.get("items", []):
+            if item["status"] == "failed":
+                errors.append(f"{item['item_key']}: {item['error']}")
+            result = item.get("result") or {}
+            for field in merged:
+                merged[field].extend(result.get(field, []))
+            chunk_changes.update(result.get("chunk_changes") or {})
+        result = {"job_id": job["job_id"], "job": job, **merged}
+        if job["kind"] == "chunks":
+            result["chunk_changes"] = chunk_changes
+        if errors:
+            return {"message": f"部分文件入库失败: {'; '.join(errors)}", "status": "failed", **result}
+        return {"message": "入库完成", "status": "success", **result}
+
+    async def get_ingest_job(self, job_id: str) -> Dict[str, Any]:
+        """获取入库任务进度（含每个文件的状态、错误和结果）
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            Dict[str, Any]: 任务进度
+        """
+        job = await self.ingest_queue.snapshot(job_id)
+        if job is None:
+            return {"message": f"任务不存在: {job_id}", "status": "failed", "status_code": 404}
+        return job
+
+    async def list_ingest_jobs(self, db_id: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """获取最近的入库任务
+
+        Args:
+            db_id: 数据库ID（可选）
+            limit: 返回数量
+
+        Returns:
+            Dict[str, Any]: 任务列表
+        """
+        return {"jobs": await self.ingest_queue.list(db_id, limit)}
+
+    async def cancel_ingest_job(self, job_id: str) -> Dict[str, Any]:
+        """取消入库任务，正在处理的文件会处理完
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            Dict[str, Any]: 取消结果
+        """
+        cancelled = await self.ingest_queue.cancel(job_id)
+        if cancelled is None:
+            return {"message": f"任务不存在: {job_id}", "status": "failed", "status_code": 404}
+        return {"message": "任务已取消", "status": "success", "cancelled": cancelled}
+
+    def watch_ingest_job(self, job_id: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """订阅入库任务进度，任务结束后停止"""
+        return self.ingest_queue.watch(job_id)
+
+    def get_embedding_stats(self) -> Dict[str, Any]:
+        """获取向量化管线的累计统计（吞吐、缓存命中、去重）
+
+        Returns:
+            Dict[str, Any]: 统计信息
+        """
+        if self.embedding_pipeline is None:
+            return {"message": "向量化管线未启用", "status": "failed", "status_code": 404}
+        return self.embedding_pipeline.stats()
+
+    def clear_embedding_cache(self) -> Dict[str, Any]:
+        """清空向量缓存（其他工作进程在下次读写缓存时切换到清空后的数据）
+
+        Returns:
+            Dict[str, Any]: 清理结果
+        """
+        if self.embedding_pipeline is None or self.embedding_pipeline.cache is None:
+            return {"message": "向量缓存未启用", "status": "failed", "status_code": 404}
+        cleared = len(self.embedding_pipeline.cache)
+        self.embedding_pipeline.cache.clear()
+        logger.info(f"向量缓存已清空: {cleared} 条")
+        return {"message": "向量缓存已清空", "status": "success", "cleared": cleared}
 
     def get_database_info(self, db_id: str) -> Dict[str, Any]:
         """获取数据库信息
@@ -175,6 +640,8 @@ class DataService:
         logger.debug(f"DELETE document {file_id} info in {db_id}")
         try:
             knowledge_base.delete_file(db_id, file_id)
+            self.content_index.remove_file(db_id, file_id)
+            kb_versions.bump(db_id)
             return {"message": "删除成功"}
         except Exception as e:
             logger.error(f"删除文档失败 {e}, {traceback.format_exc()}")
@@ -198,39 +665,193 @@ class DataService:
             logger.error(f"Failed to get file info, {e}, {db_id=}, {file_id=}, {traceback.format_exc()}")
             return {"message": "Failed to get file info", "status": "failed"}
 
-    async def upload_file(self, file_content: bytes, filename: str, db_id: Optional[str] = None) -> Dict[str, Any]:
+    def _staging_path(self, db_id: Optional[str] = None) -> str:
+        """上传暂存路径，位于最终的上传目录中，如果db_id为None则使用默认上传目录"""
+        if db_id:
+            upload_dir = knowledge_base.get_db_upload_path(db_id)
+        else:
+            upload_dir = os.path.join(config.save_dir, "data", "uploads")
+        os.makedirs(upload_dir, exist_ok=True)
+        return os.path.join(upload_dir, f".{uuid.uuid4().hex}.upload")
+
+    def _store_upload(self, staging_path: str, filename: str, db_id: Optional[str], content_hash: str,
+                      size: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """把暂存文件移动到按内容哈希命名的路径
+
+        同一知识库中已有相同内容的文件时删除暂存文件，返回已有文件的路径和索引记录。
+
+        Returns:
+            (文件路径, 已有文件的索引记录或None)
+        """
+        existing = self.content_index.lookup(db_id, content_hash)
+        if existing and os.path.exists(existing["file_path"]):
+            os.remove(staging_path)
+            return existing["file_path"], existing
+
+        basename, ext = os.path.splitext(os.path.basename(filename))
+        file_path = os.path.join(os.path.dirname(staging_path), f"{basename}_{content_hash[:16]}{ext}".lower())
+        os.replace(staging_path, file_path)
+        self.content_index.record_upload(db_id, content_hash, file_path, os.path.basename(filename).lower(), size)
+        return file_path, None
+
+    @staticmethod
+    def _upload_result(file_path: str, db_id: Optional[str], size: int, content_hash: str,
+                       existing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        result = {"message": "File successfully uploaded", "file_path": file_path, "db_id": db_id,
+                  "size": size, "content_hash": content_hash, "duplicate": existing is not None}
+        if existing is not None:
+            result["message"] = "File already uploaded"
+            result["ingested"] = existing["status"] == INGESTED
+            result["file_id"] = existing["file_id"]
+        return result
+
+    def declares_too_large(self, content_length: int) -> bool:
+        """表单请求声明的长度是否已超过上传上限（留出表单边界和字段头的余量）"""
+        return bool(self.upload_max_bytes) and content_length > self.upload_max_bytes + FORM_OVERHEAD_BYTES
+
+    def _too_large(self) -> Dict[str, Any]:
+        return {"message": f"文件超过上传大小限制 {self.upload_max_bytes} 字节", "status": "failed", "status_code": 413}
+
+    async def upload_file(self, file: Union[bytes, Any], filename: str, db_id: Optional[str] = None) -> Dict[str, Any]:
         """上传文件
 
+        文件按 UPLOAD_CHUNK_SIZE 分块写入磁盘（写入在线程中执行，不阻塞事件循环），同时计算sha256，
+        超过 UPLOAD_MAX_BYTES 时中止并删除已写入的部分。文件按内容哈希命名，同一知识库重复上传相同内容时
+        不再保存副本，返回已有文件（duplicate=True）。
+
         Args:
-            file_content: 文件内容
+            file: UploadFile（或任何带异步 read(size) 的对象），也可以直接传入文件内容
             filename: 文件名
             db_id: 数据库ID（可选）
 
         Returns:
-            Dict[str, Any]: 上传结果
+            Dict[str, Any]: 上传结果，包含 file_path、size、content_hash、duplicate
         """
         if not filename:
             return {"message": "No selected file", "status": "failed"}
 
-        # 根据db_id获取上传路径，如果db_id为None则使用默认路径
-        if db_id:
-            upload_dir = knowledge_base.get_db_upload_path(db_id)
+        staging_path = self._staging_path(db_id)
+        if isinstance(file, (bytes, bytearray)):
+            chunks = iter_bytes(bytes(file), self.upload_chunk_size)
         else:
-            upload_dir = os.path.join(config.save_dir, "data", "uploads")
-
-        basename, ext = os.path.splitext(filename)
-        new_filename = f"{basename}_{hashstr(basename, 4, with_salt=True)}{ext}".lower()
-        file_path = os.path.join(upload_dir, new_filename)
-        os.makedirs(upload_dir, exist_ok=True)
+            chunks = iter_upload(file, self.upload_chunk_size)
 
         try:
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
-            return {"message": "File successfully uploaded", "file_path": file_path, "db_id": db_id}
+            size, content_hash = await write_stream(chunks, staging_path, max_bytes=self.upload_max_bytes)
+            file_path, existing = await asyncio.to_thread(
+                self._store_upload, staging_path, filename, db_id, content_hash, size
+            )
+            return self._upload_result(file_path, db_id, size, content_hash, existing)
+        except UploadTooLarge:
+            logger.warning(f"文件上传超过大小限制: {filename}")
+            return self._too_large()
         except Exception as e:
             logger.error(f"文件上传失败: {e}, {traceback.format_exc()}")
             return {"message": f"文件上传失败: {e}", "status": "failed"}
 
+    def create_multipart_upload(self, filename: str, total_size: int, db_id: Optional[str] = None,
+                                part_size: Optional[int] = None) -> Dict[str, Any]:
+        """创建可续传的分片上传
+
+        Args:
+            filename: 文件名
+            total_size: 文件总大小（字节）
+            db_id: 数据库ID（可选）
+            part_size: 分片大小（可选）
+
+        Returns:
+            Dict[str, Any]: upload_id、part_size、total_parts
+        """
+        if not filename:
+            return {"message": "No selected file", "status": "failed"}
+        try:
+            manifest = self.multipart_uploads.create(filename, total_size, part_size, extra={"db_id": db_id})
+            return {"status": "success", **manifest}
+        except UploadTooLarge:
+            return self._too_large()
+        except Exception as e:
+            logger.error(f"创建分片上传失败: {e}, {traceback.format_exc()}")
+            return {"message": f"创建分片上传失败: {e}", "status": "failed"}
+
+    def get_multipart_upload(self, upload_id: str) -> Dict[str, Any]:
+        """查询分片上传状态（已收到和缺失的分片）
+
+        Args:
+            upload_id: 上传ID
+
+        Returns:
+            Dict[str, Any]: 上传状态
+        """
+        try:
+            return {"status": "success", **self.multipart_uploads.status(upload_id)}
+        except KeyError:
+            return {"message": f"上传不存在或已过期: {upload_id}", "status": "failed", "status_code": 404}
+
+    async def upload_part(self, upload_id: str, index: int, chunks: AsyncIterator[bytes],
+                          content_length: Optional[int] = None) -> Dict[str, Any]:
+        """写入一个分片
+
+        Args:
+            upload_id: 上传ID
+            index: 分片序号
+            chunks: 分片内容的异步字节流
+            content_length: 请求声明的长度（可选），与分片期望长度不符时在读取请求体之前拒绝
+
+        Returns:
+            Dict[str, Any]: 分片序号、大小和sha256
+        """
+        try:
+            return {"status": "success", **await self.multipart_uploads.put_part(upload_id, index, chunks, content_length)}
+        except KeyError:
+            return {"message": f"上传不存在或已过期: {upload_id}", "status": "failed", "status_code": 404}
+        except ValueError as e:
+            return {"message": str(e), "status": "failed"}
+        except Exception as e:
+            logger.error(f"分片上传失败: {e}, {traceback.format_exc()}")
+            return {"message": f"分片上传失败: {e}", "status": "failed"}
+
+    async def complete_multipart_upload(self, upload_id: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """合并分片，结果与 upload_file 相同
+
+        Args:
+            upload_id: 上传ID
+            sha256: 客户端计算的整体哈希（可选，传入时校验）
+
+        Returns:
+            Dict[str, Any]: 上传结果
+        """
+        try:
+            manifest = self.multipart_uploads.status(upload_id)
+            db_id = manifest.get("db_id")
+            staging_path = self._staging_path(db_id)
+            size, content_hash = await self.multipart_uploads.complete(upload_id, staging_path, sha256)
+            file_path, existing = await asyncio.to_thread(
+                self._store_upload, staging_path, manifest["filename"], db_id, content_hash, size
+            )
+            return self._upload_result(file_path, db_id, size, content_hash, existing)
+        except KeyError:
+            return {"message": f"上传不存在或已过期: {upload_id}", "status": "failed", "status_code": 404}
+        except ValueError as e:
+            return {"message": str(e), "status": "failed"}
+        except Exception as e:
+            logger.error(f"合并分片失败: {e}, {traceback.format_exc()}")
+            return {"message": f"合并分片失败: {e}", "status": "failed"}
+
+    def abort_multipart_upload(self, upload_id: str) -> Dict[str, Any]:
+        """放弃分片上传
+
+        Args:
+            upload_id: 上传ID
+
+        Returns:
+            Dict[str, Any]: 删除结果
+        """
+        try:
+            self.multipart_uploads.abort(upload_id)
+            return {"message": "删除成功", "status": "success"}
+        except KeyError:
+            return {"message": f"上传不存在或已过期: {upload_id}", "status": "failed", "status_code": 404}
+
     def get_files_list(self, db_id: str) -> Dict[str, Any]:
         """获取指定数据库中的所有文件列表
 
@@ -290,6 +911,8 @@ class DataService:
 
             # 执行删除操作
             knowledge_base.delete_file(db_id, file_id)
+            self.content_index.remove_file(db_id, file_id)
+            kb_versions.bump(db_id)
 
             return {
                 "message": "文件删除成功",
@@ -3,6 +3,7 @@ from typing import Optional, Dict, Any
 from packages.utils import logger
 from packages import config, graph_base
 from packages.core.graph.graph_indexer import graph_indexer
+from rag.cache.kb_version import GRAPH_VERSION_KEY, kb_versions
 
 
 class GraphService:
@@ -42,6 +43,7 @@ class GraphService:
         try:
             # 调用GraphDatabase的add_embedding_to_nodes方法
             count = graph_base.add_embedding_to_nodes(kgdb_name=kgdb_name)
+            kb_versions.bump(GRAPH_VERSION_KEY)
             return {"status": "success", "message": f"已成功为{count}个节点添加嵌入向量", "indexed_count": count}
         except Exception as e:
             logger.error(f"节点索引失败: {e}, {traceback.format_exc()}")
@@ -102,6 +104,7 @@ class GraphService:
 
         try:
             await graph_base.jsonl_file_add_entity(file_path, kgdb_name)
+            kb_versions.bump(GRAPH_VERSION_KEY)
             return {"message": "实体添加成功", "status": "success"}
         except Exception as e:
             logger.error(f"添加实体失败: {e}, {traceback.format_exc()}")
@@ -0,0 +1,200 @@
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+from rag.utils.model_registry import ModelRegistry
+from rag.utils.stream_bridge import StreamBridge
+
+DEFAULT_TITLE = "新对话"
+
+
+class TitleService:
+    """会话标题生成服务
+
+    标题生成不再占用聊天响应的SSE连接：任务进入后台队列，由固定数量的协程消费，
+    同一时间窗口内的多个任务会合并为一次模型调用，结果通过回调写入Redis。
+    """
+
+    def __init__(self, model_registry: ModelRegistry, stream_bridge: StreamBridge,
+                 on_title: Callable[[str, str], Awaitable[None]],
+                 model_provider: Optional[str] = None, model_name: Optional[str] = None,
+                 max_workers: int = 2, batch_size: int = 8, batch_wait_ms: int = 200,
+                 queue_size: int = 1000, cache_size: int = 1024):
+        """初始化标题服务
+
+        Args:
+            model_registry: 模型注册表
+            stream_bridge: 执行阻塞模型调用的桥接器
+            on_title: 标题生成后的回调，参数为 (thread_id, title)
+            model_provider: 标题生成使用的模型提供商，为空时使用默认模型
+            model_name: 标题生成使用的模型名称
+            max_workers: 并发消费协程数量
+            batch_size: 单次模型调用最多合并的任务数
+            batch_wait_ms: 合并任务的最长等待时间（毫秒）
+            queue_size: 等待队列长度，队列满时直接丢弃任务
+            cache_size: 本地保留的最近标题数量
+        """
+        self.model_registry = model_registry
+        self.stream_bridge = stream_bridge
+        self.on_title = on_title
+        self.model_provider = model_provider
+        self.model_name = model_name
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.queue_size = queue_size
+        self.cache_size = cache_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending = set()
+        self._titles: "OrderedDict[str, str]" = OrderedDict()
+
+    def submit(self, thread_id: str, query: str, response: str) -> bool:
+        """提交标题生成任务，不等待结果
+
+        Returns:
+            bool: 是否成功入队
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((thread_id, query, response))
+        except asyncio.QueueFull:
+            logger.warning(f"Title queue full, skip title generation for {thread_id}")
+            metrics.inc("title_jobs_dropped_total")
+            return False
+        self._pending.add(thread_id)
+        metrics.inc("title_jobs_submitted_total")
+        metrics.set_gauge("title_queue_depth", self._queue.qsize())
+        return True
+
+    def get_title(self, thread_id: str) -> Tuple[str, Optional[str]]:
+        """查询本地记录的标题
+
+        Returns:
+            tuple: (status, title)，status 为 pending / generated / unknown
+        """
+        if thread_id in self._pending:
+            return "pending", None
+        title = self._titles.get(thread_id)
+        if title is not None:
+            return "generated", title
+        return "unknown", None
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [task for task in self._workers if not task.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        """消费队列，按时间窗口合并任务后批量生成标题"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            metrics.set_gauge("title_queue_depth", self._queue.qsize())
+            metrics.observe("title_batch_size", len(batch))
+
+            try:
+                titles = await self._generate(batch)
+            except Exception as e:
+                logger.error(f"Title generation error: {e}")
+                titles = [DEFAULT_TITLE] * len(batch)
+
+            for (thread_id, _, _), title in zip(batch, titles):
+                await self._finish(thread_id, title)
+
+    async def _finish(self, thread_id: str, title: str):
+        self._titles[thread_id] = title
+        self._titles.move_to_end(thread_id)
+        while len(self._titles) > self.cache_size:
+            self._titles.popitem(last=False)
+        self._pending.discard(thread_id)
+        try:
+            await self.on_title(thread_id, title)
+        except Exception as e:
+            logger.warning(f"Failed to save title for {thread_id}: {e}")
+
+    async def _generate(self, batch: List[Tuple[str, str, str]]) -> List[str]:
+        """生成一批标题，批量结果解析失败时逐个生成"""
+        model = self.model_registry.get(model_provider=self.model_provider, model_name=self.model_name)
+        if len(batch) == 1:
+            _, query, response = batch[0]
+            return [await self._generate_one(model, query, response)]
+
+        conversations = "\n\n".join(
+            f"对话{i}：\n用户问题：{query}\n助手回答：{response[:200]}..."
+            for i, (_, query, response) in enumerate(batch, start=1)
+        )
+        prompt = f"""请为以下{len(batch)}段对话分别生成简洁的会话标题：
+
+{conversations}
+
+要求：
+1. 标题要简洁明了，能概括对话主题
+2. 每个标题不超过20个字符
+3. 不要包含标点符号
+4. 按对话顺序返回一个JSON字符串数组，不要其他内容"""
+
+        result = await self.stream_bridge.run(model.predict, prompt)
+        titles = self._parse_titles(result.content, len(batch))
+        if titles is None:
+            logger.debug("Batched title response not parseable, fallback to single generation")
+            return [await self._generate_one(model, query, response) for _, query, response in batch]
+        return titles
+
+    async def _generate_one(self, model, query: str, response: str) -> str:
+        # 构造标题生成提示
+        title_prompt = f"""请根据以下对话内容，生成一个简洁的会话标题（不超过20个字符）：
+
+            用户问题：{query}
+            助手回答：{response[:200]}...
+
+            要求：
+            1. 标题要简洁明了，能概括对话主题
+            2. 不超过20个字符
+            3. 不要包含标点符号
+            4. 直接返回标题，不要其他内容
+
+            标题："""
+
+        try:
+            title_response = await self.stream_bridge.run(model.predict, title_prompt)
+            return self._clean_title(title_response.content)
+        except Exception as e:
+            logger.error(f"Title generation error: {e}")
+            return DEFAULT_TITLE
+
+    def _parse_titles(self, content: str, count: int) -> Optional[List[str]]:
+        start, end = content.find("["), content.rfind("]")
+        if start == -1 or end <= start:
+            return None
+        try:
+            titles = json.loads(content[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(titles, list) or len(titles) != count:
+            return None
+        return [self._clean_title(str(title)) for title in titles]
+
+    @staticmethod
+    def _clean_title(title: str) -> str:
+        """清理标题，确保符合要求"""
+        title = title.strip()
+        title = title.replace("标题：", "").replace("：", "").replace(":", "").strip()
+        if len(title) > 20:
+            title = title[:20]
+        return title or DEFAULT_TITLE
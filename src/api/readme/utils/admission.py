@@ -0,0 +1,166 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import Deque, Dict, Optional
+
+from rag.utils.metrics import metrics
+
+
+class AdmissionRejected(Exception):
+    """超出容量时拒绝请求，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """准入凭证，生成结束时释放；release 可重复调用"""
+
+    def __init__(self, controller: "AdmissionController", key: Optional[str]):
+        self.controller = controller
+        self.key = key
+        self.acquired_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.controller._release(self.key, time.monotonic() - self.acquired_at)
+
+
+class AdmissionController:
+    """单 worker 的生成准入控制
+
+    限制同时进行的生成数量，超出时进入有界等待队列；等待队列按 key（租户或客户端地址）轮转出队，
+    并限制单个 key 的并发数，避免个别用户占满容量。key 为 None（无法识别请求方）时只受总并发限制。
+    队列已满或等待超时则快速拒绝。
+    """
+
+    def __init__(self, max_concurrent: int = 20, max_queue: int = 100,
+                 queue_timeout: float = 10.0, per_key_limit: int = 4):
+        """初始化准入控制器
+
+        Args:
+            max_concurrent: 最大并发生成数
+            max_queue: 最大等待请求数
+            queue_timeout: 最长排队时间（秒）
+            per_key_limit: 单个 key 的最大并发生成数
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.per_key_limit = per_key_limit
+
+        self.active = 0
+        self.waiting = 0
+        self._active_by_key: Dict[str, int] = defaultdict(int)
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # 生成耗时的指数加权平均，用于估算 Retry-After
+        self._avg_hold = 5.0
+
+    async def acquire(self, key: Optional[str]) -> AdmissionTicket:
+        """申请生成名额
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        # 有空闲名额时仍在排队的请求都受单 key 并发限制，不影响其他 key 直接进入
+        if key not in self._waiters and self._can_run(key):
+            self._grant(key)
+            metrics.observe("admission_wait_seconds", 0)
+            return AdmissionTicket(self, key)
+
+        if self.waiting >= self.max_queue:
+            metrics.inc("admission_rejected_total")
+            metrics.inc("admission_rejected_queue_full_total")
+            raise AdmissionRejected("Too many concurrent chats, queue is full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        self.waiting += 1
+        self._update_gauges()
+        started = time.monotonic()
+
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(key, future)
+            metrics.inc("admission_rejected_total")
+            metrics.inc("admission_rejected_timeout_total")
+            raise AdmissionRejected("Too many concurrent chats, wait timed out", self.retry_after())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配名额但调用方被取消，归还名额
+                self._release(key, 0)
+            else:
+                self._remove_waiter(key, future)
+            raise
+
+        metrics.observe("admission_wait_seconds", time.monotonic() - started)
+        return AdmissionTicket(self, key)
+
+    def retry_after(self) -> int:
+        """按当前排队情况估算客户端的重试等待时间（秒）"""
+        rounds = (self.waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self._avg_hold * rounds))
+
+    def _under_key_limit(self, key: Optional[str]) -> bool:
+        return key is None or self._active_by_key[key] < self.per_key_limit
+
+    def _can_run(self, key: Optional[str]) -> bool:
+        return self.active < self.max_concurrent and self._under_key_limit(key)
+
+    def _grant(self, key: str):
+        self.active += 1
+        self._active_by_key[key] += 1
+        metrics.inc("admission_admitted_total")
+        self._update_gauges()
+
+    def _release(self, key: str, hold_seconds: float):
+        self.active -= 1
+        self._active_by_key[key] -= 1
+        if self._active_by_key[key] <= 0:
+            del self._active_by_key[key]
+        if hold_seconds:
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * hold_seconds
+        self._dispatch()
+        self._update_gauges()
+
+    def _dispatch(self):
+        """按 key 轮转唤醒等待者，直到没有空闲名额或没有可运行的 key"""
+        while self.active < self.max_concurrent and self._waiters:
+            granted = False
+            for key in list(self._waiters):
+                if not self._under_key_limit(key):
+                    continue
+                queue = self._waiters.pop(key)
+                future = queue.popleft()
+                if queue:
+                    # 放到队尾，下一个名额优先分配给其他 key
+                    self._waiters[key] = queue
+                self.waiting -= 1
+                if future.done():
+                    granted = True
+                    break
+                self._grant(key)
+                future.set_result(None)
+                granted = True
+                break
+            if not granted:
+                break
+
+    def _remove_waiter(self, key: str, future: asyncio.Future):
+        queue = self._waiters.get(key)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._waiters[key]
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge("admission_active", self.active)
+        metrics.set_gauge("admission_queue_depth", self.waiting)
@@ -0,0 +1,93 @@
+import asyncio
+import random
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+
+
+class BatchRunner:
+    """批量任务执行器
+
+    固定数量的工作协程从队列中取任务执行，失败时按指数退避（带随机抖动）重试，
+    结果按完成顺序产出，也可以按输入顺序产出。
+    """
+
+    def __init__(self, call: Callable[[Any], Awaitable[dict]], concurrency: int = 8, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0):
+        """初始化执行器
+
+        Args:
+            call: 处理单个任务的协程函数，返回结果字典
+            concurrency: 同时执行的任务数
+            max_retries: 单个任务失败后的最大重试次数
+            backoff_base: 首次重试前的基础等待时间（秒）
+            backoff_max: 单次重试等待时间上限（秒）
+        """
+        self.call = call
+        self.concurrency = max(concurrency, 1)
+        self.max_retries = max(max_retries, 0)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    async def run(self, items: List[Any], ordered: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """执行所有任务
+
+        Args:
+            items: 任务列表
+            ordered: 是否按输入顺序产出结果（否则按完成顺序）
+
+        Yields:
+            dict: {"index", "input", "attempts", "elapsed_ms"} 加上成功时 call 的返回值或失败时的 "error"
+        """
+        work: asyncio.Queue = asyncio.Queue()
+        for index, item in enumerate(items):
+            work.put_nowait((index, item))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            while True:
+                try:
+                    index, item = work.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await results.put(await self._run_one(index, item))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(items)))]
+        try:
+            buffered: Dict[int, dict] = {}
+            next_index = 0
+            for _ in range(len(items)):
+                result = await results.get()
+                if not ordered:
+                    yield result
+                    continue
+                buffered[result["index"]] = result
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _run_one(self, index: int, item: Any) -> dict:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await self.call(item)
+                metrics.inc("batch_items_succeeded_total")
+                return {"index": index, "input": item, **result, "attempts": attempt,
+                        "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+            except Exception as e:
+                if attempt > self.max_retries:
+                    metrics.inc("batch_items_failed_total")
+                    logger.warning(f"Batch item {index} failed after {attempt} attempts: {e}")
+                    return {"index": index, "input": item, "error": str(e), "attempts": attempt,
+                            "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+                metrics.inc("batch_retries_total")
+                delay = min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max)
+                await asyncio.sleep(random.uniform(0, delay))
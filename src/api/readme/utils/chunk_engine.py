@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.utils.chunked_upload import hash_file
+from rag.utils.metrics import metrics
+
+# 解析/分块逻辑变化时递增，使旧缓存失效
+CACHE_VERSION = 2
+
+# 默认的进程池解析函数（CHUNK_PARSER 未配置时使用），只处理纯文本类文件，其他类型交给知识库在线程中分块
+DEFAULT_PARSER = "rag.utils.chunk_engine:split_text"
+TEXT_EXTENSIONS = {"txt", "md", "markdown", "csv", "tsv", "json", "jsonl", "log", "yaml", "yml"}
+# 切分时优先在这些位置断开（从强到弱）
+_BREAKS = ("\n\n", "\n", "。", "！", "？", ". ", "! ", "? ", "；", "; ", "，", ", ", " ")
+
+
+def chunk_with_knowledge_base(file: str, params: dict) -> Dict[str, Any]:
+    """在当前进程中用 knowledge_base.file_to_chunk 分块（只用于线程池，不能传给子进程）"""
+    from packages import knowledge_base
+    return knowledge_base.file_to_chunk([file], params=params)
+
+
+def _node_dict(node: Any) -> Dict[str, Any]:
+    if isinstance(node, dict):
+        return node
+    for method in ("to_dict", "dict"):
+        if callable(getattr(node, method, None)):
+            return getattr(node, method)()
+    return {"text": str(node)}
+
+
+def is_text_file(file: str) -> bool:
+    """默认解析函数能否处理该文件（按扩展名判断）"""
+    return file.rsplit(".", 1)[-1].lower() in TEXT_EXTENSIONS
+
+
+def split_text(file: str, params: dict) -> List[Dict[str, Any]]:
+    """默认解析函数：读取纯文本类文件，按 chunk_size/chunk_overlap（字符数）切分
+
+    每个分块在窗口后部的段落、句子或词边界处断开，找不到边界时按长度硬切。
+
+    Args:
+        file: 文件路径
+        params: 分块参数，chunk_size 默认 1000，chunk_overlap 默认 200
+
+    Returns:
+        list: 分块列表，每项为 {"text", "start_char_idx", "end_char_idx"}
+    """
+    with open(file, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    size = max(int(params.get("chunk_size") or 1000), 1)
+    overlap = min(max(int(params.get("chunk_overlap") or 0), 0), size // 2)
+
+    nodes = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # 只在窗口的后半部分寻找边界，避免分块过短
+            for separator in _BREAKS:
+                position = text.rfind(separator, start + size // 2, end)
+                if position != -1:
+                    end = position + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            nodes.append({"text": chunk, "start_char_idx": start, "end_char_idx": end})
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return nodes
+
+
+def chunk_one(file: str, params: dict, parser: str) -> Dict[str, Any]:
+    """在工作进程中直接调用解析/切分函数分块单个文件，返回与 knowledge_base.file_to_chunk 相同结构的结果
+
+    子进程只导入 parser 所在的模块，不初始化知识库（向量模型、向量库连接）。
+
+    Args:
+        file: 文件路径
+        params: 分块参数
+        parser: 解析/切分函数 "模块:函数"，调用方式为 fn(file, params)，返回分块列表
+    """
+    module_name, _, function_name = parser.partition(":")
+    split = getattr(importlib.import_module(module_name), function_name)
+    nodes = split(file, params)
+    file_id = f"file_{uuid.uuid4().hex[:12]}"
+    return {file_id: {"file_id": file_id, "filename": os.path.basename(file), "path": file,
+                      "type": file.rsplit(".", 1)[-1].lower(), "nodes": [_node_dict(node) for node in nodes]}}
+
+
+class ChunkEngine:
+    """文档解析/分块引擎
+
+    文件分发到进程池并行解析（解析和切分是CPU密集型，受GIL限制），按完成顺序逐个产出结果；
+    结果按 内容sha256 + 分块参数 缓存在磁盘上，相同文件以相同参数再次分块时直接返回；缓存总大小超过上限时
+    按最近使用时间淘汰。
+    工作进程以 spawn 方式启动：服务进程中已有线程池、事件循环和数据库连接，fork 会复制其他线程持有的锁。
+    """
+
+    def __init__(self, chunk_fn: Callable[[str, dict], Dict[str, Any]] = chunk_with_knowledge_base, workers: int = 0,
+                 cache_dir: Optional[str] = None, fallback_executor: Optional[Executor] = None,
+                 hash_fn: Callable[[str], str] = hash_file, accepts: Optional[Callable[[str], bool]] = None,
+                 fallback_fn: Callable[[str, dict], Dict[str, Any]] = chunk_with_knowledge_base,
+                 cache_max_bytes: int = 0):
+        """初始化引擎
+
+        Args:
+            chunk_fn: 分块函数 chunk_fn(file, params)；使用进程池时必须可序列化（模块级函数或其 partial），
+                且不应初始化知识库等重量级对象
+            workers: 进程数，为 0 时在 fallback_executor 中执行（不使用进程池）
+            cache_dir: 缓存目录，为 None 时不缓存
+            fallback_executor: 不使用进程池或进程池崩溃时使用的线程池
+            hash_fn: 计算文件内容哈希的函数（阻塞）
+            accepts: chunk_fn 能否处理该文件，返回 False 的文件在 fallback_executor 中用 fallback_fn 分块；
+                为 None 时全部交给 chunk_fn
+            fallback_fn: chunk_fn 不处理的文件使用的分块函数
+            cache_max_bytes: 缓存目录的大小上限（字节），为 0 时不限制
+        """
+        self.chunk_fn = chunk_fn
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.fallback_executor = fallback_executor
+        self.hash_fn = hash_fn
+        self.accepts = accepts
+        self.fallback_fn = fallback_fn
+        self.cache_max_bytes = cache_max_bytes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # 缓存目录的当前大小，首次写入时扫描得到，之后按写入累加
+        self._cache_bytes: Optional[int] = None
+        self._cache_lock = threading.Lock()
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def cache_key(content_hash: str, params: dict) -> str:
+        raw = json.dumps({"v": CACHE_VERSION, "hash": content_hash, "params": params or {}},
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._cache_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if self.cache_max_bytes:
+            # 命中时更新修改时间，淘汰按最近使用排序
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return result
+
+    def _store_cached(self, key: str, result: Dict[str, Any]):
+        path = self._cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        if not self.cache_max_bytes:
+            return
+        with self._cache_lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(size for _, size, _ in self._cache_files())
+            else:
+                self._cache_bytes += size
+            if self._cache_bytes > self.cache_max_bytes:
+                self._evict_cache()
+
+    def _cache_files(self) -> List[Tuple[str, int, float]]:
+        """缓存目录中的所有缓存文件 (路径, 大小, 修改时间)"""
+        files = []
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict_cache(self):
+        """重新扫描缓存目录（其他 worker 也在写入），按最近使用时间删除最旧的文件，直到低于上限的 90%"""
+        files = sorted(self._cache_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        target = int(self.cache_max_bytes * 0.9)
+        evicted = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        self._cache_bytes = total
+        metrics.inc("chunk_cache_evicted_total", evicted)
+        logger.info(f"Chunk cache over {self.cache_max_bytes} bytes, evicted {evicted} files")
+
+    @staticmethod
+    def rebind(result: Dict[str, Any], file: str) -> Dict[str, Any]:
+        """缓存结果换成新的 file_id 和当前路径，避免同一内容的多次分块共用 file_id"""
+        rebound = {}
+        for info in result.values():
+            file_id = f"file_{uuid.uuid4().hex[:12]}"
+            info = {**info, "file_id": file_id, "path": file}
+            if "nodes" in info:
+                info["nodes"] = [{**node, "file_id": file_id} if "file_id" in node else node for node in info["nodes"]]
+            rebound[file_id] = info
+        return rebound
+
+    async def _chunk(self, file: str, params: dict) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        if self.accepts is not None and not self.accepts(file):
+            return await loop.run_in_executor(self.fallback_executor, self.fallback_fn, file, params)
+        pool = self._get_pool()
+        if pool is not None:
+            try:
+                return await loop.run_in_executor(pool, self.chunk_fn, file, params)
+            except BrokenProcessPool:
+                # 工作进程异常退出（例如解析器崩溃），重建进程池，本文件在线程中重试
+                logger.warning(f"Chunk process pool broken while parsing {file}, falling back to thread")
+                metrics.inc("chunk_pool_broken_total")
+                self.shutdown()
+        return await loop.run_in_executor(self.fallback_executor, self.chunk_fn, file, params)
+
+    async def _process(self, file: str, params: dict) -> Tuple[str, Optional[Dict[str, Any]], Optional[str], bool]:
+        key = None
+        try:
+            if self.cache_dir:
+                content_hash = await asyncio.to_thread(self.hash_fn, file)
+                key = self.cache_key(content_hash, params)
+                cached = await asyncio.to_thread(self._load_cached, key)
+                if cached is not None:
+                    metrics.inc("chunk_cache_hits_total")
+                    return file, self.rebind(cached, file), None, True
+                metrics.inc("chunk_cache_misses_total")
+
+            result = await self._chunk(file, params)
+            if key is not None:
+                await asyncio.to_thread(self._store_cached, key, result)
+            return file, result, None, False
+        except Exception as e:
+            logger.error(f"文件分块失败 {file}: {e}")
+            metrics.inc("chunk_files_failed_total")
+            return file, None, str(e), False
+
+    async def run(self, files: List[str], params: dict) -> AsyncGenerator[Dict[str, Any], None]:
+        """并行分块，按完成顺序产出每个文件的结果
+
+        Args:
+            files: 文件路径列表
+            params: 分块参数
+
+        Yields:
+            dict: {"file", "cached", "chunks"}（chunks 为 file_id -> 分块信息），失败时为 {"file", "error"}
+        """
+        tasks = [asyncio.ensure_future(self._process(file, params)) for file in files]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                file, result, error, cached = await next_done
+                if error is not None:
+                    yield {"file": file, "error": error}
+                else:
+                    yield {"file": file, "cached": cached, "chunks": result}
+        finally:
+            for task in tasks:
+                task.cancel()
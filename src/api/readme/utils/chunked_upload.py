@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# 分片大小下限（最后一个分片除外），避免极小的分片产生大量分片文件
+MIN_PART_SIZE = 256 * 1024
+# 表单上传中文件以外的开销（边界、字段头、其他字段）的余量，用于按 Content-Length 提前拒绝
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """上传内容超过大小限制"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"File exceeds the upload limit of {limit} bytes")
+        self.limit = limit
+
+
+async def iter_upload(file: Any, chunk_size: int) -> AsyncIterator[bytes]:
+    """按固定大小读取 UploadFile（或任何带异步 read(size) 的对象）"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def iter_bytes(content: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    """把内存中的字节按固定大小切分，兼容直接传入文件内容的调用方"""
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """按块读取文件计算 sha256（阻塞，应在线程中调用）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def _write_chunk(handle, digest, chunk: bytes):
+    handle.write(chunk)
+    digest.update(chunk)
+
+
+async def write_stream(chunks: AsyncIterator[bytes], path: str, max_bytes: Optional[int] = None) -> Tuple[int, str]:
+    """把异步字节流写入文件，边写边计算 sha256
+
+    写文件和计算哈希在线程中执行，读取下一块与写入上一块重叠进行；先写入临时文件，完成后原子替换，
+    超过大小限制或中途失败时删除临时文件。
+
+    Args:
+        chunks: 字节块的异步迭代器
+        path: 目标文件路径
+        max_bytes: 大小上限，超过时抛出 UploadTooLarge
+
+    Returns:
+        (写入字节数, sha256 十六进制摘要)
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    handle = await asyncio.to_thread(open, tmp_path, "wb")
+    pending: Optional[asyncio.Future] = None
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            if pending is not None:
+                await pending
+            pending = asyncio.ensure_future(asyncio.to_thread(_write_chunk, handle, digest, chunk))
+        if pending is not None:
+            await pending
+            pending = None
+        await asyncio.to_thread(handle.close)
+        await asyncio.to_thread(os.replace, tmp_path, path)
+    except BaseException:
+        if pending is not None:
+            # 等待进行中的写入结束后再关闭文件
+            await asyncio.gather(pending, return_exceptions=True)
+        handle.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    metrics.inc("upload_bytes_total", size)
+    return size, digest.hexdigest()
+
+
+class MultipartUploads:
+    """可续传的分片上传
+
+    每个上传在暂存目录下有一个子目录，保存清单 manifest.json 和已收到的分片文件；状态全部落盘，
+    服务重启或客户端断线后可以查询已收到的分片并只补传缺失部分。分片先写入临时文件再改名，
+    只有完整写入的分片才会被计入。
+    """
+
+    def __init__(self, root: str, part_size: int = 16 * 1024 * 1024, max_bytes: Optional[int] = None,
+                 ttl: float = 86400, max_parts: int = 10000):
+        """初始化分片上传管理
+
+        Args:
+            root: 暂存目录
+            part_size: 默认分片大小（字节），不小于 MIN_PART_SIZE
+            max_bytes: 单个文件大小上限
+            ttl: 未完成的上传保留时间（秒），超时后在创建新上传时清理
+            max_parts: 单个上传的最大分片数
+        """
+        self.root = root
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_parts = max_parts
+
+    def _dir(self, upload_id: str) -> str:
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise KeyError(upload_id)
+        return os.path.join(self.root, upload_id)
+
+    def _load(self, upload_id: str) -> Dict[str, Any]:
+        path = os.path.join(self._dir(upload_id), "manifest.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+
+    @staticmethod
+    def _part_path(upload_dir: str, index: int) -> str:
+        return os.path.join(upload_dir, f"{index:06d}.part")
+
+    def _received(self, upload_dir: str, manifest: Dict[str, Any]) -> list:
+        return [index for index in range(manifest["total_parts"])
+                if os.path.exists(self._part_path(upload_dir, index))]
+
+    def part_length(self, manifest: Dict[str, Any], index: int) -> int:
+        """分片的期望长度：最后一个分片为剩余字节数，其余为分片大小"""
+        if index == manifest["total_parts"] - 1:
+            return manifest["total_size"] - manifest["part_size"] * index
+        return manifest["part_size"]
+
+    def create(self, filename: str, total_size: int, part_size: Optional[int] = None,
+               extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """创建分片上传
+
+        Args:
+            filename: 原始文件名
+            total_size: 文件总大小（字节）
+            part_size: 分片大小，不传时使用默认值
+            extra: 随清单保存的附加信息（例如 db_id）
+
+        Returns:
+            dict: 清单，包含 upload_id、part_size、total_parts
+        """
+        if total_size <= 0:
+            raise ValueError("total_size must be positive")
+        if self.max_bytes and total_size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        part_size = int(part_size or self.part_size)
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        total_parts = (total_size + part_size - 1) // part_size
+        if total_parts > self.max_parts:
+            raise ValueError(f"Upload would have {total_parts} parts, limit is {self.max_parts}; use a larger part_size")
+        self.purge_expired()
+
+        manifest = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": filename,
+            "total_size": total_size,
+            "part_size": part_size,
+            "total_parts": total_parts,
+            "created_at": time.time(),
+            **(extra or {}),
+        }
+        upload_dir = self._dir(manifest["upload_id"])
+        os.makedirs(upload_dir, exist_ok=True)
+        with open(os.path.join(upload_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        metrics.inc("upload_multipart_created_total")
+        return manifest
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """查询上传状态：清单加已收到的分片序号，续传时客户端只需补传缺失分片"""
+        manifest = self._load(upload_id)
+        received = self._received(self._dir(upload_id), manifest)
+        return {**manifest, "received_parts": received, "missing_parts": self._missing(manifest, received)}
+
+    @staticmethod
+    def _missing(manifest: Dict[str, Any], received: list) -> list:
+        received = set(received)
+        return [index for index in range(manifest["total_parts"]) if index not in received]
+
+    async def put_part(self, upload_id: str, index: int, chunks: AsyncIterator[bytes],
+                       content_length: Optional[int] = None) -> Dict[str, Any]:
+        """写入一个分片，重复上传同一分片会覆盖之前的内容
+
+        Args:
+            upload_id: 上传ID
+            index: 分片序号（从0开始）
+            chunks: 分片内容的异步字节流
+            content_length: 请求声明的长度，传入时先与分片期望长度比对
+
+        Returns:
+            dict: {"index", "size", "sha256"}
+        """
+        manifest = self._load(upload_id)
+        if not 0 <= index < manifest["total_parts"]:
+            raise ValueError(f"Part index {index} out of range 0..{manifest['total_parts'] - 1}")
+        expected = self.part_length(manifest, index)
+        if content_length is not None and content_length != expected:
+            raise ValueError(f"Part {index} declares {content_length} bytes, expected {expected}")
+        path = self._part_path(self._dir(upload_id), index)
+        try:
+            size, digest = await write_stream(chunks, path, max_bytes=expected)
+        except UploadTooLarge:
+            raise ValueError(f"Part {index} exceeds its expected size of {expected} bytes")
+        if size != expected:
+            os.remove(path)
+            raise ValueError(f"Part {index} has {size} bytes, expected {expected}")
+        metrics.inc("upload_parts_total")
+        return {"index": index, "size": size, "sha256": digest}
+
+    def _assemble(self, upload_dir: str, manifest: Dict[str, Any], target_path: str) -> Tuple[int, str]:
+        tmp_path = f"{target_path}.{uuid.uuid4().hex[:8]}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as out:
+                for index in range(manifest["total_parts"]):
+                    with open(self._part_path(upload_dir, index), "rb") as part:
+                        while True:
+                            chunk = part.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            out.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return size, digest.hexdigest()
+
+    async def complete(self, upload_id: str, target_path: str, sha256: Optional[str] = None) -> Tuple[int, str]:
+        """合并所有分片到目标文件并删除暂存目录
+
+        Args:
+            upload_id: 上传ID
+            target_path: 目标文件路径
+            sha256: 客户端计算的整体哈希，传入时校验
+
+        Returns:
+            (文件大小, sha256 十六进制摘要)
+        """
+        manifest = self._load(upload_id)
+        upload_dir = self._dir(upload_id)
+        missing = self._missing(manifest, self._received(upload_dir, manifest))
+        if missing:
+            raise ValueError(f"Missing parts: {missing[:20]}")
+
+        size, digest = await asyncio.to_thread(self._assemble, upload_dir, manifest, target_path)
+        if sha256 and sha256.lower() != digest:
+            os.remove(target_path)
+            raise ValueError(f"sha256 mismatch: expected {sha256}, got {digest}")
+        await asyncio.to_thread(shutil.rmtree, upload_dir, True)
+        metrics.inc("upload_multipart_completed_total")
+        return size, digest
+
+    def abort(self, upload_id: str):
+        """放弃上传并删除暂存的分片"""
+        upload_dir = self._dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            raise KeyError(upload_id)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def purge_expired(self):
+        """删除超过保留时间仍未完成的上传"""
+        if not os.path.isdir(self.root):
+            return
+        deadline = time.time() - self.ttl
+        for upload_id in os.listdir(self.root):
+            upload_dir = os.path.join(self.root, upload_id)
+            try:
+                if os.path.getmtime(upload_dir) < deadline:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+                    logger.info(f"Purged expired multipart upload {upload_id}")
+            except OSError:
+                continue
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Optional
+
+from rag.utils.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续失败达到阈值后打开，打开期间调用方直接跳过依赖；经过 reset_timeout 后进入半开状态，
+    只放行少量探测请求，探测成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 10.0, half_open_max_calls: int = 1):
+        """初始化熔断器
+
+        Args:
+            name: 名称，用于指标
+            failure_threshold: 打开熔断的连续失败次数
+            reset_timeout: 打开后进入半开状态的等待时间（秒）
+            half_open_max_calls: 半开状态下同时放行的探测请求数
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._half_opened_at = 0.0
+        self._probes = 0
+        # 失败调用耗时的指数加权平均，用于估算熔断节省的时间
+        self._failure_latency = 0.0
+        self._set_state(CLOSED)
+
+    def allow(self) -> bool:
+        """判断本次调用是否放行"""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                metrics.inc(f"circuit_{self.name}_short_circuited_total")
+                metrics.inc(f"circuit_{self.name}_time_saved_seconds", self._failure_latency)
+                return False
+            self._probes = 0
+            self._half_opened_at = time.monotonic()
+            self._set_state(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                if time.monotonic() - self._half_opened_at < self.reset_timeout:
+                    metrics.inc(f"circuit_{self.name}_short_circuited_total")
+                    return False
+                # 探测请求超过 reset_timeout 仍未报告结果（例如调用方未调用 release），重新放行探测
+                self._probes = 0
+                self._half_opened_at = time.monotonic()
+            self._probes += 1
+        return True
+
+    def cooling_down(self) -> bool:
+        """是否处于打开状态且尚未到半开时间；不占用探测名额、不计入熔断指标，供后台任务判断是否暂停"""
+        return self.state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def release(self):
+        """放行的调用没有结果就结束（例如被取消）时调用，归还半开状态的探测名额"""
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self):
+        """记录一次成功调用"""
+        self.failures = 0
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_failure(self, latency: float = 0.0):
+        """记录一次失败调用
+
+        Args:
+            latency: 失败调用的耗时（秒）
+        """
+        self.failures += 1
+        self._failure_latency = latency if not self._failure_latency else 0.8 * self._failure_latency + 0.2 * latency
+        metrics.inc(f"circuit_{self.name}_failures_total")
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set_gauge(f"circuit_{self.name}_state", _STATE_VALUES[state])
+
+
+class RequestBudget:
+    """单个请求在某个依赖上的总耗时预算，只在创建它的任务内生效"""
+
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds
+        self.task: Optional[asyncio.Task] = asyncio.current_task()
+
+    def remaining(self) -> Optional[float]:
+        """剩余预算（秒）；不在所属任务中调用时返回 None 表示不受限制"""
+        if self.task is not asyncio.current_task():
+            return None
+        return self.deadline - time.monotonic()
@@ -0,0 +1,218 @@
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+# 消息中保存的token数字段，发送给模型前移除
+TOKENS_FIELD = "tokens"
+# 发送给模型的消息字段，随会话保存的token计数、消息ID等字段不进入提示词
+PROMPT_FIELDS = ("role", "content")
+
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def _load_encoding():
+    """按 CONTEXT_TOKENIZER 加载精确分词器，未配置或不可用时使用估算"""
+    if os.getenv("CONTEXT_TOKENIZER", "estimate").lower() != "tiktoken":
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken不可用，使用估算分词: {e}")
+        return None
+
+
+_encoding = _load_encoding()
+
+
+# 只缓存不超过该长度的文本的计数：缓存以文本为键，长文本（整段检索片段、长回答）会被缓存一直引用
+CACHE_MAX_CHARS = 2048
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的token数
+
+    默认按 CJK 字符每字一个token、其他字符每4个字符一个token估算，误差在预算留出的余量之内；
+    配置 CONTEXT_TOKENIZER=tiktoken 时使用精确分词。不超过 CACHE_MAX_CHARS 的文本结果按文本缓存。
+    """
+    if not text:
+        return 0
+    if len(text) <= CACHE_MAX_CHARS:
+        return _count_tokens_cached(text)
+    return _count_tokens(text)
+
+
+@lru_cache(maxsize=8192)
+def _count_tokens_cached(text: str) -> int:
+    return _count_tokens(text)
+
+
+def _count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    """消息的token数，优先使用随会话保存的计数（客户端传入的历史在进入前已移除该字段）"""
+    tokens = message.get(TOKENS_FIELD)
+    if isinstance(tokens, int):
+        return tokens
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+class ContextBuilder:
+    """按模型token预算组装提示词上下文
+
+    系统提示词和当前问题始终保留；检索到的知识库片段按相关度排序后装入片段预算；
+    历史消息从最近一轮开始向前按整轮装入剩余预算。
+    """
+
+    def __init__(self, default_budget: int = 16000, budgets: Optional[Dict[str, int]] = None,
+                 reserve_output: int = 1024, retrieval_ratio: float = 0.5):
+        """初始化上下文构建器
+
+        Args:
+            default_budget: 未单独配置的模型使用的上下文token预算
+            budgets: 按 "provider/model" 配置的预算
+            reserve_output: 为模型输出预留的token数
+            retrieval_ratio: 检索片段最多占用的预算比例
+        """
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.reserve_output = reserve_output
+        self.retrieval_ratio = retrieval_ratio
+
+    def budget_for(self, model_key: Tuple[str, Optional[str]], meta: dict) -> int:
+        """计算本次请求可用于输入的token预算，meta.context_budget 优先"""
+        budget = meta.get("context_budget")
+        if not budget:
+            provider, name = model_key
+            budget = self.budgets.get(f"{provider}/{name}", self.budgets.get(provider, self.default_budget))
+        return max(int(budget) - self.reserve_output, 0)
+
+    def chunk_budget(self, budget: int) -> int:
+        """检索片段可用的token预算"""
+        return int(budget * self.retrieval_ratio)
+
+    @staticmethod
+    def _relevance(doc: dict) -> float:
+        """片段的相关度，越大越相关；只有距离时取其相反数（距离越小越相关）"""
+        for field in ("rerank_score", "score"):
+            value = doc.get(field)
+            if isinstance(value, (int, float)):
+                return float(value)
+        distance = doc.get("distance")
+        if isinstance(distance, (int, float)):
+            return -float(distance)
+        return 0.0
+
+    def pack_results(self, result: dict, budget: int) -> dict:
+        """按相关度排序装入知识库检索片段，超出预算的片段被丢弃
+
+        Args:
+            result: 知识库检索结果，results 中每项的 entity.text 为片段文本
+            budget: 片段token预算
+
+        Returns:
+            dict: 只包含装入片段的检索结果副本
+        """
+        docs = result.get("results") if isinstance(result, dict) else None
+        if not docs:
+            return result
+
+        packed = []
+        used = 0
+        for doc in sorted(docs, key=self._relevance, reverse=True):
+            tokens = count_tokens(doc.get("entity", {}).get("text") or "")
+            if used + tokens > budget:
+                continue
+            packed.append(doc)
+            used += tokens
+
+        dropped = len(docs) - len(packed)
+        if dropped:
+            metrics.inc("context_chunks_dropped_total", dropped)
+            logger.debug(f"Context budget {budget} kept {len(packed)}/{len(docs)} chunks ({used} tokens)")
+        metrics.observe("context_chunk_tokens", used)
+        return {**result, "results": packed}
+
+    def fit_messages(self, messages: List[dict], budget: int) -> List[dict]:
+        """把消息列表裁剪到预算内
+
+        系统消息和最后一条消息（当前问题）始终保留，其余历史按整轮从新到旧装入。
+
+        Args:
+            messages: get_history_with_msg 返回的消息列表
+            budget: 输入token预算
+
+        Returns:
+            list: 裁剪后的消息列表，只保留 role/content 字段
+        """
+        if not messages:
+            return messages
+
+        pinned_head = [m for m in messages[:-1] if m.get("role") == "system"]
+        history = [m for m in messages[:-1] if m.get("role") != "system"]
+        current = messages[-1]
+
+        used = sum(message_tokens(m) for m in pinned_head) + message_tokens(current)
+        if used > budget:
+            logger.warning(f"Prompt exceeds context budget without history: {used} > {budget}")
+
+        # 按轮（从用户消息开始）分组，从最近一轮向前装入
+        rounds: List[List[dict]] = []
+        for message in history:
+            if message.get("role") == "user" or not rounds:
+                rounds.append([message])
+            else:
+                rounds[-1].append(message)
+
+        kept: List[List[dict]] = []
+        for round_messages in reversed(rounds):
+            tokens = sum(message_tokens(m) for m in round_messages)
+            if used + tokens > budget:
+                break
+            kept.append(round_messages)
+            used += tokens
+
+        dropped = len(rounds) - len(kept)
+        if dropped:
+            metrics.inc("context_rounds_dropped_total", dropped)
+        metrics.observe("context_prompt_tokens", used)
+
+        fitted = pinned_head + [m for round_messages in reversed(kept) for m in round_messages] + [current]
+        return [self.strip(m) for m in fitted]
+
+    @staticmethod
+    def strip(message: dict) -> dict:
+        """只保留模型接口接受的 role/content 字段（移除随会话保存的token计数和消息ID）"""
+        return {k: message[k] for k in PROMPT_FIELDS if k in message}
+
+    @staticmethod
+    def annotate(message: dict) -> dict:
+        """为待保存的消息附加token计数，后续轮次无需重新分词"""
+        return {**message, TOKENS_FIELD: message_tokens(message)}
+
+
+def parse_budgets(raw: Optional[str]) -> Dict[str, int]:
+    """解析 JSON 格式的模型预算配置，例如 {"openai/gpt-4o": 32000, "zhipu": 8000}"""
+    if not raw:
+        return {}
+    try:
+        return {key: int(value) for key, value in json.loads(raw).items()}
+    except Exception as e:
+        logger.warning(f"CONTEXT_TOKEN_BUDGETS 配置无效: {e}")
+        return {}
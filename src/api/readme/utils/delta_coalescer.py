@@ -0,0 +1,131 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, List
+
+from rag.utils.metrics import metrics
+
+
+@dataclass
+class CoalescedDelta:
+    """合并后的模型增量，字段与模型返回的 GeneralResponse 保持一致"""
+    content: str = ""
+    reasoning_content: str = ""
+    is_full: bool = False
+
+
+class DeltaCoalescer:
+    """模型增量合并器
+
+    按时间窗口或字节上限把多个细碎的模型增量合并为一个，减少 SSE 事件数量和序列化开销。
+    第一个增量总是立即发出，保证首字延迟不受影响。
+    """
+
+    def __init__(self, window_ms: int = 30, max_bytes: int = 1024):
+        """初始化合并器
+
+        Args:
+            window_ms: 合并时间窗口（毫秒），为 0 时不合并
+            max_bytes: 单次合并的最大字节数，达到后立即发出
+        """
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+
+    async def coalesce(self, deltas: AsyncIterator[Any]) -> AsyncGenerator[Any, None]:
+        """合并异步增量流
+
+        Args:
+            deltas: 模型增量的异步迭代器
+
+        Yields:
+            CoalescedDelta 或原样透传的完整内容（is_full）/未知类型对象
+        """
+        if self.window <= 0:
+            async for delta in deltas:
+                yield delta
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = deltas.__aiter__()
+        pending = None
+        content: List[str] = []
+        reasoning: List[str] = []
+        size = 0
+        deadline = None
+        first = True
+        chunk_count = 0
+        delta_count = 0
+        started = time.monotonic()
+
+        def flush() -> CoalescedDelta:
+            nonlocal content, reasoning, size, deadline, chunk_count
+            merged = CoalescedDelta(content="".join(content), reasoning_content="".join(reasoning))
+            metrics.observe("sse_chunk_bytes", size)
+            chunk_count += 1
+            content, reasoning, size, deadline = [], [], 0, None
+            return merged
+
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+
+                if deadline is not None:
+                    # 缓冲区非空：等待下一个增量，超时则先发出已缓冲的内容
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        yield flush()
+                        continue
+                    done, _ = await asyncio.wait({pending}, timeout=timeout)
+                    if not done:
+                        yield flush()
+                        continue
+
+                try:
+                    delta = await pending
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if pending.done():
+                        pending = None
+                delta_count += 1
+
+                if not hasattr(delta, "content") or getattr(delta, "is_full", False):
+                    # 完整内容或未知对象：先发出缓冲区再原样透传
+                    if deadline is not None:
+                        yield flush()
+                    yield delta
+                    continue
+
+                if getattr(delta, "reasoning_content", None):
+                    reasoning.append(delta.reasoning_content)
+                    size += len(delta.reasoning_content.encode("utf-8"))
+                if delta.content:
+                    content.append(delta.content)
+                    size += len(delta.content.encode("utf-8"))
+                if not size:
+                    continue
+
+                if first or size >= self.max_bytes:
+                    first = False
+                    yield flush()
+                elif deadline is None:
+                    deadline = loop.time() + self.window
+
+            if deadline is not None:
+                yield flush()
+        finally:
+            if pending is not None:
+                pending.cancel()
+                try:
+                    await pending
+                except BaseException:
+                    pass
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            elapsed = time.monotonic() - started
+            metrics.inc("sse_deltas_total", delta_count)
+            metrics.inc("sse_chunks_total", chunk_count)
+            if chunk_count and elapsed > 0:
+                metrics.observe("sse_chunks_per_second", chunk_count / elapsed)
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from typing import AsyncGenerator, Awaitable, Callable
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+
+# 队列中的控制标记：生产任务结束、等待超时
+_END = object()
+_IDLE = object()
+
+
+async def cancel_on_disconnect(stream: AsyncGenerator[bytes, None], is_disconnected: Callable[[], Awaitable[bool]],
+                               poll_interval: float = 0.5) -> AsyncGenerator[bytes, None]:
+    """客户端断开时取消流
+
+    在独立任务中消费 stream，并定期调用 is_disconnected（例如 Request.is_disconnected）检查客户端状态。
+    检测到断开或本生成器被关闭时取消该任务，取消信号在 stream 当前的 await 处抛出，
+    使检索、模型调用等正在进行的工作立即停止并执行各自的清理逻辑。
+
+    Args:
+        stream: 要转发的流（整个生命周期在同一个任务中运行，请求内的 ContextVar 保持有效）
+        is_disconnected: 返回客户端是否已断开的协程函数
+        poll_interval: 检查间隔（秒）
+
+    Yields:
+        bytes: stream 产生的数据块
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def produce():
+        try:
+            async for chunk in stream:
+                await queue.put((None, chunk))
+            await queue.put((_END, None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put((_END, e))
+
+    producer = asyncio.create_task(produce())
+    last_check = time.monotonic()
+    try:
+        while True:
+            timeout = max(poll_interval - (time.monotonic() - last_check), 0)
+            try:
+                kind, payload = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                kind, payload = _IDLE, None
+
+            if kind is _END:
+                if payload is not None:
+                    raise payload
+                return
+
+            if time.monotonic() - last_check >= poll_interval:
+                last_check = time.monotonic()
+                if await is_disconnected():
+                    logger.info("客户端已断开，取消流")
+                    metrics.inc("chat_disconnected_total")
+                    return
+
+            if kind is not _IDLE:
+                yield payload
+    finally:
+        if not producer.done():
+            producer.cancel()
+            metrics.inc("chat_cancelled_streams_total")
+        try:
+            await producer
+        except (asyncio.CancelledError, Exception):
+            pass
+        await stream.aclose()
@@ -0,0 +1,371 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from packages.utils.logging_config import logger
+from rag.utils.context_builder import count_tokens
+from rag.utils.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不做跨进程加锁
+    fcntl = None
+
+_KEY_SIZE = 32
+
+
+class EmbeddingCache:
+    """持久化的向量缓存
+
+    向量按行保存在 float32 内存映射文件中，行号与 keys.bin 中按顺序追加的 32 字节文本哈希一一对应；
+    先写向量再追加哈希，进程中断时未写完的行不会被读到。写入时持有目录下的文件锁并读取其他进程新追加的行，
+    多个工作进程可以共用同一个缓存目录。
+
+    数据按代保存在 <directory>/<代号>/ 下，CURRENT 记录当前代号。行数达到 max_rows 或调用 clear() 时
+    切换到新的一代并删除旧数据（整体淘汰）；其他进程在下次读写时发现代号变化，改用新的一代。
+    清理缓存可调用 clear()（DELETE /data/embedding/cache），或在服务停止时删除整个缓存目录。
+    """
+
+    def __init__(self, directory: str, initial_capacity: int = 4096, max_rows: int = 200000):
+        """初始化缓存
+
+        Args:
+            directory: 缓存目录（每个向量模型一个目录）
+            initial_capacity: 初始行数，写满后按倍数扩容
+            max_rows: 最多缓存的向量条数，达到后清空重新开始；0 表示不限制
+        """
+        self.directory = directory
+        self.initial_capacity = initial_capacity
+        self.max_rows = max_rows
+        os.makedirs(directory, exist_ok=True)
+        self._current_path = os.path.join(directory, "CURRENT")
+        self._lock_path = os.path.join(directory, "lock")
+        self._lock = threading.Lock()
+        self.generation: Optional[int] = None
+        with self._lock:
+            self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _reset(self, generation: int):
+        """切换到指定的一代（调用方持有锁）"""
+        self.generation = generation
+        # 目录在首次写入时（持有文件锁）创建：读取时创建可能复活其他进程刚删除的旧代目录
+        self._generation_dir = os.path.join(self.directory, str(generation))
+        self._keys_path = os.path.join(self._generation_dir, "keys.bin")
+        self._vectors_path = os.path.join(self._generation_dir, "vectors.f32")
+        self._meta_path = os.path.join(self._generation_dir, "meta.json")
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self._vectors: Optional[np.memmap] = None
+
+    def _current_generation(self) -> int:
+        try:
+            with open(self._current_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _map(self, dim: int, capacity: int):
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        self.dim, self.capacity = dim, capacity
+
+    def _refresh(self):
+        """读取当前代号、元数据和其他进程新追加的哈希（调用方持有锁）
+
+        读取时不持有文件锁，其他进程可能恰好切换到新的一代并删除了这一代的文件：此时重新读取代号，
+        仍然读不到时按空缓存处理（只影响命中率）。
+        """
+        for _ in range(2):
+            generation = self._current_generation()
+            if generation != self.generation:
+                self._reset(generation)
+            try:
+                self._load()
+                return
+            except FileNotFoundError:
+                metrics.inc("embedding_cache_refresh_races_total")
+        self._reset(self._current_generation())
+
+    def _load(self):
+        """读取这一代的元数据和新追加的哈希，文件已被删除时抛出 FileNotFoundError"""
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim or meta["capacity"] != self.capacity:
+                self._map(meta["dim"], meta["capacity"])
+        if not os.path.exists(self._keys_path):
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._rows * _KEY_SIZE)
+            data = f.read()
+        for offset in range(0, len(data) - len(data) % _KEY_SIZE, _KEY_SIZE):
+            if self._rows >= self.capacity:
+                break
+            self._index.setdefault(data[offset:offset + _KEY_SIZE], self._rows)
+            self._rows += 1
+
+    def _write_atomic(self, path: str, content: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _rotate(self):
+        """切换到新的一代并删除旧数据（调用方持有线程锁和文件锁）"""
+        previous = self.generation
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._write_atomic(self._current_path, str(previous + 1))
+        self._reset(previous + 1)
+        # 其他进程映射中的旧文件在解除映射前仍然可读
+        shutil.rmtree(os.path.join(self.directory, str(previous)), ignore_errors=True)
+        metrics.inc("embedding_cache_rotations_total")
+        logger.info(f"向量缓存 {self.directory} 切换到第 {previous + 1} 代")
+
+    def _ensure(self, dim: int, rows: int):
+        """按需创建或扩容向量文件（调用方持有锁）"""
+        if self.dim is not None and dim != self.dim:
+            raise ValueError(f"Embedding dimension changed from {self.dim} to {dim}, use a new cache directory")
+        if rows <= self.capacity:
+            return
+        capacity = max(self.capacity * 2, self.initial_capacity, rows)
+        if self.max_rows:
+            capacity = min(capacity, max(self.max_rows, rows))
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        os.makedirs(self._generation_dir, exist_ok=True)
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * dim * 4)
+        self._write_atomic(self._meta_path, json.dumps({"dim": dim, "capacity": capacity}))
+        self._map(dim, capacity)
+
+    @contextmanager
+    def _locked(self):
+        """线程锁 + 跨进程文件锁"""
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        """批量读取，返回命中的 哈希 -> 向量（副本）"""
+        with self._lock:
+            self._refresh()
+            rows = {key: self._index[key] for key in keys if key in self._index}
+            if not rows:
+                return {}
+            vectors = self._vectors[list(rows.values())]
+        return dict(zip(rows.keys(), np.array(vectors, dtype=np.float32)))
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray):
+        """批量写入，已存在的哈希跳过；写满 max_rows 时先切换到新的一代"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._locked():
+            self._refresh()
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._index]
+            if not new:
+                return
+            if self.max_rows and self._rows + len(new) > self.max_rows:
+                self._rotate()
+            start = self._rows
+            self._ensure(vectors.shape[1], start + len(new))
+            self._vectors[start:start + len(new)] = np.stack([vector for _, vector in new])
+            self._vectors.flush()
+            with open(self._keys_path, "ab") as key_file:
+                key_file.write(b"".join(key for key, _ in new))
+            for offset, (key, _) in enumerate(new):
+                self._index[key] = start + offset
+            self._rows += len(new)
+
+    def clear(self):
+        """清空缓存（切换到新的一代并删除旧数据）"""
+        with self._locked():
+            self._refresh()
+            self._rotate()
+
+
+class EmbeddingPipeline:
+    """文档向量化管线
+
+    输入文本按哈希去重，命中缓存的直接返回；其余按条数和token预算组成批次调用向量模型，
+    结果写回缓存并按输入顺序组装。统计向量化吞吐（条/秒）、缓存命中和去重节省的调用量。
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], Any], cache: Optional[EmbeddingCache] = None,
+                 batch_size: int = 64, max_batch_tokens: int = 8192, namespace: str = ""):
+        """初始化管线
+
+        Args:
+            embed_fn: 向量模型的批量调用 embed_fn(texts)，返回与输入等长的向量列表
+            cache: 向量缓存，为 None 时只做批内去重
+            batch_size: 单批最大条数
+            max_batch_tokens: 单批最大token数（单条超过时独占一批）
+            namespace: 参与哈希的命名空间（通常为模型名），不同模型的向量不会混用
+        """
+        self.embed_fn = embed_fn
+        self.cache = cache
+        self.batch_size = max(batch_size, 1)
+        self.max_batch_tokens = max_batch_tokens
+        self.namespace = namespace
+        self._stats_lock = threading.Lock()
+        self._stats = {"requested": 0, "embedded": 0, "cache_hits": 0, "deduplicated": 0, "batches": 0,
+                       "embed_seconds": 0.0}
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).digest()
+
+    def batches(self, texts: List[str]) -> Iterator[List[int]]:
+        """按条数和token预算切分批次，产出文本下标列表"""
+        batch, tokens = [], 0
+        for index, text in enumerate(texts):
+            size = count_tokens(text)
+            if batch and (len(batch) >= self.batch_size or tokens + size > self.max_batch_tokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(index)
+            tokens += size
+        if batch:
+            yield batch
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """向量化文本
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            np.ndarray: float32 向量矩阵，行与输入一一对应
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self.key(text) for text in texts]
+        unique: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+
+        vectors = self.cache.get_many(list(unique)) if self.cache is not None else {}
+        missing = [key for key in unique if key not in vectors]
+        missing_texts = [unique[key] for key in missing]
+
+        embed_seconds, batch_count = 0.0, 0
+        for batch in self.batches(missing_texts):
+            started = time.perf_counter()
+            result = np.asarray(self.embed_fn([missing_texts[i] for i in batch]), dtype=np.float32)
+            embed_seconds += time.perf_counter() - started
+            batch_count += 1
+            batch_keys = [missing[i] for i in batch]
+            vectors.update(zip(batch_keys, result))
+            if self.cache is not None:
+                self.cache.put_many(batch_keys, result)
+
+        with self._stats_lock:
+            self._stats["requested"] += len(texts)
+            self._stats["embedded"] += len(missing)
+            self._stats["cache_hits"] += len(unique) - len(missing)
+            self._stats["deduplicated"] += len(texts) - len(unique)
+            self._stats["batches"] += batch_count
+            self._stats["embed_seconds"] += embed_seconds
+        metrics.inc("embedding_requested_total", len(texts))
+        metrics.inc("embedding_embedded_total", len(missing))
+        metrics.inc("embedding_cache_hits_total", len(unique) - len(missing))
+        metrics.inc("embedding_deduplicated_total", len(texts) - len(unique))
+        if missing:
+            metrics.observe("embedding_batch_seconds", embed_seconds / max(batch_count, 1))
+
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self) -> dict:
+        """累计统计：embeddings_per_sec 为模型实际向量化吞吐，effective_per_sec 含缓存和去重"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        seconds = stats["embed_seconds"]
+        stats["embeddings_per_sec"] = round(stats["embedded"] / seconds, 1) if seconds else None
+        stats["effective_per_sec"] = round(stats["requested"] / seconds, 1) if seconds else None
+        stats["embed_seconds"] = round(seconds, 3)
+        stats["cache_size"] = len(self.cache) if self.cache is not None else 0
+        return stats
+
+
+_ingestion = threading.local()
+
+
+@contextmanager
+def ingestion():
+    """标记当前线程正在入库，期间 CachedEmbedModel 的向量化调用才经过管线和缓存"""
+    depth = getattr(_ingestion, "depth", 0)
+    _ingestion.depth = depth + 1
+    try:
+        yield
+    finally:
+        _ingestion.depth = depth
+
+
+class CachedEmbedModel:
+    """包装知识库的向量模型
+
+    入库期间（ingestion() 内）encode/batch_encode 经过 EmbeddingPipeline（批处理、去重、缓存），返回向量列表；
+    检索、语义缓存等查询时的调用直接交给原模型，查询文本不写入缓存。其他属性和方法（例如 encode_queries）透传给原模型。
+    """
+
+    def __init__(self, model: Any, pipeline: EmbeddingPipeline):
+        self.model = model
+        self.pipeline = pipeline
+
+    def encode(self, message):
+        if not getattr(_ingestion, "depth", 0):
+            return self.model.encode(message)
+        if isinstance(message, str):
+            return self.pipeline.encode([message])[0].tolist()
+        return self.pipeline.encode(list(message)).tolist()
+
+    def batch_encode(self, messages, batch_size: Optional[int] = None):
+        if not getattr(_ingestion, "depth", 0):
+            return self.model.batch_encode(messages, batch_size) if batch_size else self.model.batch_encode(messages)
+        return self.pipeline.encode(list(messages)).tolist()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def model_id(model: Any) -> str:
+    """向量模型的标识，用作缓存目录名和哈希命名空间"""
+    name = (getattr(model, "embed_model_fullname", None) or getattr(model, "model", None)
+            or getattr(model, "model_name", None) or type(model).__name__)
+    return re.sub(r"[^0-9A-Za-z._-]+", "_", str(name))
+
+
+def install(knowledge_base: Any, cache_root: Optional[str], batch_size: int = 64,
+            max_batch_tokens: int = 8192, max_rows: int = 200000) -> Optional[EmbeddingPipeline]:
+    """为知识库的向量模型接入管线，知识库没有 embed_model 时返回 None
+
+    缓存保存在 <cache_root>/<模型标识>/，最多 max_rows 条（0 表示不限制），写满后整体清空重新开始。
+    """
+    model = getattr(knowledge_base, "embed_model", None)
+    if model is None:
+        logger.warning("knowledge_base 没有 embed_model，向量化管线未启用")
+        return None
+    if isinstance(model, CachedEmbedModel):
+        return model.pipeline
+    name = model_id(model)
+    cache = EmbeddingCache(os.path.join(cache_root, name), max_rows=max_rows) if cache_root else None
+    pipeline = EmbeddingPipeline(model.encode, cache, batch_size, max_batch_tokens, namespace=name)
+    knowledge_base.embed_model = CachedEmbedModel(model, pipeline)
+    logger.info(f"向量化管线已启用: {name}, 缓存 {len(cache) if cache else 0} 条")
+    return pipeline
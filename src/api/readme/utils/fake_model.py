@@ -0,0 +1,119 @@
+import hashlib
+import random
+import time
+from typing import Iterator, List, Union
+
+import numpy as np
+
+
+class FakeResponse:
+    """与模型提供商返回的 GeneralResponse 字段一致的响应对象"""
+
+    def __init__(self, content: str, is_full: bool = False, reasoning_content: str = None):
+        self.content = content
+        self.is_full = is_full
+        self.reasoning_content = reasoning_content
+
+
+class FakeModel:
+    """本地假模型，用于压测和基准，不访问任何外部服务
+
+    按固定首字延迟和输出速率模拟提供商的阻塞调用，可按比例注入失败以验证重试逻辑。
+    """
+
+    def __init__(self, model_name: str = None, latency_ms: float = 200, tokens_per_second: float = 200,
+                 output_tokens: int = 32, failure_rate: float = 0.0, seed: int = None):
+        """初始化假模型
+
+        Args:
+            model_name: 模型名称
+            latency_ms: 首字延迟（毫秒）
+            tokens_per_second: 输出速率
+            output_tokens: 每次回答的token数
+            failure_rate: 调用失败的概率（0~1）
+            seed: 随机种子
+        """
+        self.model_name = model_name or "fake"
+        self.latency = latency_ms / 1000
+        self.token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+        self.output_tokens = output_tokens
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def _answer(self, message: Union[str, List[dict]]) -> List[str]:
+        if isinstance(message, list):
+            message = message[-1].get("content", "") if message else ""
+        return [message[:16]] + [f" token{i}" for i in range(1, self.output_tokens)]
+
+    def predict(self, message: Union[str, List[dict]], stream: bool = False):
+        """模拟模型调用
+
+        Args:
+            message: 提示词或消息列表
+            stream: 是否流式返回
+
+        Returns:
+            stream=False 时返回 FakeResponse，stream=True 时返回增量生成器
+        """
+        if stream:
+            return self._stream(message)
+        time.sleep(self.latency + self.token_interval * self.output_tokens)
+        self._maybe_fail()
+        return FakeResponse("".join(self._answer(message)), is_full=True)
+
+    def _stream(self, message: Union[str, List[dict]]) -> Iterator[FakeResponse]:
+        time.sleep(self.latency)
+        self._maybe_fail()
+        for word in self._answer(message):
+            if self.token_interval:
+                time.sleep(self.token_interval)
+            yield FakeResponse(word)
+
+    def _maybe_fail(self):
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise RuntimeError("Fake model injected failure")
+
+
+class FakeEmbedder:
+    """本地确定性假向量模型，用于入库压测和向量化基准
+
+    向量由文本哈希生成，相同文本总是得到相同的单位向量；每次调用按固定开销加每条耗时模拟远程向量服务。
+    """
+
+    def __init__(self, dimension: int = 1024, call_latency_ms: float = 20, per_text_ms: float = 1,
+                 model_name: str = "fake-embedding"):
+        """初始化假向量模型
+
+        Args:
+            dimension: 向量维度
+            call_latency_ms: 每次调用的固定开销（毫秒）
+            per_text_ms: 每条文本的耗时（毫秒）
+            model_name: 模型名称
+        """
+        self.dimension = dimension
+        self.call_latency = call_latency_ms / 1000
+        self.per_text = per_text_ms / 1000
+        self.model = model_name
+        self.calls = 0
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, message: Union[str, List[str]]):
+        """向量化文本，传入字符串时返回单个向量，传入列表时返回向量列表"""
+        texts = [message] if isinstance(message, str) else list(message)
+        self.calls += 1
+        time.sleep(self.call_latency + self.per_text * len(texts))
+        vectors = [self._vector(text).tolist() for text in texts]
+        return vectors[0] if isinstance(message, str) else vectors
+
+    def batch_encode(self, messages: List[str], batch_size: int = 20):
+        vectors = []
+        for start in range(0, len(messages), batch_size):
+            vectors.extend(self.encode(messages[start:start + batch_size]))
+        return vectors
+
+    def encode_queries(self, queries: Union[str, List[str]]):
+        return self.encode(queries)
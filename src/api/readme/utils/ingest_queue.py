@@ -0,0 +1,195 @@
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.cache.ingest_jobs import CANCELLED, COMPLETED, DONE, FAILED, RUNNING, SKIPPED, IngestJobStore
+from rag.utils.metrics import metrics
+
+# 已结束的任务状态
+TERMINAL_STATUSES = (COMPLETED, CANCELLED)
+
+
+class IngestQueue:
+    """异步入库任务队列
+
+    提交后立即返回任务ID，任务中的文件逐个交给 handler 处理，所有任务共享 concurrency 个并发名额；
+    每个文件的状态实时写入任务表，服务启动时（start，或首次使用队列时）恢复未完成的任务。
+    任务表是本地 sqlite，所有读写都在线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, store: IngestJobStore, handler: Callable[[str, str, str, Any], Awaitable[dict]],
+                 concurrency: int = 2, retention: float = 7 * 86400):
+        """初始化队列
+
+        Args:
+            store: 任务表
+            handler: 处理单个文件的协程函数 handler(kind, db_id, item_key, payload)，失败时抛出异常；
+                返回结果中 added 为空且 skipped 非空时该文件记为跳过
+            concurrency: 同时处理的文件数（所有任务共享）
+            retention: 已结束任务的保留时间（秒）
+        """
+        self.store = store
+        self.handler = handler
+        self.concurrency = max(concurrency, 1)
+        self.retention = retention
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._signals: Dict[str, asyncio.Event] = {}
+        self._started = False
+
+    async def start(self):
+        """清理过期任务并恢复中断的任务（应用启动时调用；未调用时在首次使用队列时执行）"""
+        if self._started:
+            return
+        self._started = True
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        purged = await asyncio.to_thread(self.store.purge, time.time() - self.retention)
+        if purged:
+            logger.info(f"清理过期入库任务 {purged} 个")
+        for job_id in await asyncio.to_thread(self.store.recover):
+            logger.info(f"恢复未完成的入库任务 {job_id}")
+            self._launch(job_id)
+
+    def _launch(self, job_id: str):
+        task = asyncio.create_task(self._run_job(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    def _notify(self, job_id: str):
+        signal = self._signals.pop(job_id, None)
+        if signal is not None:
+            signal.set()
+
+    async def submit(self, db_id: str, kind: str, items: List[Tuple[str, Any]]) -> str:
+        """提交任务
+
+        Args:
+            db_id: 数据库ID
+            kind: 任务类型（files 或 chunks）
+            items: (文件标识, 附加数据) 列表
+
+        Returns:
+            str: 任务ID
+        """
+        await self.start()
+        job_id = await asyncio.to_thread(self.store.create, db_id, kind, items)
+        metrics.inc("ingest_jobs_submitted_total")
+        self._launch(job_id)
+        return job_id
+
+    async def snapshot(self, job_id: str, include_items: bool = True) -> Optional[Dict[str, Any]]:
+        """任务进度：状态、各状态文件数、吞吐（文件/秒）和每个文件的状态"""
+        await self.start()
+        return await asyncio.to_thread(self._snapshot, job_id, include_items)
+
+    def _snapshot(self, job_id: str, include_items: bool = True) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        counts = self.store.counts(job_id)
+        total = sum(counts.values())
+        processed = counts[DONE] + counts[SKIPPED] + counts[FAILED]
+        elapsed = None
+        if job["started_at"]:
+            elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+        snapshot = {
+            **job,
+            "total": total,
+            "counts": counts,
+            "progress": round((processed + counts[CANCELLED]) / total, 4) if total else 1.0,
+            "elapsed": round(elapsed, 3) if elapsed is not None else None,
+            "throughput": round(processed / elapsed, 3) if elapsed else None,
+        }
+        if include_items:
+            snapshot["items"] = self.store.items(job_id)
+        return snapshot
+
+    async def list(self, db_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的任务（不含文件明细）"""
+        await self.start()
+
+        def load():
+            return [self._snapshot(job["job_id"], include_items=False) for job in self.store.list(db_id, limit)]
+
+        return await asyncio.to_thread(load)
+
+    async def cancel(self, job_id: str) -> Optional[int]:
+        """取消任务：未开始的文件不再处理，正在处理的文件完成后任务结束
+
+        Returns:
+            取消的文件数，任务不存在时返回 None
+        """
+        await self.start()
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return None
+        cancelled = await asyncio.to_thread(self.store.cancel_pending, job_id)
+        if job_id not in self._tasks and job["status"] not in TERMINAL_STATUSES:
+            await asyncio.to_thread(self.store.set_status, job_id, CANCELLED)
+        self._notify(job_id)
+        return cancelled
+
+    async def wait(self, job_id: str):
+        """等待任务结束"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def watch(self, job_id: str, heartbeat: float = 15) -> AsyncGenerator[Dict[str, Any], None]:
+        """订阅任务进度：立即产出一次快照，之后每次状态变化产出一次，任务结束后停止
+
+        Args:
+            job_id: 任务ID
+            heartbeat: 无变化时重发快照的间隔（秒），用于保持连接
+        """
+        last = None
+        while True:
+            signal = self._signals.setdefault(job_id, asyncio.Event())
+            snapshot = await self.snapshot(job_id)
+            if snapshot is None:
+                return
+            state = (snapshot["status"], tuple(snapshot["counts"].values()))
+            if state != last:
+                yield snapshot
+                last = state
+            if snapshot["status"] in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(signal.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # 无变化时也重发一次快照，保持连接
+                last = None
+
+    async def _run_job(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        items = await asyncio.to_thread(self.store.pending_items, job_id)
+        await asyncio.to_thread(self.store.set_status, job_id, RUNNING)
+        self._notify(job_id)
+        started = time.monotonic()
+        await asyncio.gather(*[self._run_item(job, idx, key, payload) for idx, key, payload in items])
+
+        counts = await asyncio.to_thread(self.store.counts, job_id)
+        status = CANCELLED if counts[CANCELLED] else COMPLETED
+        await asyncio.to_thread(self.store.set_status, job_id, status)
+        metrics.observe("ingest_job_seconds", time.monotonic() - started)
+        logger.info(f"入库任务 {job_id} 结束: {status} {counts}")
+        self._notify(job_id)
+
+    async def _run_item(self, job: Dict[str, Any], idx: int, key: str, payload: Any):
+        job_id = job["job_id"]
+        async with self._semaphore:
+            # 排队期间任务可能已被取消
+            if not await asyncio.to_thread(self.store.claim, job_id, idx):
+                return
+            self._notify(job_id)
+            try:
+                result = await self.handler(job["kind"], job["db_id"], key, payload)
+                status = SKIPPED if result.get("skipped") and not result.get("added") else DONE
+                await asyncio.to_thread(self.store.update_item, job_id, idx, status, None, result)
+                metrics.inc(f"ingest_items_{status}_total")
+            except Exception as e:
+                logger.warning(f"入库任务 {job_id} 处理 {key} 失败: {e}")
+                await asyncio.to_thread(self.store.update_item, job_id, idx, FAILED, str(e))
+                metrics.inc("ingest_items_failed_total")
+            self._notify(job_id)
@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Dict
+
+
+class Metrics:
+    """进程内指标注册表
+
+    提供计数器、仪表盘和摘要（count/sum/min/max）三类指标，
+    通过 snapshot() 导出给 /chat/metrics 等接口，不依赖外部监控组件。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._summaries: Dict[str, Dict[str, float]] = {}
+
+    def inc(self, name: str, value: float = 1):
+        """计数器累加"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        """设置仪表盘当前值"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """记录一次观测值"""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = {"count": 1, "sum": value, "min": value, "max": value}
+                return
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> dict:
+        """导出所有指标的当前快照"""
+        with self._lock:
+            summaries = {}
+            for name, summary in self._summaries.items():
+                summaries[name] = {**summary, "avg": summary["sum"] / summary["count"]}
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": summaries,
+            }
+
+
+class StageTimer:
+    """单个请求的阶段计时器
+
+    各阶段可以重叠（例如检索与模型建连并行），每个阶段独立记录开始和结束时间，
+    结束时写入 {prefix}_{stage}_seconds 摘要指标。
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._origin = time.perf_counter()
+        self._started: Dict[str, float] = {}
+        self.stages: Dict[str, float] = {}
+
+    def start(self, stage: str):
+        """标记阶段开始"""
+        self._started[stage] = time.perf_counter()
+
+    def stop(self, stage: str):
+        """标记阶段结束，未开始或已结束的阶段忽略"""
+        started = self._started.pop(stage, None)
+        if started is None:
+            return
+        self._record(stage, time.perf_counter() - started)
+
+    def mark(self, stage: str):
+        """记录从请求开始到当前的耗时（例如首字延迟），同一阶段只记录一次"""
+        if stage not in self.stages:
+            self._record(stage, time.perf_counter() - self._origin)
+
+    def _record(self, stage: str, seconds: float):
+        self.stages[stage] = round(seconds * 1000, 2)
+        metrics.observe(f"{self.prefix}_{stage}_seconds", seconds)
+
+
+# 全局指标实例
+metrics = Metrics()
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from packages import config
+from packages.models import select_model
+from packages.utils.logging_config import logger
+
+
+class ModelRegistry:
+    """模型客户端注册表
+
+    按 (model_provider, model_name) 缓存已初始化的模型实例，复用其内部的HTTP连接池（keep-alive），
+    超过容量时按LRU淘汰最久未使用的实例。请求的模型须在配置的模型列表中，避免任意名称占满注册表。
+    """
+
+    def __init__(self, max_size: int = 16, providers: Optional[Dict[str, Callable[..., Any]]] = None):
+        """初始化注册表
+
+        Args:
+            max_size: 最多缓存的模型实例数量
+            providers: 额外的模型提供商（名称到工厂函数的映射，工厂以 model_name 为参数），例如本地假模型
+        """
+        self.max_size = max_size
+        self.providers = providers or {}
+        self._models: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def resolve_key(model_provider: Optional[str] = None, model_name: Optional[str] = None) -> Tuple[str, str]:
+        """解析缓存键
+
+        未指定提供商时使用配置中的默认模型，这样配置变更后会自然对应到新的缓存项；
+        只指定提供商时模型名称留空，由 select_model 解析该提供商的默认模型。
+        """
+        if model_provider is None:
+            return getattr(config, "model_provider", None), model_name or getattr(config, "model_name", None)
+        return model_provider, model_name
+
+    def get(self, model_provider: Optional[str] = None, model_name: Optional[str] = None) -> Any:
+        """获取模型实例，不存在时创建并缓存
+
+        Args:
+            model_provider: 模型提供商，默认使用配置
+            model_name: 模型名称，默认使用配置
+
+        Returns:
+            模型实例（与 select_model 返回值一致）
+
+        Raises:
+            ValueError: 提供商或模型不在配置的模型列表中
+        """
+        key = self.resolve_key(model_provider, model_name)
+        self.validate(*key)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+
+            factory = self.providers.get(model_provider)
+            if factory is not None:
+                model = factory(model_name=model_name)
+            else:
+                model = select_model(model_provider=model_provider, model_name=model_name)
+            self._models[key] = model
+            logger.debug(f"Model client created: {key}")
+
+            while len(self._models) > self.max_size:
+                # 只移除引用不关闭：被淘汰的实例可能仍有请求在流式读取，由最后的引用释放
+                evicted_key, _ = self._models.popitem(last=False)
+                logger.debug(f"Model client evicted: {evicted_key}")
+            return model
+
+    def validate(self, model_provider: Optional[str], model_name: Optional[str]):
+        """检查模型是否在配置的模型列表中（默认模型和额外提供商不检查）
+
+        Raises:
+            ValueError: 提供商或模型不在配置的模型列表中
+        """
+        if model_provider in self.providers:
+            return
+        if (model_provider, model_name) == (getattr(config, "model_provider", None), getattr(config, "model_name", None)):
+            return
+        model_names = getattr(config, "model_names", None) or {}
+        if not model_names:
+            return
+        if model_provider not in model_names:
+            raise ValueError(f"Unknown model provider: {model_provider}")
+        models = model_names[model_provider].get("models") or []
+        if model_name and models and model_name not in models:
+            raise ValueError(f"Unknown model {model_name} for provider {model_provider}")
+
+    def invalidate(self, model_provider: Optional[str] = None, close: bool = True) -> int:
+        """移除指定提供商（为空时移除全部）的缓存实例，例如配置变更后
+
+        Args:
+            model_provider: 模型提供商，为空时移除全部
+            close: 是否关闭被移除的实例；仍有请求在使用时传 False，由最后的引用释放
+
+        Returns:
+            int: 移除的实例数
+        """
+        with self._lock:
+            keys = [key for key in self._models if model_provider is None or key[0] == model_provider]
+            for key in keys:
+                model = self._models.pop(key)
+                if close:
+                    self._close(key, model)
+        if keys:
+            logger.info(f"Model clients invalidated: {keys}")
+        return len(keys)
+
+    @staticmethod
+    def _close(key: Tuple[str, str], model: Any):
+        close = getattr(model, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"Failed to close model client {key}: {e}")
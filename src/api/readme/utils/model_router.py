@@ -0,0 +1,284 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from packages.utils.logging_config import logger
+from rag.utils.metrics import metrics
+from rag.utils.model_registry import ModelRegistry
+from rag.utils.stream_bridge import StreamBridge
+
+Endpoint = Tuple[str, Optional[str]]
+
+
+class EndpointStats:
+    """单个模型端点的实时统计：延迟和错误率的指数滑动平均、进行中的请求数、最近延迟样本"""
+
+    def __init__(self, alpha: float = 0.2, window: int = 200):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.samples: deque = deque(maxlen=window)
+        self.failed_at = 0.0
+
+    def observe(self, latency: float, ok: bool):
+        if not ok:
+            self.failed_at = time.monotonic()
+        if ok:
+            self.latency = latency if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * latency
+            self.samples.append(latency)
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha * (0.0 if ok else 1.0)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < 10:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def score(self) -> float:
+        """越小越好：没有样本的端点优先被探测，排队越多、错误率越高得分越差"""
+        latency = self.latency or 0.0
+        return latency * (1 + self.inflight) * (1 + 4 * self.error_rate)
+
+
+class ModelRouter:
+    """模型路由层
+
+    把等价的模型端点（不同提供商部署的同一模型）配置为一组，请求按实时延迟/错误率选择端点（两选一随机采样），
+    端点排队过多或错误率过高时跳过；首选端点超过其 p95 延迟仍未返回时向另一个端点发送对冲请求，
+    先返回者胜出并取消另一方；调用失败时切换到组内其他端点。未配置分组的模型不经过路由。
+    """
+
+    def __init__(self, registry: ModelRegistry, bridge: StreamBridge, groups: Iterable[List[Endpoint]] = (),
+                 hedge_enabled: bool = True, hedge_quantile: float = 0.95, hedge_min_ms: float = 500,
+                 max_inflight: int = 64, error_threshold: float = 0.5, probe_after: float = 10.0, alpha: float = 0.2):
+        """初始化路由
+
+        Args:
+            registry: 模型注册表，端点实例从中获取
+            bridge: 同步模型调用的桥接线程池
+            groups: 等价端点分组，每个端点为 (model_provider, model_name)
+            hedge_enabled: 是否发送对冲请求
+            hedge_quantile: 对冲延迟取首选端点延迟的分位数
+            hedge_min_ms: 对冲延迟下限（毫秒），样本不足时也使用该值
+            max_inflight: 单个端点进行中的请求上限，达到时优先选择其他端点
+            error_threshold: 错误率超过该值的端点暂不选择（组内全部超过时仍会尝试）
+            probe_after: 错误率过高的端点在最近一次失败后经过该时间（秒）重新参与选择，用于探测恢复
+            alpha: 滑动平均系数
+        """
+        self.registry = registry
+        self.bridge = bridge
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min_ms / 1000
+        self.max_inflight = max_inflight
+        self.error_threshold = error_threshold
+        self.probe_after = probe_after
+        self.alpha = alpha
+        self._groups: Dict[Endpoint, List[Endpoint]] = {}
+        self._stats: Dict[Tuple[Endpoint, str], EndpointStats] = {}
+        for group in groups:
+            group = [tuple(endpoint) for endpoint in group]
+            for endpoint in group:
+                self._groups[endpoint] = group
+
+    @staticmethod
+    def parse_groups(raw: Optional[str]) -> List[List[Endpoint]]:
+        """解析 JSON 格式的分组配置，例如 [["deepseek/deepseek-chat", "siliconflow/deepseek-ai/DeepSeek-V3"]]
+
+        端点写作 "provider/model"（只按第一个斜杠拆分），只写提供商时使用该提供商的默认模型。
+        """
+        if not raw:
+            return []
+        try:
+            groups = []
+            for group in json.loads(raw):
+                endpoints = []
+                for endpoint in group:
+                    provider, _, name = endpoint.partition("/")
+                    endpoints.append((provider, name or None))
+                groups.append(endpoints)
+            return groups
+        except Exception as e:
+            logger.warning(f"MODEL_ROUTES 配置无效: {e}")
+            return []
+
+    def routes(self, model_key: Endpoint) -> Optional[List[Endpoint]]:
+        """返回模型所在的端点分组，未配置或只有一个端点时返回 None"""
+        group = self._groups.get(tuple(model_key))
+        return group if group and len(group) > 1 else None
+
+    def stats(self, endpoint: Endpoint, kind: str) -> EndpointStats:
+        key = (endpoint, kind)
+        if key not in self._stats:
+            self._stats[key] = EndpointStats(self.alpha)
+        return self._stats[key]
+
+    def snapshot(self) -> dict:
+        """各端点统计的快照"""
+        return {
+            f"{provider}/{name or ''}:{kind}": {
+                "latency_ms": round(stats.latency * 1000, 1) if stats.latency is not None else None,
+                "p95_ms": round(stats.quantile(0.95) * 1000, 1) if stats.quantile(0.95) is not None else None,
+                "error_rate": round(stats.error_rate, 3),
+                "inflight": stats.inflight,
+            }
+            for ((provider, name), kind), stats in self._stats.items()
+        }
+
+    def choose(self, endpoints: List[Endpoint], kind: str, exclude: Iterable[Endpoint] = ()) -> Optional[Endpoint]:
+        """选择端点：过滤排队过多和错误率过高的端点，随机取两个比较得分"""
+        exclude = set(exclude)
+        remaining = [endpoint for endpoint in endpoints if endpoint not in exclude]
+        if not remaining:
+            return None
+        healthy = [endpoint for endpoint in remaining if self._healthy(self.stats(endpoint, kind))]
+        candidates = healthy or remaining
+        if len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        return min(candidates, key=lambda endpoint: self.stats(endpoint, kind).score())
+
+    def _healthy(self, stats: EndpointStats) -> bool:
+        if stats.inflight >= self.max_inflight:
+            return False
+        return stats.error_rate < self.error_threshold or time.monotonic() - stats.failed_at >= self.probe_after
+
+    def hedge_delay(self, endpoint: Endpoint, kind: str) -> float:
+        return max(self.stats(endpoint, kind).quantile(self.hedge_quantile) or 0.0, self.hedge_min)
+
+    async def call(self, model_key: Endpoint, fn: Callable[[Any], Any]) -> Any:
+        """在分组内执行一次阻塞调用（例如非流式 predict）
+
+        Args:
+            model_key: 请求的模型 (model_provider, model_name)
+            fn: 以模型实例为参数的阻塞函数，在桥接线程池中执行
+
+        Returns:
+            最先成功的端点的返回值
+        """
+        async def start(endpoint: Endpoint):
+            stats = self.stats(endpoint, "call")
+            stats.inflight += 1
+            started = time.monotonic()
+            try:
+                result = await self.bridge.run(fn, self.registry.get(*endpoint))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                stats.observe(time.monotonic() - started, ok=False)
+                raise
+            finally:
+                stats.inflight -= 1
+            stats.observe(time.monotonic() - started, ok=True)
+            return result
+
+        _, result = await self._race(self.routes(model_key) or [tuple(model_key)], "call", start)
+        return result
+
+    async def stream(self, model_key: Endpoint, factory: Callable[[Any], Iterable]) -> AsyncGenerator[Any, None]:
+        """在分组内打开模型流，按首个增量到达的先后决定胜出端点
+
+        Args:
+            model_key: 请求的模型 (model_provider, model_name)
+            factory: 以模型实例为参数、返回同步增量生成器的函数（例如 model.predict(messages, stream=True)）
+
+        Yields:
+            胜出端点的所有增量；首个增量之后的错误直接抛出，不再切换端点
+        """
+        async def start(endpoint: Endpoint):
+            stats = self.stats(endpoint, "ttft")
+            started = time.monotonic()
+            try:
+                model = self.registry.get(*endpoint)
+            except Exception:
+                # 模型实例创建失败（配置错误、缺少密钥等）同样计为端点失败，进行中计数不变
+                stats.observe(time.monotonic() - started, ok=False)
+                raise
+            stats.inflight += 1
+            stream = self.bridge.iterate(lambda: factory(model))
+            try:
+                first = await stream.__anext__()
+            except BaseException as e:
+                stats.inflight -= 1
+                if not isinstance(e, asyncio.CancelledError):
+                    stats.observe(time.monotonic() - started, ok=False)
+                await stream.aclose()
+                raise
+            stats.observe(time.monotonic() - started, ok=True)
+            return stream, first
+
+        async def discard(endpoint: Endpoint, opened):
+            self.stats(endpoint, "ttft").inflight -= 1
+            await opened[0].aclose()
+
+        endpoint, (stream, first) = await self._race(self.routes(model_key) or [tuple(model_key)], "ttft",
+                                                     start, discard)
+        try:
+            yield first
+            async for item in stream:
+                yield item
+        finally:
+            self.stats(endpoint, "ttft").inflight -= 1
+            await stream.aclose()
+
+    async def _race(self, endpoints: List[Endpoint], kind: str, start: Callable[[Endpoint], Awaitable[Any]],
+                    discard: Optional[Callable[[Endpoint, Any], Awaitable[None]]] = None) -> Tuple[Endpoint, Any]:
+        """在端点间执行请求：超过对冲延迟时追加一个端点，失败时切换端点，返回最先成功的结果"""
+        primary = self.choose(endpoints, kind)
+        tasks = {asyncio.create_task(start(primary)): primary}
+        tried = [primary]
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            while tasks:
+                can_hedge = self.hedge_enabled and not hedged and len(tried) < len(endpoints)
+                timeout = self.hedge_delay(primary, kind) if can_hedge else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # 首选端点超过其延迟分位数仍未返回，向另一个端点发送对冲请求
+                    hedged = True
+                    backup = self.choose(endpoints, kind, exclude=tried)
+                    if backup is not None:
+                        metrics.inc("router_hedges_total")
+                        tasks[asyncio.create_task(start(backup))] = backup
+                        tried.append(backup)
+                    continue
+
+                winner = None
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        logger.warning(f"Model endpoint {endpoint} failed: {error}")
+                    elif winner is None:
+                        winner = (endpoint, task.result())
+                    elif discard is not None:
+                        await discard(endpoint, task.result())
+                if winner is not None:
+                    if winner[0] != primary:
+                        metrics.inc("router_hedge_wins_total" if hedged else "router_failover_wins_total")
+                    return winner
+
+                if not tasks:
+                    # 全部进行中的请求都失败，切换到尚未尝试的端点
+                    fallback = self.choose(endpoints, kind, exclude=tried)
+                    if fallback is not None:
+                        metrics.inc("router_failovers_total")
+                        tasks[asyncio.create_task(start(fallback))] = fallback
+                        tried.append(fallback)
+            raise error
+        finally:
+            # 取消落败的请求；流式请求被取消时桥接线程会关闭底层连接
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    result = await task
+                except BaseException:
+                    continue
+                if discard is not None:
+                    await discard(tasks[task], result)
@@ -0,0 +1,88 @@
+import json
+from typing import Any, Callable, Dict, Optional
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+# 可选的高性能JSON后端：优先 orjson，其次 msgspec，都不可用时使用标准库 json
+try:
+    import orjson
+
+    def _fast_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    BACKEND = "orjson"
+except ImportError:
+    try:
+        import msgspec
+
+        _fast_dumps = msgspec.json.Encoder().encode
+        BACKEND = "msgspec"
+    except ImportError:
+        _fast_dumps = _json_dumps
+        BACKEND = "json"
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为UTF-8编码的JSON，快速后端不支持的对象回退到标准库 json"""
+    try:
+        return _fast_dumps(obj)
+    except TypeError:
+        return _json_dumps(obj)
+
+
+class SSEEncoder:
+    """单个流的SSE帧编码器
+
+    每个流创建一次，meta、thread_id 等不变的外层字段只序列化一次，
+    之后每个事件只编码变化的字段，输出与 ChatService.make_chunk 等价的 SSE 帧。
+    """
+
+    def __init__(self, meta: Optional[dict] = None, thread_id: Optional[str] = None,
+                 dumps_func: Callable[[Any], bytes] = dumps):
+        """初始化编码器
+
+        Args:
+            meta: 请求元数据
+            thread_id: 会话ID
+            dumps_func: 序列化函数，默认使用可用的最快后端
+        """
+        self._dumps = dumps_func
+        self._key_cache: Dict[str, bytes] = {}
+        self.meta = meta or {}
+        self.thread_id = thread_id
+        self._envelope = b""
+        self.update()
+
+    def update(self, meta: Optional[dict] = None, thread_id: Optional[str] = None):
+        """meta 或 thread_id 发生变化时重新编码外层字段"""
+        if meta is not None:
+            self.meta = meta
+        if thread_id is not None:
+            self.thread_id = thread_id
+        self._envelope = b'"meta": ' + self._dumps(self.meta) + b', "thread_id": ' + self._dumps(self.thread_id)
+
+    def _key(self, key: str) -> bytes:
+        encoded = self._key_cache.get(key)
+        if encoded is None:
+            encoded = self._key_cache[key] = b', ' + self._dumps(key) + b': '
+        return encoded
+
+    def encode(self, content: Any = None, **kwargs) -> bytes:
+        """编码一个SSE事件
+
+        Args:
+            content: response 字段内容
+            **kwargs: 其他变化字段，例如 status、reasoning_content
+
+        Returns:
+            bytes: data: {json}\\n\\n 格式的SSE帧
+        """
+        parts = [b'data: {"response": ', self._dumps(content), b', ', self._envelope]
+        for key, value in kwargs.items():
+            parts.append(self._key(key))
+            parts.append(self._dumps(value))
+        parts.append(b'}\n\n')
+        return b"".join(parts)
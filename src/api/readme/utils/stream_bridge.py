@@ -0,0 +1,150 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncGenerator, Callable, Iterable
+
+from packages.utils.logging_config import logger
+
+# 队列中的控制标记
+_END = object()
+_ERROR = object()
+
+
+class StreamBridge:
+    """同步流式生成器到异步迭代器的桥接器
+
+    模型提供商的 predict(stream=True) 返回阻塞的同步生成器，直接在 async 函数中迭代会阻塞事件循环。
+    桥接器在独立线程中拉取增量，通过有界 asyncio.Queue 回传给事件循环，
+    并用信号量限制单个 worker 上同时进行的流数量。
+    一次性的阻塞调用（run）使用单独的线程池和并发上限，长时间占用线程的流不会让短调用排队。
+    """
+
+    def __init__(self, max_workers: int = 256, queue_size: int = 64, max_calls: int = 32):
+        """初始化桥接器
+
+        Args:
+            max_workers: 单个 worker 允许同时进行的模型流数量
+            queue_size: 每个流的缓冲队列长度，队列满时生产线程会阻塞（背压）
+            max_calls: 单个 worker 允许同时进行的阻塞调用数量（run）
+        """
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.max_calls = max_calls
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-stream")
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._call_executor = ThreadPoolExecutor(max_workers=max_calls, thread_name_prefix="model-call")
+        self._call_semaphore = asyncio.Semaphore(max_calls)
+        self.active = 0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在调用线程池中执行一次阻塞调用（例如非流式的 model.predict），不占用流的名额"""
+        loop = asyncio.get_running_loop()
+        async with self._call_semaphore:
+            return await loop.run_in_executor(self._call_executor, lambda: func(*args, **kwargs))
+
+    async def iterate(self, factory: Callable[[], Iterable]) -> AsyncGenerator[Any, None]:
+        """异步迭代同步生成器
+
+        Args:
+            factory: 无参可调用对象，在工作线程中调用并返回同步可迭代对象
+
+        Yields:
+            同步生成器产生的每个元素
+
+        当调用方取消任务或关闭本生成器（例如客户端断开）时，工作线程会在下一个增量处停止并关闭底层生成器。
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        async with self._semaphore:
+            self.active += 1
+            producer = loop.run_in_executor(self._executor, self._pump, factory, queue, loop, stop)
+            try:
+                while True:
+                    kind, payload = await queue.get()
+                    if kind is _END:
+                        break
+                    if kind is _ERROR:
+                        raise payload
+                    yield payload
+                await producer
+            finally:
+                stop.set()
+                self.active -= 1
+                # 清空队列，避免生产线程阻塞在 put 上
+                while not queue.empty():
+                    queue.get_nowait()
+
+    @staticmethod
+    def _pump(factory: Callable[[], Iterable], queue: asyncio.Queue, loop: asyncio.AbstractEventLoop, stop: threading.Event):
+        """工作线程：拉取同步生成器并写入异步队列"""
+
+        def put(item) -> bool:
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            except RuntimeError:
+                # 事件循环已关闭
+                return False
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except FutureTimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+                except Exception:
+                    return False
+
+        iterator = None
+        try:
+            iterator = factory()
+            for item in iterator:
+                if stop.is_set() or not put((None, item)):
+                    return
+            put((_END, None))
+        except Exception as e:
+            if not stop.is_set():
+                put((_ERROR, e))
+        finally:
+            if stop.is_set():
+                logger.debug("Model stream cancelled by consumer")
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.debug(f"Failed to close model stream: {e}")
+
+
+class PrimedStream:
+    """提前开始拉取首个元素的异步迭代器
+
+    包装一个异步生成器并立即调度其第一次 __anext__，使首个元素的等待（例如模型首字延迟）
+    与调用方在开始消费前的其他工作重叠。
+    """
+
+    def __init__(self, stream: AsyncGenerator[Any, None]):
+        self._stream = stream
+        self._first = asyncio.ensure_future(stream.__anext__())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._first is not None:
+            first, self._first = self._first, None
+            return await first
+        return await self._stream.__anext__()
+
+    async def aclose(self):
+        """取消尚未消费的首个元素并关闭底层生成器"""
+        if self._first is not None:
+            first, self._first = self._first, None
+            first.cancel()
+            try:
+                await first
+            except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                pass
+        await self._stream.aclose()
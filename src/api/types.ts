@@ -20,6 +20,8 @@ export interface ChatMeta {
   model_provider?: string;
   model_name?: string;
   server_model_name?: string;
+  finished_format?: 'compact' | 'full';  // finished 事件格式
+  resumable?: boolean;  // 可续传流：断线后携带 Last-Event-ID 重连
 }
 
 export interface ChatRequest {
@@ -43,14 +45,19 @@ export interface ChatStreamChunk {
   response?: string;  // 兼容旧版本
   content?: string;   // 后端实际使用的字段
   reasoning_content?: string;
-  status: 'searching' | 'generating' | 'reasoning' | 'loading' | 'finished' | 'error' | 'title_generating' | 'title_generated';
+  status: 'searching' | 'retrieved' | 'generating' | 'reasoning' | 'loading' | 'finished' | 'error' | 'title_generating' | 'title_generated';
   message?: string;
   meta?: ChatMeta;
   thread_id?: string;
   history?: ChatMessage[];
   refs?: any[];
   retrieved_docs?: RetrievedDocument[];  // 召回文档字段
+  source?: 'knowledge_base' | 'graph_base' | 'web_search';  // 分来源检索时的来源
+  source_status?: 'success' | 'timeout' | 'error';
   title?: string;  // 新增：会话标题字段
+  turn?: { user_id: string; assistant_id: string };  // 精简 finished 事件：本轮消息ID
+  history_version?: number | null;
+  refs_digest?: string | null;
 }
 
 export interface ChatCallRequest {
@@ -76,6 +83,28 @@ export interface ChatSession {
   updated_at: string;
 }
 
+export interface ChatSessionHistory {
+  thread_id: string;
+  messages: ChatMessage[];
+  total: number;
+  offset: number;
+  limit: number;
+}
+
+export interface ChatSessionRefs {
+  thread_id: string;
+  items: { turn_id: string; refs: any }[];
+  total: number;
+  offset: number;
+  limit: number;
+}
+
+export interface ChatSessionTitle {
+  thread_id: string;
+  status: 'pending' | 'generated' | 'unknown';
+  title: string | null;
+}
+
 // 知识库相关类型
 export interface KnowledgeDatabase {
   id: string;
@@ -115,6 +144,53 @@ export interface UploadFileResponse {
   message: string;
   file_path: string;
   db_id: string;
+  size?: number;
+  content_hash?: string;
+  // 同一知识库已有相同内容的文件时为 true，file_path 指向已有文件
+  duplicate?: boolean;
+  ingested?: boolean;
+  file_id?: string;
+}
+
+export interface MultipartUpload {
+  upload_id: string;
+  filename: string;
+  total_size: number;
+  part_size: number;
+  total_parts: number;
+  db_id?: string;
+  received_parts?: number[];
+  missing_parts?: number[];
+}
+
+export interface IngestJobItem {
+  idx: number;
+  item_key: string;
+  status: 'pending' | 'running' | 'done' | 'skipped' | 'failed' | 'cancelled';
+  error?: string | null;
+  result?: any;
+  started_at?: number | null;
+  finished_at?: number | null;
+}
+
+export interface IngestJob {
+  job_id: string;
+  db_id: string;
+  kind: 'files' | 'chunks';
+  status: 'queued' | 'running' | 'completed' | 'cancelled';
+  total: number;
+  counts: Record<IngestJobItem['status'], number>;
+  progress: number;
+  elapsed?: number | null;
+  throughput?: number | null;
+  items?: IngestJobItem[];
+}
+
+export interface IngestJobResponse {
+  message: string;
+  status: string;
+  job_id: string;
+  job: IngestJob;
 }
 
 export interface ChunkParams {
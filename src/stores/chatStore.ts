@@ -16,6 +16,8 @@ export type Message = {
   loading?: boolean;
   reasoning_content?: string;
   refs?: any[];
+  refs_digest?: string | null;  // 精简 finished 事件的引用摘要，引用通过 ChatAPI.getSessionRefs 按需获取
+  turn_id?: string;  // 服务端助手消息ID
   retrieved_docs?: RetrievedDocument[];  // 新增召回文档字段
 };
 
@@ -37,6 +39,7 @@ export type ChatMeta = {
   system_prompt?: string;
   model_provider?: string;
   model_name?: string;
+  resumable?: boolean;  // 可续传流（默认关闭）：开启后服务端在断线后保留生成一段时间等待重连
 };
 
 export type ChatState = {
@@ -80,7 +83,8 @@ const useStore = create<ChatState>()(
         history_round: 5,
         system_prompt: '',
         model_provider: '',
-        model_name: ''
+        model_name: '',
+        resumable: false
       },
       currentModel: '',
       availableModels: {},
@@ -313,7 +317,7 @@ const useStore = create<ChatState>()(
 
         try {
           // 构建meta参数，从空对象开始
-          const cleanMeta: any = {};
+          const cleanMeta: any = { finished_format: 'compact' };
 
           if (meta.use_graph) {
             cleanMeta.use_graph = true;
@@ -330,6 +334,9 @@ const useStore = create<ChatState>()(
           if (meta.model_name) {
             cleanMeta.model_name = meta.model_name;
           }
+          if (meta.resumable) {
+            cleanMeta.resumable = true;
+          }
           if (meta.history_round && meta.history_round !== 5) {
             cleanMeta.history_round = meta.history_round;
           }
@@ -367,6 +374,28 @@ const useStore = create<ChatState>()(
           let finalContent = '';
           let finalRefs: any[] = [];
 
+          // 更新会话标题
+          const applyTitle = (title: string) => {
+            console.log('会话标题生成完成:', title);
+
+            // 使用当前的actualConversationId（可能已经被更新为serverThreadId）
+            const currentConversation = get().conversationHistory[actualConversationId];
+            if (currentConversation) {
+              set({
+                conversationHistory: {
+                  ...get().conversationHistory,
+                  [actualConversationId]: {
+                    ...currentConversation,
+                    title
+                  }
+                },
+                titleGenerating: false
+              });
+            } else {
+              console.warn('无法找到会话记录，actualConversationId:', actualConversationId);
+            }
+          };
+
           await ChatAPI.streamChat(
             requestBody,
             (data: ChatStreamChunk) => {
@@ -399,6 +428,15 @@ const useStore = create<ChatState>()(
                   loading: true,
                   streaming: true
                 }));
+              } else if (data.status === 'retrieved') {
+                // 分来源检索：每个来源完成后追加其召回文档
+                const sourceDocs = data.retrieved_docs || [];
+                if (sourceDocs.length > 0) {
+                  updateMessage(actualConversationId, botMsg.id, (msg) => ({
+                    ...msg,
+                    retrieved_docs: [...(msg.retrieved_docs || []), ...sourceDocs]
+                  }));
+                }
               } else if (data.status === 'generating') {
                 updateMessage(actualConversationId, botMsg.id, (msg) => ({
                   ...msg,
@@ -436,26 +474,27 @@ const useStore = create<ChatState>()(
               } else if (data.status === 'title_generated') {
                 // 标题生成完成，更新会话标题
                 if (data.title) {
-                  console.log('会话标题生成完成:', data.title);
-
-                  // 使用当前的actualConversationId（可能已经被更新为serverThreadId）
-                  const currentConversation = get().conversationHistory[actualConversationId];
-                  if (currentConversation) {
-                    set({
-                      conversationHistory: {
-                        ...get().conversationHistory,
-                        [actualConversationId]: {
-                          ...currentConversation,
-                          title: data.title
-                        }
-                      },
-                      titleGenerating: false
-                    });
-                  } else {
-                    console.warn('无法找到会话记录，actualConversationId:', actualConversationId);
-                  }
+                  applyTitle(data.title);
                 }
               } else if (data.status === 'finished') {
+                // 精简格式不再返回完整历史，在本地追加本轮消息
+                if (!data.history && data.turn) {
+                  const currentConversation = get().conversationHistory[actualConversationId];
+                  set({
+                    conversationHistory: {
+                      ...get().conversationHistory,
+                      [actualConversationId]: {
+                        ...currentConversation,
+                        history: [
+                          ...(requestBody.history || []),
+                          { role: 'user', content: input },
+                          { role: 'assistant', content: finalContent }
+                        ]
+                      }
+                    }
+                  });
+                }
+
                 // 保存对话历史
                 if (data.history) {
                   set({
@@ -478,6 +517,8 @@ const useStore = create<ChatState>()(
                   ...msg,
                   content: finalContent || msg.content,
                   refs: finalRefs,
+                  refs_digest: data.refs_digest,
+                  turn_id: data.turn?.assistant_id,
                   streaming: false,
                   loading: false
                 }));
@@ -504,6 +545,27 @@ const useStore = create<ChatState>()(
             }
           );
 
+          // 标题由后端后台生成，流结束后轮询标题接口
+          if (isNewSession && get().titleGenerating) {
+            for (let attempt = 0; attempt < 10 && get().titleGenerating; attempt++) {
+              await new Promise(resolve => setTimeout(resolve, 1000));
+              try {
+                const result = await ChatAPI.getSessionTitle(actualConversationId);
+                if (result.status === 'generated' && result.title) {
+                  applyTitle(result.title);
+                  break;
+                }
+                if (result.status === 'unknown') {
+                  break;
+                }
+              } catch (error) {
+                console.warn('获取会话标题失败:', error);
+                break;
+              }
+            }
+            set({ titleGenerating: false });
+          }
+
         } catch (error) {
           console.error('聊天请求失败:', error);
           updateMessage(actualConversationId, botMsg.id, (msg) => ({
@@ -244,18 +244,32 @@ export const useKnowledgeStore = create<KnowledgeState>()(
                     //console.log('文件分块成功:', chunkResult);
 
                     // 步骤3: 调用 /data/add-by-chunks 将分块添加到数据库
-                    await KnowledgeAPI.addByChunks({
+                    // 入库在后台任务中进行，等待任务结束
+                    const { job_id } = await KnowledgeAPI.addByChunks({
                         db_id: databaseId,
                         file_chunks: chunkResult
                     });
-                    //console.log('添加分块成功');
+                    const job = await KnowledgeAPI.waitForIngestJob(job_id);
+                    const unfinished = (job.items || []).filter(item => item.status === 'failed' || item.status === 'cancelled');
 
-                    // 清除已处理的待处理文件
+                    // 清除已处理的待处理文件，失败或取消的文件保留在待处理列表中以便重试
                     get().clearPendingFiles(databaseId);
+                    unfinished.forEach(item => {
+                        const filePath = chunkResult[item.item_key]?.path;
+                        if (filePath) {
+                            get().addPendingFile(databaseId, filePath);
+                        }
+                    });
 
                     // 刷新文件列表
                     await get().fetchDatabaseFiles(databaseId);
 
+                    if (job.counts.failed > 0) {
+                        const errors = unfinished.filter(item => item.status === 'failed').map(item => item.error);
+                        console.error('部分文件入库失败:', errors);
+                        throw new Error(`${job.counts.failed} 个文件入库失败: ${errors.join('; ')}`);
+                    }
+
                     console.log('三步上传流程完成!');
                 } catch (error) {
                     console.error('三步上传流程失败:', error);
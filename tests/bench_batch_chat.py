@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+批量调用吞吐基准（本地假模型）
+对比逐条调用（与循环请求 /chat/call 相同）与 BatchRunner 并发 + 重试的吞吐
+需要在后端环境中运行（rag、packages 可导入）
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.api.readme.utils.batch_runner import BatchRunner
+from src.api.readme.utils.fake_model import FakeModel
+from src.api.readme.utils.stream_bridge import StreamBridge
+
+
+def make_queries(count):
+    return [f"指标 198.51.100.{i % 255} 关联的恶意活动是什么？" for i in range(count)]
+
+
+async def run_serial(model, bridge, queries):
+    """逐条调用：每条等待上一条完成"""
+    failed = 0
+    for query in queries:
+        try:
+            await bridge.run(model.predict, query)
+        except Exception:
+            failed += 1
+    return failed
+
+
+async def run_batch(model, bridge, queries, concurrency, ordered):
+    """BatchRunner：固定并发，失败按指数退避重试"""
+    async def call(query):
+        response = await bridge.run(model.predict, query)
+        return {"response": response.content}
+
+    runner = BatchRunner(call, concurrency=concurrency, max_retries=2, backoff_base=0.05)
+    failed = 0
+    async for result in runner.run(queries, ordered=ordered):
+        failed += "error" in result
+    return failed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="批量调用吞吐基准")
+    parser.add_argument("--count", type=int, default=200, help="查询条数")
+    parser.add_argument("--latency-ms", type=float, default=100, help="假模型首字延迟（毫秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="假模型注入的失败概率")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="批量并发数")
+    args = parser.parse_args()
+
+    model = FakeModel(latency_ms=args.latency_ms, tokens_per_second=0, failure_rate=args.failure_rate, seed=7)
+    bridge = StreamBridge(max_workers=64)
+    queries = make_queries(args.count)
+
+    print(f"查询条数: {args.count}  假模型延迟: {args.latency_ms}ms  失败率: {args.failure_rate:.0%}")
+    serial_count = min(args.count, 50)
+    started = time.perf_counter()
+    failed = await run_serial(model, bridge, queries[:serial_count])
+    elapsed = time.perf_counter() - started
+    serial_qps = serial_count / elapsed
+    print(f"逐条调用       {serial_count:5d} 条  {elapsed:7.2f}s  {serial_qps:8.1f} 条/秒  失败 {failed}")
+
+    for concurrency in args.concurrency:
+        for ordered in (False, True):
+            started = time.perf_counter()
+            failed = await run_batch(model, bridge, queries, concurrency, ordered)
+            elapsed = time.perf_counter() - started
+            qps = args.count / elapsed
+            label = f"批量 c={concurrency}{' 有序' if ordered else ''}"
+            print(f"{label:14s} {args.count:5d} 条  {elapsed:7.2f}s  {qps:8.1f} 条/秒  失败 {failed}  "
+                  f"加速 {qps / serial_qps:5.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
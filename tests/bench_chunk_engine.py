@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+文档分块吞吐基准（本地合成文档）
+用CPU密集型的假解析函数（通过 chunk_one 以 "模块:函数" 方式调用，与 CHUNK_PARSER 相同）模拟PDF/DOCX解析和切分，对比：
+  1. 逐个文件在单线程中分块（与原 file_to_chunk 相同）
+  2. 线程池并行（受GIL限制）
+  3. ChunkEngine 进程池并行
+  4. 相同文件和参数再次分块（命中缓存）
+需要在后端环境中运行（rag、packages 可导入）
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.api.readme.utils.chunk_engine import ChunkEngine, chunk_one
+
+# 工作进程按 "模块:函数" 导入解析函数（spawn 启动的子进程继承 sys.path，tests 目录可导入）
+PARSER = "bench_chunk_engine:fake_parse_and_split"
+
+
+def fake_parse_and_split(file, params):
+    """模拟解析：逐行规整文本若干轮（纯Python，持有GIL），再按 chunk_size/chunk_overlap 切分"""
+    with open(file, "r", encoding="utf-8") as f:
+        text = f.read()
+    for _ in range(params.get("parse_rounds", 3)):
+        text = "\n".join(re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    size, overlap = params.get("chunk_size", 1000), params.get("chunk_overlap", 200)
+    return [{"text": text[start:start + size]} for start in range(0, len(text), max(size - overlap, 1))]
+
+
+def make_documents(directory, count, size_kb):
+    files = []
+    line = "Indicator 198.51.100.7 observed   beaconing to   c2.example.net   over TLS;  "
+    for i in range(count):
+        path = os.path.join(directory, f"report_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            repeats = size_kb * 1024 // len(line)
+            f.write("\n".join(f"{i}-{n} {line}" for n in range(repeats)))
+        files.append(path)
+    return files
+
+
+async def run(engine, files, params):
+    started = time.perf_counter()
+    chunks = cached = 0
+    async for item in engine.run(files, params):
+        if "error" in item:
+            raise RuntimeError(item["error"])
+        cached += item["cached"]
+        chunks += sum(len(info["nodes"]) for info in item["chunks"].values())
+    return time.perf_counter() - started, chunks, cached
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="文档分块吞吐基准")
+    parser.add_argument("--files", type=int, default=32, help="文件数")
+    parser.add_argument("--size-kb", type=int, default=512, help="每个文件大小（KB）")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="进程/线程数")
+    args = parser.parse_args()
+
+    params = {"chunk_size": 1000, "chunk_overlap": 200}
+    with tempfile.TemporaryDirectory() as directory:
+        files = make_documents(directory, args.files, args.size_kb)
+        cache_dir = os.path.join(directory, "cache")
+        chunk_fn = functools.partial(chunk_one, parser=PARSER)
+        scenarios = [
+            ("逐个(单线程)", ChunkEngine(chunk_fn, workers=0, fallback_executor=ThreadPoolExecutor(1))),
+            (f"线程池 x{args.workers}",
+             ChunkEngine(chunk_fn, workers=0, fallback_executor=ThreadPoolExecutor(args.workers))),
+            (f"进程池 x{args.workers}", ChunkEngine(chunk_fn, workers=args.workers, cache_dir=cache_dir)),
+        ]
+
+        print(f"文件数: {args.files}  单文件: {args.size_kb}KB  CPU: {os.cpu_count()}")
+        baseline = None
+        for label, engine in scenarios:
+            elapsed, chunks, cached = await run(engine, files, params)
+            baseline = baseline or elapsed
+            print(f"{label:14s} {elapsed:7.2f}s  {args.files / elapsed:7.1f} 文件/秒  分块 {chunks}  "
+                  f"加速 {baseline / elapsed:5.1f}x")
+
+        engine = scenarios[-1][1]
+        elapsed, chunks, cached = await run(engine, files, params)
+        print(f"{'缓存命中':14s} {elapsed:7.2f}s  {args.files / elapsed:7.1f} 文件/秒  分块 {chunks}  "
+              f"加速 {baseline / elapsed:5.1f}x  命中 {cached}/{args.files}")
+        engine.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
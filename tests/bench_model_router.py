@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+模型路由尾延迟基准（本地桩HTTP服务）
+启动三个注入延迟的本地HTTP服务模拟等价的模型端点，对比：
+  1. 固定使用一个端点（现有 select_model 行为）
+  2. ModelRouter 按延迟/错误率滑动平均分流
+  3. ModelRouter 分流 + 超过 p95 延迟时对冲
+分别统计非流式调用耗时和流式首字延迟的 p50/p95/p99
+需要在后端环境中运行（rag、packages 可导入）
+"""
+
+import argparse
+import asyncio
+import random
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.api.readme.utils.fake_model import FakeResponse
+from src.api.readme.utils.metrics import metrics
+from src.api.readme.utils.model_registry import ModelRegistry
+from src.api.readme.utils.model_router import ModelRouter
+from src.api.readme.utils.stream_bridge import StreamBridge
+
+# 端点延迟画像：(基础延迟秒, 慢请求概率, 慢请求延迟秒)
+PROFILES = {
+    "stub_a": (0.05, 0.10, 0.8),
+    "stub_b": (0.06, 0.05, 0.6),
+    "stub_c": (0.08, 0.02, 0.5),
+}
+
+
+def make_handler(profile, seed):
+    base, slow_rate, slow_latency = profile
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                latency = slow_latency if rng.random() < slow_rate else base
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            stream = self.path == "/stream"
+            try:
+                for i in range(8):
+                    body = f"token{i} \n".encode("utf-8")
+                    self.wfile.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+                    if stream:
+                        self.wfile.flush()
+                        time.sleep(0.005)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # 对冲落败的流被客户端关闭
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class StubHTTPModel:
+    """通过HTTP调用桩服务的模型，阻塞调用方式与真实提供商客户端一致"""
+
+    def __init__(self, url, model_name=None):
+        self.url = url
+        self.model_name = model_name or url
+
+    def predict(self, message, stream=False):
+        if stream:
+            return self._stream(message)
+        request = urllib.request.Request(f"{self.url}/predict", data=str(message).encode("utf-8"), method="POST")
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return FakeResponse(response.read().decode("utf-8"), is_full=True)
+
+    def _stream(self, message):
+        request = urllib.request.Request(f"{self.url}/stream", data=str(message).encode("utf-8"), method="POST")
+        with urllib.request.urlopen(request, timeout=10) as response:
+            for line in response:
+                yield FakeResponse(line.decode("utf-8"))
+
+
+def start_servers():
+    urls = {}
+    for index, (name, profile) in enumerate(PROFILES.items()):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(profile, seed=index))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls[name] = f"http://127.0.0.1:{server.server_address[1]}"
+    return urls
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000
+    return f"p50 {pick(0.5):6.0f}ms  p95 {pick(0.95):6.0f}ms  p99 {pick(0.99):6.0f}ms  avg {statistics.mean(ordered) * 1000:6.0f}ms"
+
+
+async def measure(requests, concurrency, call):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(i)
+            samples.append(time.perf_counter() - started)
+
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="模型路由尾延迟基准")
+    parser.add_argument("--requests", type=int, default=300, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发数")
+    args = parser.parse_args()
+
+    urls = start_servers()
+    registry = ModelRegistry(providers={
+        name: (lambda url: lambda model_name=None: StubHTTPModel(url, model_name))(url) for name, url in urls.items()
+    })
+    bridge = StreamBridge(max_workers=128)
+    group = [[(name, None) for name in urls]]
+    primary = ("stub_a", None)
+
+    async def direct_call(_):
+        await bridge.run(registry.get(*primary).predict, "q")
+
+    async def direct_stream(_):
+        stream = bridge.iterate(lambda: registry.get(*primary).predict("q", stream=True))
+        await stream.__anext__()
+        await stream.aclose()
+
+    scenarios = [("固定端点", None)]
+    for hedge in (False, True):
+        router = ModelRouter(registry, bridge, group, hedge_enabled=hedge, hedge_min_ms=50)
+        scenarios.append(("路由+对冲" if hedge else "路由(EWMA)", router))
+
+    print(f"请求数: {args.requests}  并发: {args.concurrency}  端点: {', '.join(PROFILES)}")
+    for label, router in scenarios:
+        before = metrics.snapshot()["counters"].get("router_hedges_total", 0)
+        if router is None:
+            call, stream = direct_call, direct_stream
+        else:
+            async def call(_, router=router):
+                await router.call(primary, lambda model: model.predict("q"))
+
+            async def stream(_, router=router):
+                routed = router.stream(primary, lambda model: model.predict("q", stream=True))
+                await routed.__anext__()
+                await routed.aclose()
+
+        call_samples = await measure(args.requests, args.concurrency, call)
+        ttft_samples = await measure(args.requests, args.concurrency, stream)
+        hedges = metrics.snapshot()["counters"].get("router_hedges_total", 0) - before
+        print(f"{label:10s} 调用  {percentiles(call_samples)}")
+        print(f"{label:10s} 首字  {percentiles(ttft_samples)}  对冲 {hedges}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+会话历史读写基准（fakeredis）
+对比现有路径（每轮读取完整历史 + 用户/助手两次独立写入）与 RedisHistoryStore（LRANGE 最近N轮 + 一次 MULTI 管道写入）
+需要安装 fakeredis: pip install fakeredis
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis
+
+from src.api.readme.cache.redis_history import RedisHistoryStore
+
+
+class CountingRedis(fakeredis.FakeAsyncRedis):
+    """统计网络往返次数（一次管道提交计为一次）"""
+    round_trips = 0
+
+    async def execute_command(self, *args, **options):
+        CountingRedis.round_trips += 1
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        CountingRedis.round_trips += 1
+        return fakeredis.FakeAsyncRedis.pipeline(self, transaction, shard_hint)
+
+
+async def legacy_turn(client, thread_id: str, query: str, answer: str):
+    """模拟现有路径：整段历史存为一个JSON，读取完整历史，再分两次读改写追加"""
+    key = f"session:{thread_id}"
+    raw = await client.get(key)
+    history = json.loads(raw) if raw else []
+    for role, content in (("user", query), ("assistant", answer)):
+        raw = await client.get(key)
+        history = json.loads(raw) if raw else []
+        history.append({"role": role, "content": content})
+        await client.set(key, json.dumps(history, ensure_ascii=False), ex=3600)
+    return history
+
+
+async def store_turn(store: RedisHistoryStore, thread_id: str, query: str, answer: str, rounds: int):
+    history = await store.get_recent(thread_id, rounds)
+    await store.append(thread_id, [
+        {"role": "user", "content": query},
+        {"role": "assistant", "content": answer},
+    ])
+    return history
+
+
+async def main():
+    turns = 200
+    rounds = 5
+    query = "APT28 在最近的行动中使用了哪些初始访问手段？" * 2
+    answer = "根据检索到的情报，APT28 主要通过鱼叉式钓鱼邮件和公开服务漏洞获取初始访问。" * 10
+
+    client = CountingRedis(decode_responses=True)
+    CountingRedis.round_trips = 0
+    started = time.perf_counter()
+    for _ in range(turns):
+        await legacy_turn(client, "legacy", query, answer)
+    legacy_time = time.perf_counter() - started
+    legacy_trips = CountingRedis.round_trips
+
+    store = RedisHistoryStore(client=client, max_messages=200)
+    CountingRedis.round_trips = 0
+    started = time.perf_counter()
+    for _ in range(turns):
+        await store_turn(store, "store", query, answer, rounds)
+    store_time = time.perf_counter() - started
+    store_trips = CountingRedis.round_trips
+
+    print(f"对话轮数: {turns}，每轮读取最近 {rounds} 轮")
+    print(f"现有路径: {legacy_time / turns * 1000:.3f} ms/轮，{legacy_trips / turns:.1f} 次往返/轮")
+    print(f"RedisHistoryStore: {store_time / turns * 1000:.3f} ms/轮，{store_trips / turns:.1f} 次往返/轮")
+    print(f"加速比: {legacy_time / store_time:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+SSE帧编码微基准
+对比 ChatService.make_chunk（每个事件完整 json.dumps）与 SSEEncoder（外层字段只序列化一次）的编码耗时
+"""
+
+import json
+import os
+import sys
+import timeit
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.api.readme.utils.sse_encoder import SSEEncoder, BACKEND
+
+
+def make_chunk(content=None, meta=None, thread_id=None, **kwargs):
+    """与 ChatService.make_chunk 相同的实现，作为基准"""
+    data = json.dumps({
+        "response": content,
+        "meta": meta or {},
+        "thread_id": thread_id,
+        **kwargs
+    }, ensure_ascii=False)
+    return f"data: {data}\n\n".encode('utf-8')
+
+
+def main():
+    meta = {
+        "use_web": False,
+        "use_graph": True,
+        "db_id": "kb_6f1c2a9e0b7d4f3a",
+        "history_round": 5,
+        "system_prompt": "你是一名威胁情报分析助手，请基于检索到的情报回答问题。",
+        "server_model_name": "deepseek-reasoner",
+    }
+    thread_id = "5b0e7c1e-3f2a-4d8b-9a61-2c4e8f0d7b13"
+    deltas = ["APT28", " 常用", "鱼叉式", "钓鱼", "邮件", "进行", "初始", "访问", "。"] * 100
+    number = 20
+
+    def run_make_chunk():
+        for delta in deltas:
+            make_chunk(content=delta, status="loading", meta=meta, thread_id=thread_id)
+
+    def run_encoder():
+        encoder = SSEEncoder(meta, thread_id)
+        for delta in deltas:
+            encoder.encode(content=delta, status="loading")
+
+    # 校验两种编码结果等价
+    encoder = SSEEncoder(meta, thread_id)
+    for delta in deltas[:10]:
+        legacy = json.loads(make_chunk(content=delta, status="loading", meta=meta, thread_id=thread_id)[6:])
+        fast = json.loads(encoder.encode(content=delta, status="loading")[6:])
+        assert legacy == fast, (legacy, fast)
+
+    events = len(deltas) * number
+    legacy_time = min(timeit.repeat(run_make_chunk, number=number, repeat=5))
+    encoder_time = min(timeit.repeat(run_encoder, number=number, repeat=5))
+
+    print(f"JSON后端: {BACKEND}")
+    print(f"make_chunk: {legacy_time / events * 1e6:.2f} us/事件")
+    print(f"SSEEncoder: {encoder_time / events * 1e6:.2f} us/事件")
+    print(f"加速比: {legacy_time / encoder_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+后端单元测试的公共配置
+
+后端代码部署时以 rag 包的名义导入（rag.utils.*、rag.cache.*），这里把 rag 指向仓库中的 src/api/readme，
+不依赖外部 packages 的模块（缓存、准入、熔断等）可以直接在仓库中运行；依赖 packages 的测试用
+pytest.importorskip("packages") 标记，只在完整的后端环境中运行。
+"""
+
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, "src", "api", "readme")
+
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+if "rag" not in sys.modules:
+    try:
+        import rag  # noqa: F401  完整后端环境中使用已安装的 rag
+    except ImportError:
+        rag = types.ModuleType("rag")
+        rag.__path__ = [BACKEND]
+        sys.modules["rag"] = rag
+
+# 脚本式的接口测试需要运行中的服务，不作为单元测试收集
+collect_ignore = ["test_stream_api.py"]
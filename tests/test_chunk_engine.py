@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+分块引擎测试：内置文本切分、非文本文件交给知识库分块、缓存目录大小上限
+"""
+
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("packages")
+
+from rag.utils.chunk_engine import ChunkEngine, is_text_file, split_text  # noqa: E402
+
+REPORT = "APT29 使用鱼叉式钓鱼获取初始访问。随后通过 WMI 横向移动。\n\n" * 40
+
+
+def test_split_text_respects_size_and_boundaries(tmp_path):
+    path = tmp_path / "report.md"
+    path.write_text(REPORT, encoding="utf-8")
+    nodes = split_text(str(path), {"chunk_size": 200, "chunk_overlap": 20})
+    assert len(nodes) > 1
+    assert all(len(node["text"]) <= 200 for node in nodes)
+    # 在句子或段落边界处断开
+    assert all(node["text"].endswith("。") for node in nodes[:-1])
+    assert nodes[1]["start_char_idx"] < nodes[0]["end_char_idx"]
+    assert is_text_file(str(path)) and not is_text_file("report.pdf")
+
+
+def fake_chunk(file, params):
+    return {"file_x": {"file_id": "file_x", "path": file, "nodes": [{"text": "x" * 2000}]}}
+
+
+def test_unaccepted_files_use_fallback(tmp_path):
+    calls = []
+
+    def fallback(file, params):
+        calls.append(file)
+        return fake_chunk(file, params)
+
+    async def run():
+        engine = ChunkEngine(chunk_fn=fake_chunk, accepts=is_text_file, fallback_fn=fallback)
+        return [item async for item in engine.run([str(tmp_path / "a.txt"), str(tmp_path / "b.pdf")], {})]
+
+    items = asyncio.run(run())
+    assert len(items) == 2 and calls == [str(tmp_path / "b.pdf")]
+
+
+def test_cache_is_capped(tmp_path):
+    files = []
+    for i in range(10):
+        path = tmp_path / f"report_{i}.txt"
+        path.write_text(f"report {i}", encoding="utf-8")
+        files.append(str(path))
+    cache_dir = tmp_path / "cache"
+
+    async def run():
+        engine = ChunkEngine(chunk_fn=fake_chunk, cache_dir=str(cache_dir), cache_max_bytes=10 * 1024)
+        async for _ in engine.run(files, {}):
+            pass
+        return engine
+
+    engine = asyncio.run(run())
+    total = sum(os.path.getsize(os.path.join(d, name)) for d, _, names in os.walk(cache_dir) for name in names)
+    assert total <= 10 * 1024 and total == engine._cache_bytes
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+熔断器测试：半开状态的探测名额在调用被取消后归还，不会永久熔断
+"""
+
+import time
+
+from rag.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def open_breaker(reset_timeout=0.05) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=reset_timeout)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    time.sleep(reset_timeout)
+    return breaker
+
+
+def test_probe_outcome_closes_or_reopens():
+    breaker = open_breaker()
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker = open_breaker()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_cancelled_probe_is_released():
+    breaker = open_breaker()
+    assert breaker.allow()
+    # 探测调用被取消，没有报告结果
+    breaker.release()
+    assert breaker.allow() and breaker.state == HALF_OPEN
+
+
+def test_unreported_probe_expires_after_reset_timeout():
+    breaker = open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(breaker.reset_timeout)
+    assert breaker.allow()
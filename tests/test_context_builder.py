@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+上下文构建测试：片段按相关度装入预算、历史按整轮裁剪、长文本不进入计数缓存
+"""
+
+import pytest
+
+pytest.importorskip("packages")
+
+from rag.utils import context_builder  # noqa: E402
+from rag.utils.context_builder import ContextBuilder, count_tokens  # noqa: E402
+
+
+def chunk(text: str, **score) -> dict:
+    return {"entity": {"text": text}, **score}
+
+
+def test_pack_results_prefers_smaller_distance():
+    builder = ContextBuilder()
+    near, far = chunk("a" * 40, distance=0.1), chunk("b" * 40, distance=0.9)
+    packed = builder.pack_results({"results": [far, near]}, budget=count_tokens("a" * 40))
+    assert packed["results"] == [near]
+
+    low, high = chunk("a" * 40, rerank_score=0.2), chunk("b" * 40, rerank_score=0.8)
+    packed = builder.pack_results({"results": [low, high]}, budget=count_tokens("a" * 40))
+    assert packed["results"] == [high]
+
+
+def test_fit_messages_keeps_system_and_current():
+    builder = ContextBuilder()
+    system = {"role": "system", "content": "你是威胁情报分析师"}
+    old = [{"role": "user", "content": "x" * 400}, {"role": "assistant", "content": "y" * 400}]
+    recent = [{"role": "user", "content": "APT29?"}, {"role": "assistant", "content": "鱼叉式钓鱼。", "tokens": 10}]
+    current = {"role": "user", "content": "检测建议？"}
+    fitted = builder.fit_messages([system, *old, *recent, current], budget=100)
+    assert fitted == [system, recent[0], {"role": "assistant", "content": "鱼叉式钓鱼。"}, current]
+
+
+def test_long_texts_bypass_token_cache():
+    context_builder._count_tokens_cached.cache_clear()
+    count_tokens("短文本")
+    count_tokens("长" * (context_builder.CACHE_MAX_CHARS + 1))
+    assert context_builder._count_tokens_cached.cache_info().currsize == 1
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+向量缓存测试：多个进程共用缓存目录，其他进程切换代号并删除旧数据后读取不出错
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("packages")
+np = pytest.importorskip("numpy")
+
+from rag.utils.embedding_pipeline import EmbeddingCache  # noqa: E402
+
+
+def keys(*names):
+    return [name.encode("utf-8").ljust(32, b"\0") for name in names]
+
+
+def test_reader_survives_rotation_by_other_process(tmp_path):
+    directory = str(tmp_path / "cache")
+    reader, writer = EmbeddingCache(directory, initial_capacity=4), EmbeddingCache(directory, initial_capacity=4)
+    writer.put_many(keys("a", "b"), np.ones((2, 3)))
+    assert set(reader.get_many(keys("a", "b"))) == set(keys("a", "b"))
+
+    # 另一个进程清空缓存：切换到新的一代并删除旧数据
+    writer.clear()
+    assert reader.get_many(keys("a", "b")) == {}
+    assert not os.path.exists(os.path.join(directory, "0"))
+
+    writer.put_many(keys("c"), np.full((1, 3), 2.0))
+    assert np.array_equal(reader.get_many(keys("c"))[keys("c")[0]], np.full(3, 2.0, dtype=np.float32))
+
+
+def test_missing_generation_files_read_as_empty(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = EmbeddingCache(directory, initial_capacity=4)
+    cache.put_many(keys("a"), np.ones((1, 3)))
+    # 读取途中数据文件被删除（其他进程切换代号后的清理）
+    os.remove(os.path.join(directory, "0", "vectors.f32"))
+    fresh = EmbeddingCache(directory, initial_capacity=4)
+    assert fresh.get_many(keys("a")) == {} and len(fresh) == 0
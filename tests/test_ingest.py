@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+入库去重测试
+  按内容哈希索引文件和分块，相同内容同一时间只由一个调用入库，其他调用等待其结果
+"""
+
+import asyncio
+
+from rag.cache.content_index import INGESTED, UPLOADED, ContentIndex, InflightIngests
+
+
+def make_index(tmp_path) -> ContentIndex:
+    return ContentIndex(str(tmp_path / "content_index.db"))
+
+
+def test_upload_is_indexed_per_database(tmp_path):
+    index = make_index(tmp_path)
+    index.record_upload("kb1", "h1", "/data/kb1/report.txt", "report.txt", 100)
+    assert index.lookup("kb1", "h1")["status"] == UPLOADED
+    assert index.lookup("kb2", "h1") is None
+    assert index.lookup_path("/data/kb1/report.txt")["content_hash"] == "h1"
+
+    # 相同内容再次上传只更新保存路径，不改变入库状态
+    index.mark_ingested("kb1", "h1", "file_0", ["c1", "c2"])
+    index.record_upload("kb1", "h1", "/data/kb1/report-copy.txt", "report-copy.txt", 100)
+    entry = index.lookup("kb1", "h1")
+    assert entry["status"] == INGESTED and entry["file_path"] == "/data/kb1/report-copy.txt"
+
+
+def test_revision_and_chunk_hashes(tmp_path):
+    index = make_index(tmp_path)
+    index.record_upload("kb1", "h1", "/data/v1/report.txt", "report.txt", 100)
+    index.mark_ingested("kb1", "h1", "file_0", ["c1", "c2"])
+    index.record_upload("kb1", "h2", "/data/v2/report.txt", "report.txt", 120)
+
+    assert index.latest_revision("kb1", "report.txt", "h2")["file_id"] == "file_0"
+    assert index.latest_revision("kb1", "report.txt", "h1") is None
+    assert index.chunk_hashes("kb1", "file_0") == {"c1", "c2"}
+
+    index.remove_file("kb1", "file_0")
+    assert index.lookup("kb1", "h1") is None and index.chunk_hashes("kb1", "file_0") == set()
+
+
+def test_inflight_claim_is_exclusive_per_database():
+    inflight = InflightIngests()
+    assert inflight.claim("kb1", "h1") is None
+    assert inflight.claim("kb1", "h1") is not None
+    assert inflight.claim("kb2", "h1") is None
+
+    inflight.release("kb1", "h1")
+    assert inflight.claim("kb1", "h1") is None
+
+
+def test_waiter_resumes_after_release():
+    async def run():
+        inflight = InflightIngests()
+        assert inflight.claim("kb1", "h1") is None
+        # claim 在线程中调用，与入库计划的调用方式一致
+        event = await asyncio.to_thread(inflight.claim, "kb1", "h1")
+        assert event is not None
+
+        waiter = asyncio.ensure_future(event.wait())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        inflight.release("kb1", "h1")
+        await asyncio.wait_for(waiter, timeout=1)
+
+    asyncio.run(run())
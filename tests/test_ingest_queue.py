@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+入库任务队列测试：失败的文件记入任务结果，服务中断后在启动时恢复未完成的任务
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("packages")
+
+from rag.cache.ingest_jobs import IngestJobStore  # noqa: E402
+from rag.utils.ingest_queue import IngestQueue  # noqa: E402
+
+
+def test_failed_items_are_reported(tmp_path):
+    async def handler(kind, db_id, key, payload):
+        if key == "bad.txt":
+            raise RuntimeError("embedding service unavailable")
+        return {"added": [key], "skipped": []} if key != "dup.txt" else {"added": [], "skipped": [key]}
+
+    async def run():
+        queue = IngestQueue(IngestJobStore(str(tmp_path / "ingest_jobs.db")), handler)
+        job_id = await queue.submit("kb1", "files", [("a.txt", None), ("bad.txt", None), ("dup.txt", None)])
+        await queue.wait(job_id)
+        return await queue.snapshot(job_id)
+
+    snapshot = asyncio.run(run())
+    assert snapshot["status"] == "completed"
+    assert snapshot["counts"]["done"] == 1 and snapshot["counts"]["failed"] == 1 and snapshot["counts"]["skipped"] == 1
+    failed = [item for item in snapshot["items"] if item["status"] == "failed"]
+    assert "embedding service unavailable" in failed[0]["error"]
+
+
+def test_job_resumes_on_start(tmp_path):
+    db_path = str(tmp_path / "ingest_jobs.db")
+    store = IngestJobStore(db_path)
+    job_id = store.create("kb1", "files", [("a.txt", None), ("b.txt", None), ("c.txt", None)])
+    store.set_status(job_id, "running")
+    store.update_item(job_id, 0, "done", result={"added": ["a.txt"]})
+    # 服务在处理 b.txt 时中断
+    assert store.claim(job_id, 1)
+
+    handled = []
+
+    async def handler(kind, db_id, key, payload):
+        handled.append(key)
+        return {"added": [key], "skipped": []}
+
+    async def run():
+        queue = IngestQueue(IngestJobStore(db_path), handler)
+        # 应用启动时恢复，不依赖之后对队列的访问
+        await queue.start()
+        await queue.wait(job_id)
+        return await queue.snapshot(job_id)
+
+    after = asyncio.run(run())
+    assert sorted(handled) == ["b.txt", "c.txt"]
+    assert after["status"] == "completed" and after["counts"]["done"] == 3
+
+
+def test_cancel_stops_pending_items(tmp_path):
+    release = None
+
+    async def handler(kind, db_id, key, payload):
+        await release.wait()
+        return {"added": [key], "skipped": []}
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        queue = IngestQueue(IngestJobStore(str(tmp_path / "ingest_jobs.db")), handler, concurrency=1)
+        job_id = await queue.submit("kb1", "files", [(f"{i}.txt", None) for i in range(4)])
+        while (await queue.snapshot(job_id))["counts"]["running"] == 0:
+            await asyncio.sleep(0.01)
+        assert await queue.cancel(job_id) == 3
+        release.set()
+        await queue.wait(job_id)
+        assert await queue.cancel("missing") is None
+        return await queue.snapshot(job_id)
+
+    snapshot = asyncio.run(run())
+    assert snapshot["status"] == "cancelled" and snapshot["counts"]["done"] == 1
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+知识库版本号测试（fakeredis）：一个 worker 的变更对其他 worker 可见，Redis 不可用时版本号仍然递增
+需要安装 fakeredis: pip install fakeredis
+"""
+
+import fakeredis
+
+from rag.cache.kb_version import KnowledgeVersions
+
+
+def make_workers(server, count=2):
+    workers = []
+    for _ in range(count):
+        versions = KnowledgeVersions()
+        versions.configure(client=fakeredis.FakeRedis(server=server, decode_responses=True), refresh_interval=0)
+        workers.append(versions)
+    return workers
+
+
+def test_bump_visible_to_other_workers_after_refresh():
+    server = fakeredis.FakeServer()
+    a, b = make_workers(server)
+    assert a.bump("kb1") == 1
+    assert b.get("kb1") == 0
+    assert b.refresh() and b.get("kb1") == 1
+    # 新启动的 worker 直接读到当前版本
+    c, = make_workers(server, 1)
+    assert c.get("kb1") == 1
+
+
+def test_bump_while_redis_is_down_still_changes_version():
+    server = fakeredis.FakeServer()
+    a, b = make_workers(server)
+    a.bump("kb1")
+    server.connected = False
+    assert a.bump("kb1") == 2
+    assert not b.refresh()
+
+    server.connected = True
+    b.bump("kb1")
+    assert a.refresh()
+    # 恢复后其他 worker 的变更仍然使版本号变化
+    assert a.get("kb1") == 3
+
+
+def test_listeners_notified_on_local_bump():
+    versions = KnowledgeVersions()
+    changed = []
+    versions.subscribe(changed.append)
+    versions.bump("kb1")
+    assert changed == ["kb1"] and versions.get("kb1") == 1
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+模型注册表测试：LRU 淘汰不关闭仍在使用的实例，未配置的模型被拒绝
+"""
+
+import pytest
+
+pytest.importorskip("packages")
+
+from packages import config  # noqa: E402
+from rag.utils.model_registry import ModelRegistry  # noqa: E402
+
+
+class FakeModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_eviction_keeps_client_open():
+    registry = ModelRegistry(max_size=1, providers={"fake": lambda model_name: FakeModel(model_name)})
+    first = registry.get("fake", "a")
+    registry.get("fake", "b")
+    assert not first.closed
+    assert registry.get("fake", "a") is not first
+
+
+def test_rejects_unconfigured_models(monkeypatch):
+    monkeypatch.setattr(config, "model_names", {"openai": {"models": ["gpt-4o"]}}, raising=False)
+    registry = ModelRegistry()
+    registry.validate("openai", "gpt-4o")
+    registry.validate("openai", None)
+    with pytest.raises(ValueError):
+        registry.validate("openai", "gpt-x")
+    with pytest.raises(ValueError):
+        registry.get("unknown", "gpt-4o")
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+响应缓存测试：作用域包含影响回答的所有条件
+"""
+
+from rag.cache.response_cache import ResponseCache
+
+MODEL = ("openai", "gpt-4o")
+HISTORY = [{"role": "user", "content": "APT29 的初始访问手法？"}, {"role": "assistant", "content": "鱼叉式钓鱼。"}]
+
+
+def test_scope_depends_on_system_prompt():
+    cache = ResponseCache()
+    analyst = cache.make_scope(MODEL, {"system_prompt": "你是威胁情报分析师"}, HISTORY)
+    assert analyst == cache.make_scope(MODEL, {"system_prompt": "你是威胁情报分析师"}, HISTORY)
+    assert analyst != cache.make_scope(MODEL, {"system_prompt": "只用英文回答"}, HISTORY)
+    assert analyst != cache.make_scope(MODEL, {}, HISTORY)
+
+
+def test_scope_depends_on_history_round():
+    cache = ResponseCache()
+    assert cache.make_scope(MODEL, {"history_round": 1}, HISTORY) != cache.make_scope(MODEL, {"history_round": 5}, HISTORY)
+
+
+def test_web_answers_use_short_ttl():
+    cache = ResponseCache(ttl=3600, web_ttl=300)
+    assert cache.ttl_for({"use_web": True}) == 300 and cache.ttl_for({}) == 3600
+    assert not ResponseCache(web_ttl=0).cacheable({"use_web": True})
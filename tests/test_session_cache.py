@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+会话历史本地缓存测试（fakeredis）：回写与删除互斥、后台回写不计入熔断短路、关闭时写出待写消息
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("packages")
+fakeredis = pytest.importorskip("fakeredis")
+
+from rag.cache.redis_history import RedisHistoryStore  # noqa: E402
+from rag.cache.session_cache import CachedHistoryStore  # noqa: E402
+from rag.utils.circuit_breaker import OPEN, CircuitBreaker  # noqa: E402
+from rag.utils.metrics import metrics  # noqa: E402
+
+TURN = [{"role": "user", "content": "APT29 的初始访问手法？"}, {"role": "assistant", "content": "鱼叉式钓鱼。"}]
+
+
+class SlowStore(RedisHistoryStore):
+    """回写时先等待，模拟管道写入进行中"""
+
+    def __init__(self):
+        super().__init__(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+        self.writing = asyncio.Event()
+
+    async def append_many(self, batches):
+        self.writing.set()
+        await asyncio.sleep(0.05)
+        return await super().append_many(batches)
+
+
+def test_delete_waits_for_inflight_flush():
+    async def run():
+        store = SlowStore()
+        cached = CachedHistoryStore(store, flush_interval_ms=1)
+        await cached.append("t1", TURN)
+        await store.writing.wait()
+        await cached.delete("t1")
+        await cached.close()
+        messages, _ = await store.get_recent_with_version("t1")
+        assert messages == []
+
+    asyncio.run(run())
+
+
+def test_flush_does_not_short_circuit_while_open():
+    async def run():
+        breaker = CircuitBreaker("session-cache-test", failure_threshold=1, reset_timeout=60)
+        breaker.allow()
+        breaker.record_failure()
+        cached = CachedHistoryStore(RedisHistoryStore(client=fakeredis.FakeAsyncRedis(decode_responses=True)),
+                                    flush_interval_ms=1000, breaker=breaker)
+        await cached.append("t1", TURN)
+        before = metrics.snapshot()["counters"].get("circuit_session-cache-test_short_circuited_total", 0)
+        assert not await cached.flush()
+        assert metrics.snapshot()["counters"].get("circuit_session-cache-test_short_circuited_total", 0) == before
+        assert breaker.state == OPEN
+        # 关闭时的最后一次回写不受熔断限制
+        await cached.close()
+        assert (await cached.store.get_recent_with_version("t1"))[0] == TURN
+
+    asyncio.run(run())
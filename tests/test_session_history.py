@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+会话历史迁移测试（fakeredis）
+旧格式会话（RedisSessionManager）在新一轮对话后，历史仍应完整出现在提示词和会话详情中
+需要安装 fakeredis: pip install fakeredis
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("packages")
+fakeredis = pytest.importorskip("fakeredis")
+
+from rag.service import chat_service  # noqa: E402
+from rag.utils.circuit_breaker import CircuitBreaker  # noqa: E402
+
+LEGACY_HISTORY = [
+    {"role": "user", "content": "APT29 最近使用了哪些初始访问手法？"},
+    {"role": "assistant", "content": "主要是鱼叉式钓鱼和针对云租户的密码喷洒。"},
+    {"role": "user", "content": "对应的 ATT&CK 技术编号是？"},
+    {"role": "assistant", "content": "T1566 和 T1110.003。"},
+]
+
+
+class LegacySessions:
+    """旧格式会话管理器：整段历史保存在会话记录中"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    async def get_history(self, thread_id):
+        session = self.sessions.get(thread_id)
+        return list(session["history"]) if session else []
+
+    async def get_session(self, thread_id):
+        session = self.sessions.get(thread_id)
+        return dict(session) if session else None
+
+
+def make_service(cached: bool) -> chat_service.ChatService:
+    service = chat_service.ChatService.__new__(chat_service.ChatService)
+    service.redis_session = LegacySessions({"t1": {"thread_id": "t1", "title": "APT29", "history": LEGACY_HISTORY}})
+    service.redis_breaker = CircuitBreaker("redis-test")
+    service.redis_op_timeout = 1.0
+    service.context_builder = None
+    service.history_store = chat_service.RedisHistoryStore(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+    if cached:
+        service.history_store = chat_service.CachedHistoryStore(service.history_store, flush_interval_ms=1)
+    return service
+
+
+async def legacy_session_then_new_turn(cached: bool):
+    service = make_service(cached)
+    history = await service._load_history("t1", rounds=10)
+    assert history == LEGACY_HISTORY
+
+    new_turn = [{"role": "user", "content": "有哪些检测建议？"}, {"role": "assistant", "content": "监控异常登录失败。"}]
+    await service._save_messages("t1", new_turn)
+    if cached:
+        await service.history_store.flush()
+
+    assert await service._load_history("t1", rounds=10) == LEGACY_HISTORY + new_turn
+    assert await service._load_history("t1", rounds=1) == new_turn
+    session = await service.get_session("t1")
+    assert session["history"] == LEGACY_HISTORY + new_turn
+    page = await service.get_session_history("t1", offset=0, limit=50)
+    assert page["total"] == len(LEGACY_HISTORY) + 2
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_legacy_session_keeps_history_after_new_turn(cached):
+    asyncio.run(legacy_session_then_new_turn(cached))
+
+
+def test_seed_only_once():
+    async def run():
+        store = chat_service.RedisHistoryStore(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+        assert await store.seed("t1", LEGACY_HISTORY)
+        assert not await store.seed("t1", LEGACY_HISTORY)
+        messages, version = await store.get_recent_with_version("t1")
+        assert messages == LEGACY_HISTORY and version == len(LEGACY_HISTORY)
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+桥接器测试：占满名额的模型流不阻塞一次性的阻塞调用
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("packages")
+
+from rag.utils.stream_bridge import StreamBridge  # noqa: E402
+
+
+def test_streams_do_not_starve_calls():
+    release = threading.Event()
+
+    def slow_stream():
+        release.wait(5)
+        yield "done"
+
+    async def run():
+        bridge = StreamBridge(max_workers=2, max_calls=1)
+
+        async def consume():
+            return [item async for item in bridge.iterate(slow_stream)]
+
+        streams = [asyncio.create_task(consume()) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert bridge.active == 2
+        # 两个流占满了流的名额，阻塞调用仍然立即执行
+        assert await asyncio.wait_for(bridge.run(lambda: "ok"), timeout=1) == "ok"
+        release.set()
+        assert await asyncio.gather(*streams) == [["done"], ["done"]]
+
+    asyncio.run(run())